@@ -0,0 +1,96 @@
+"""
+benchmarks of `fetch_data` against the stand-in WDC server in
+`gmdata_webinterface.tests.mock_server`, so offline and repeatable:
+throughput, mean request latency and peak memory across station counts,
+date spans and concurrency settings
+
+run with `python benchmarks/bench_fetch_data.py`,
+or e.g. `python benchmarks/bench_fetch_data.py --latency 0.2 --bandwidth 1e6`
+to look like a slower network
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+from gmdata_webinterface.consume_webservices import fetch_data
+from gmdata_webinterface.instrument import MetricsAggregator
+from gmdata_webinterface.tests.mock_server import MockWDCServer
+
+STATIONS = ['ESK', 'LER', 'HAD', 'NGK', 'ABK', 'BOU', 'FRD', 'KAK']
+STATION_COUNTS = [1, 4, 8]
+# months of minute data, from 2015-01
+SPANS = [1, 6, 12]
+# (max_workers, stream)
+SETTINGS = [(1, False), (4, False), (4, True)]
+REPEAT = 3
+LATENCY = 0.05
+BANDWIDTH = 20e6
+
+
+def run(server, n_stations, months, max_workers, stream, observer=None):
+    """fetch `months` of minute data for `n_stations`, in seconds taken"""
+    with tempfile.TemporaryDirectory() as saveroot:
+        started = time.perf_counter()
+        fetch_data(
+            start_date=date(2015, 1, 1), end_date=date(2015, months, 28),
+            station_list=STATIONS[:n_stations], cadence='minute',
+            service='WDC', saveroot=saveroot,
+            configpath=server.write_config(saveroot),
+            max_workers=max_workers, stream=stream, observer=observer
+        )
+        return time.perf_counter() - started
+
+
+def measure(server, n_stations, months, max_workers, stream, repeat=REPEAT):
+    """best seconds, MB/s and mean request seconds over `repeat` runs,
+    then the peak MB allocated in one more"""
+    best = None
+    for _ in range(repeat):
+        metrics = MetricsAggregator()
+        sent = server.bytes_sent
+        seconds = run(server, n_stations, months, max_workers, stream,
+                      observer=metrics)
+        if best is None or seconds < best[0]:
+            request = metrics.stages['request']
+            best = (seconds, (server.bytes_sent - sent) / seconds / 1e6,
+                    request['seconds'] / request['count'])
+    tracemalloc.start()
+    try:
+        run(server, n_stations, months, max_workers, stream)
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+    return best + (peak,)
+
+
+def main(latency=LATENCY, bandwidth=BANDWIDTH, repeat=REPEAT):
+    """print the timings of each setting for each station count and span"""
+    print('server: {}s latency, {:.1f}MB/s per response'.format(
+        latency, bandwidth / 1e6))
+    print('{:>8} {:>6} {:>7} {:>6} {:>9} {:>9} {:>11} {:>9}'.format(
+        'stations', 'months', 'workers', 'stream', 'seconds', 'MB/s',
+        'latency', 'peak MB'))
+    with MockWDCServer(latency=latency, bandwidth=bandwidth) as server:
+        for n_stations in STATION_COUNTS:
+            for months in SPANS:
+                for max_workers, stream in SETTINGS:
+                    seconds, rate, mean, peak = measure(
+                        server, n_stations, months, max_workers, stream,
+                        repeat=repeat)
+                    print('{:>8} {:>6} {:>7} {:>6} {:>8.3f}s {:>9.2f} '
+                          '{:>9.1f}ms {:>9.2f}'.format(
+                              n_stations, months, max_workers, str(stream),
+                              seconds, rate, mean * 1e3, peak))
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    PARSER.add_argument('--latency', type=float, default=LATENCY,
+                        help='seconds before each response')
+    PARSER.add_argument('--bandwidth', type=float, default=BANDWIDTH,
+                        help='bytes per second of each response')
+    PARSER.add_argument('--repeat', type=int, default=REPEAT)
+    ARGS = PARSER.parse_args()
+    main(ARGS.latency, ARGS.bandwidth, ARGS.repeat)
@@ -0,0 +1,66 @@
+"""
+import-time benchmark: how long importing each entry point of the package
+takes, from `python -X importtime` in a fresh interpreter, held to a
+budget so that a heavy dependency imported eagerly again shows up
+
+run with `python benchmarks/bench_import_time.py`, from the source
+directory; exits with status 1 if any module is over budget.
+`-X importtime` needs python 3.7.
+"""
+import argparse
+import subprocess
+import sys
+
+MODULES = [
+    'gmdata_webinterface.consume_webservices',
+    'gmdata_webinterface.cache',
+    'gmdata_webinterface.planner',
+    'gmdata_webinterface.cli',
+]
+# milliseconds, cumulative, best of `REPEAT`. Generous: each takes about
+#   20 ms here, where consume_webservices took about 93 ms when requests,
+#   zipfile and the rest were imported with it, so only a slow machine or
+#   a dependency imported eagerly again should go over.
+BUDGET_MS = 60.0
+REPEAT = 5
+
+
+def import_time(module):
+    """cumulative seconds `import module` takes in a fresh interpreter"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True
+    ).stderr
+    # lines of 'import time: <self us> | <cumulative us> | <module>'
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1e6
+    raise ValueError('no import time reported for {}'.format(module))
+
+
+def main(budget_ms=BUDGET_MS, repeat=REPEAT):
+    """
+    print the best import time of each module against `budget_ms`
+
+    Returns
+    -------
+    int how many modules are over budget
+    """
+    print('{:<42} {:>9} {:>9}'.format('module', 'best', 'budget'))
+    over = 0
+    for module in MODULES:
+        best = min(import_time(module) for _ in range(repeat)) * 1e3
+        over += best > budget_ms
+        print('{:<42} {:>7.1f}ms {:>7.1f}ms{}'.format(
+            module, best, budget_ms, '  OVER' if best > budget_ms else ''))
+    return over
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    PARSER.add_argument('--budget', type=float, default=BUDGET_MS,
+                        help='milliseconds each import may take')
+    PARSER.add_argument('--repeat', type=int, default=REPEAT)
+    ARGS = PARSER.parse_args()
+    sys.exit(1 if main(ARGS.budget, ARGS.repeat) else 0)
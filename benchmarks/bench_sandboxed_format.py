@@ -0,0 +1,50 @@
+"""
+microbenchmarks of `sandboxed_format`: the compiled `SafeTemplate`
+against parsing the format string with a fresh `SafeFormatter` each time
+
+run with `python benchmarks/bench_sandboxed_format.py`
+"""
+import timeit
+
+from gmdata_webinterface.sandboxed_format import (
+    SafeFormatter, MagicFormatMapping, get_template, safe_format
+)
+
+CASES = [
+    # as in the per-month loop of `FormData.set_datasets`
+    ('dataset name', '/wdc/datasets/{}/{}{}{:02d}',
+     ('minute', 'esk', 2015, 3)),
+    ('error message', 'failed to fetch {} chunk(s) of data for {}:\n{}',
+     (2, 'ESK', 'boom')),
+    ('named fields', '{station}-{year}', ()),
+]
+NUMBER = 100000
+
+
+def uncompiled(fmt, *args, **kwargs):
+    """formatting as it was: a new formatter parsing `fmt` every call"""
+    return SafeFormatter().vformat(fmt, args,
+                                   MagicFormatMapping(args, kwargs))
+
+
+def main(number=NUMBER):
+    """print the time per call of each way of formatting each case"""
+    print('{:<14} {:>12} {:>12} {:>12} {:>8}'.format(
+        'case', 'uncompiled', 'safe_format', 'template', 'speedup'))
+    for name, fmt, args in CASES:
+        kwargs = {} if args else {'station': 'ESK', 'year': 2015}
+        template = get_template(fmt)
+        timings = [
+            min(timeit.repeat(lambda: func(*args, **kwargs), number=number,
+                              repeat=3)) / number * 1e6
+            for func in (lambda *a, **k: uncompiled(fmt, *a, **k),
+                         lambda *a, **k: safe_format(fmt, *a, **k),
+                         template.render)
+        ]
+        print('{:<14} {:>10.2f}us {:>10.2f}us {:>10.2f}us {:>7.1f}x'.format(
+            name, timings[0], timings[1], timings[2],
+            timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+archive module
+
+An index of the data files downloaded by `fetch_data`, so that a time
+window can be read for a station without globbing for file names.
+
+A JSON manifest alongside the data maps each station, cadence and period
+(e.g. 'ESK/minute/201501') to the file holding it, its size, and the
+times of its first and last samples. `ArchiveIndex.query` then opens
+only the files covering the window asked for.
+
+Files can be indexed as they are downloaded, by passing the index as the
+`convert` stage of `fetch_data`, or afterwards with `ArchiveIndex.scan`.
+
+Needs NumPy: `pip install gmdata_webinterface[readers]`
+
+@author: W. Brown
+"""
+import glob
+import os
+import threading
+
+import numpy as np
+
+from gmdata_webinterface.jsonfile import load_json, save_json
+from gmdata_webinterface.readers import (
+    GeomagData, MappedIAGA2002, TEXT_READERS, concatenate, read_npz
+)
+from gmdata_webinterface.sandboxed_format import safe_format
+
+INDEX_NAME = '.gmdata_index.json'
+# file name extensions we index, most preferred first where
+#   a period is held in more than one format
+INDEXED_EXTENSIONS = ['.npz', '.min', '.wdc']
+
+
+class ArchiveIndex(object):
+    """
+    Which periods of which stations' data do we hold under `root`?
+
+    Safe to share between the threads of a concurrent `fetch_data`.
+
+    Parameters
+    ----------
+    root: file path as string
+        directory the data are downloaded to,
+        i.e. the `saveroot` of `fetch_data`. The index lives here.
+
+    Attributes
+    ----------
+    index_path: file path as string
+        where the index is saved
+
+    Example
+    -------
+    >>> index = ArchiveIndex(saveroot)
+    >>> fetch_data(..., saveroot=saveroot, convert=index)
+    >>> index.query('ESK', '2015-01-31T12:00', '2015-02-01T12:00', ['X'])
+    """
+    def __init__(self, root):
+        """ see class docstring """
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self._lock = threading.RLock()
+        self._entries = load_json(self.index_path)
+
+    def __repr__(self):
+        return safe_format('{}({})', self.__class__.__name__, repr(self.root))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __call__(self, files):
+        """
+        index `files` as a `convert` stage of `fetch_data`,
+        passing them on unchanged
+        """
+        self.add(files)
+        return files
+
+    @property
+    def stations(self):
+        """sorted list of the IAGA codes of every station indexed"""
+        with self._lock:
+            return sorted({key.split('/')[0] for key in self._entries})
+
+    def entries(self, station=None, cadence=None):
+        """
+        The index entries, sorted by key e.g. 'ESK/minute/201501',
+        optionally of only one `station` and/or `cadence`
+
+        Returns
+        -------
+        list of dict, with keys 'key', 'path', 'bytes', 'first', 'last'
+            (ISO format times of the first and last samples)
+            and 'components'
+        """
+        with self._lock:
+            return [
+                dict(entry, key=key, path=os.path.join(self.root,
+                                                       entry['path']))
+                for key, entry in sorted(self._entries.items())
+                if _matches(key, station, cadence)
+            ]
+
+    def add(self, files):
+        """
+        Index `files` (paths) of the formats we can read; others,
+        e.g. READMEs, are passed over.
+
+        A period held in more than one format is read from the first
+        of `INDEXED_EXTENSIONS`.
+        """
+        with self._lock:
+            for path in files:
+                ext = os.path.splitext(path)[1].lower()
+                if ext not in INDEXED_EXTENSIONS:
+                    continue
+                key, entry = _describe(path)
+                entry['path'] = os.path.relpath(path, self.root)
+                held = self._entries.get(key)
+                if held is None or not self._prefer(held, entry):
+                    self._entries[key] = entry
+            save_json(self.index_path, self._entries)
+
+    def scan(self, pattern='*'):
+        """
+        Index every file under `root` whose name matches `pattern`,
+        forgetting any indexed files since deleted
+        """
+        with self._lock:
+            self._entries = {
+                key: entry for key, entry in self._entries.items()
+                if os.path.isfile(os.path.join(self.root, entry['path']))
+            }
+            self.add(sorted(glob.glob(os.path.join(self.root, pattern))))
+
+    def query(self, station, start=None, end=None, components=None,
+              cadence=None):
+        """
+        Read the samples of `station` at or after `start` and before
+        `end`, opening only the files covering that time
+
+        Parameters
+        ----------
+        station: string
+            IAGA code e.g. 'ESK'
+        start, end: `datetime.datetime`, `numpy.datetime64`, string,
+            or (default) `None` for no limit
+        components: list of string or (default) `None` for all
+        cadence: string or (default) `None`
+            'minute' or 'hour'; may be left out if we hold only one
+            cadence for `station`
+
+        Returns
+        -------
+        `readers.GeomagData`, sorted by time
+
+        Raises
+        ------
+        KeyError if we hold no data for `station` (and `cadence`)
+            or it lacks any of `components`
+        ValueError if `cadence` is left out and we hold both
+        """
+        station = station.upper()
+        entries = self.entries(station, cadence)
+        if not entries:
+            raise KeyError(safe_format('{} {}', station, cadence or ''))
+        cadences = sorted({entry['key'].split('/')[1] for entry in entries})
+        if len(cadences) > 1:
+            raise ValueError(safe_format(
+                'say which cadence of {} to read, from {}', station, cadences
+            ))
+        start = None if start is None else np.datetime64(start, 'ms')
+        end = None if end is None else np.datetime64(end, 'ms')
+        wanted = [
+            entry for entry in entries
+            if (start is None or np.datetime64(entry['last'], 'ms') >= start)
+            and (end is None or np.datetime64(entry['first'], 'ms') < end)
+        ] or entries[:1]
+        return concatenate([
+            _read_window(entry['path'], start, end, components)
+            for entry in wanted
+        ])
+
+    def _prefer(self, held, entry):
+        """keep the file `held` for a period, rather than that of `entry`?"""
+        return held['path'] != entry['path'] and \
+            os.path.isfile(os.path.join(self.root, held['path'])) and \
+            _preference(held['path']) < _preference(entry['path'])
+
+
+def _matches(key, station, cadence):
+    """is the index `key` of `station` and `cadence`, where given?"""
+    key_station, key_cadence, _ = key.split('/')
+    return (station is None or key_station == station.upper()) and \
+        (cadence is None or key_cadence == cadence)
+
+
+def _preference(path):
+    """rank of the format of `path` in `INDEXED_EXTENSIONS`"""
+    return INDEXED_EXTENSIONS.index(os.path.splitext(path)[1].lower())
+
+
+def _describe(path):
+    """
+    the index key e.g. 'ESK/minute/201501' and the entry for a data file
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.min':
+        with MappedIAGA2002(path) as mapped:
+            metadata, components = mapped.metadata, mapped.components
+            first, last = mapped.start, mapped.end - mapped.interval
+            interval = mapped.interval
+    else:
+        data = read_npz(path) if ext == '.npz' else TEXT_READERS[ext](path)
+        metadata, components = data.metadata, data.components
+        first, last = data.times[0], data.times[-1]
+        interval = data.times[1] - first if len(data) > 1 else None
+    if np.isnat(first):
+        raise ValueError(safe_format('no samples in {}', path))
+    code = metadata.get('iaga_code') or os.path.basename(path)[:3]
+    if interval is None:
+        hourly = ext == '.wdc'
+    else:
+        hourly = interval >= np.timedelta64(1, 'h')
+    first = str(first.astype('datetime64[ms]'))
+    period = first[:4] if hourly else first[:4] + first[5:7]
+    entry = {
+        'bytes': os.path.getsize(path),
+        'first': first,
+        'last': str(last.astype('datetime64[ms]')),
+        'components': list(components),
+    }
+    key = '/'.join([code.upper(), 'hour' if hourly else 'minute', period])
+    return key, entry
+
+
+def _read_window(path, start, end, components):
+    """
+    the samples of the file at `path` at or after `start` and before `end`
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.min':
+        with MappedIAGA2002(path) as mapped:
+            return mapped.read(start, end, components)
+    data = read_npz(path) if ext == '.npz' else TEXT_READERS[ext](path)
+    wanted = np.ones(len(data), dtype=bool)
+    if start is not None:
+        wanted &= data.times >= start
+    if end is not None:
+        wanted &= data.times < end
+    if components is None:
+        components = data.components
+    columns = [data.components.index(component) if component in
+               data.components else _missing(component)
+               for component in components]
+    return GeomagData(data.times[wanted], data.values[wanted][:, columns],
+                      components, data.metadata)
+
+
+def _missing(component):
+    """raise KeyError for a `component` a file does not hold"""
+    raise KeyError(component)
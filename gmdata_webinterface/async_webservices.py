@@ -0,0 +1,319 @@
+"""
+async_webservices module
+
+An asyncio version of `consume_webservices.fetch_data`, for use from
+within an event loop without tying up a thread per request.
+
+Requests are sent with an `aiohttp.ClientSession`; the archives returned
+are unpacked in an executor so the event loop is never blocked on disk
+or decompression. The request is built from the same `ParsedConfigFile`
+and `FormData` as the blocking API.
+
+Needs aiohttp: `pip install gmdata_webinterface[async]`
+
+@author: W. Brown
+"""
+import asyncio
+from collections import namedtuple
+
+from gmdata_webinterface.consume_webservices import (
+    ChunkError, DataRequest, FetchError, FetchResult, FormData,
+    check_response, load_config, check_status, drop_cached
+)
+from gmdata_webinterface.extract import Extractor
+from gmdata_webinterface.instrument import Event, Stage
+from gmdata_webinterface.sandboxed_format import safe_format
+from gmdata_webinterface.transport import RetryPolicy
+
+DEFAULT_CONCURRENCY = 4
+
+# the parts of an HTTP response we keep once its body has been read
+AsyncResponse = namedtuple('AsyncResponse', ['status_code', 'content'])
+
+
+class AsyncDataRequest(DataRequest):
+    """
+    A `DataRequest` which can also be sent with an asyncio HTTP client,
+    by `send_async`. Built and populated exactly as `DataRequest`.
+    """
+    async def send_async(self, session):
+        """
+        Send a populated AsyncDataRequest and read the response,
+        as `DataRequest.send` does without blocking
+
+        Parameters
+        ----------
+        session: `aiohttp.ClientSession`
+            HTTP session to send the request with
+
+        Returns
+        -------
+        `AsyncResponse` with the `status_code` and body `content`
+
+        Raises
+        ------
+        InvalidRequest if we've not been fully populated
+
+        InvalidResponse if the server returns an error, with any
+            'Retry-After' it sent
+        """
+        if not self.can_send:
+            self._error_with_message()
+        async with session.post(self.url, data=self.form_data,
+                                headers=self.headers) as response:
+            check_status(response.status, response.headers)
+            content = await response.read()
+            return AsyncResponse(response.status, content)
+
+
+async def async_fetch_data(*, start_date, end_date, station_list, cadence,
+                           service, saveroot, configpath=None,
+                           max_concurrency=DEFAULT_CONCURRENCY, session=None,
+                           max_datasets=None, max_bytes=None,
+                           chunk_concurrency=DEFAULT_CONCURRENCY, cache=None,
+                           extract=None, convert=None, observer=None,
+                           retry=None):
+    """
+    Fetch data for every station in `station_list` concurrently,
+    as `consume_webservices.fetch_data` does from a thread pool
+
+    Parameters
+    ----------
+    max_concurrency: int, default `DEFAULT_CONCURRENCY`
+        most stations fetched at the same time
+    session: `aiohttp.ClientSession` or (default) `None`
+        HTTP session shared by every station's request. By default we
+        make one, with a connection pool of
+        `max_concurrency * chunk_concurrency`, and close it when we are
+        done.
+    chunk_concurrency: int, default `DEFAULT_CONCURRENCY`
+        most chunks of each station fetched at the same time,
+        see `async_fetch_station_data`
+    start_date, end_date, station_list, cadence, service, saveroot,
+    configpath, max_datasets, max_bytes, cache, extract, convert, observer,
+    retry:
+        as for `consume_webservices.fetch_data`; `retry.sleep` is not
+        used, we wait with `asyncio.sleep` instead. The aiohttp and
+        asyncio errors of `async_retry_errors()` are retried too.
+
+    Returns
+    -------
+    `dict` of `FetchResult`, keyed on station code
+
+    Raises
+    ------
+    ValueError if `max_concurrency` or `chunk_concurrency` is less than 1
+
+    ImportError if we must make a session and aiohttp is not installed
+
+    FetchError if fetching any station failed. Stations are not
+        abandoned when another fails; the error carries the
+        `FetchResult` for every station.
+    """
+    if max_concurrency < 1:
+        raise ValueError(safe_format('max_concurrency must be >= 1, not {}',
+                                     max_concurrency))
+    if chunk_concurrency < 1:
+        raise ValueError(safe_format(
+            'chunk_concurrency must be >= 1, not {}', chunk_concurrency
+        ))
+    if isinstance(station_list, str):
+        station_list = station_list.split()
+    if session is None:
+        async with _make_session(max_concurrency * chunk_concurrency) \
+                as own_session:
+            return await async_fetch_data(
+                start_date=start_date, end_date=end_date,
+                station_list=station_list, cadence=cadence, service=service,
+                saveroot=saveroot, configpath=configpath,
+                max_concurrency=max_concurrency, session=own_session,
+                max_datasets=max_datasets, max_bytes=max_bytes,
+                chunk_concurrency=chunk_concurrency, cache=cache,
+                extract=extract, convert=convert, observer=observer,
+                retry=retry
+            )
+
+    with Stage(observer, 'config', None):
+        config = load_config(configpath, service)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_bounded(station):
+        """wait for a free slot, then fetch `station`"""
+        async with semaphore:
+            try:
+                return await async_fetch_station_data(
+                    start_date=start_date, end_date=end_date,
+                    station=station, cadence=cadence, service=service,
+                    saveroot=saveroot, config=config,
+                    session=session, max_datasets=max_datasets,
+                    max_bytes=max_bytes, chunk_concurrency=chunk_concurrency,
+                    cache=cache, extract=extract, convert=convert,
+                    observer=observer, retry=retry
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                # reported once every station has been tried
+                return FetchResult.failed(station, err)
+
+    results = await asyncio.gather(*[
+        fetch_bounded(station) for station in station_list
+    ])
+    results = dict(zip(station_list, results))
+    if not all(result.ok for result in results.values()):
+        raise FetchError(results)
+    return results
+
+
+async def async_fetch_station_data(*, start_date, end_date, station, cadence,
+                                   service, saveroot, session,
+                                   configpath=None, config=None,
+                                   max_datasets=None, max_bytes=None,
+                                   chunk_concurrency=DEFAULT_CONCURRENCY,
+                                   cache=None, extract=None, convert=None,
+                                   observer=None, retry=None):
+    """
+    Fetch one station's data, as `consume_webservices.fetch_station_data`.
+    The chunks of a split request are fetched concurrently.
+
+    Parameters
+    ----------
+    session: `aiohttp.ClientSession`
+        HTTP session to send the request(s) with
+    chunk_concurrency: int, default `DEFAULT_CONCURRENCY`
+        most chunks fetched at the same time
+    start_date, end_date, station, cadence, service, saveroot, configpath,
+    config, max_datasets, max_bytes, cache, extract, convert, observer,
+    retry:
+        as for `consume_webservices.fetch_station_data`; we wait between
+        attempts with `asyncio.sleep`, and retry the errors of
+        `async_retry_errors()` too
+
+    Returns
+    -------
+    `FetchResult` listing the files extracted to `saveroot`,
+        including any already held by `cache`, and how many `retries`
+        it took
+
+    Raises
+    ------
+    As `consume_webservices.fetch_station_data`
+    """
+    if config is None:
+        with Stage(observer, 'config', station):
+            config = load_config(configpath, service)
+    if extract is None:
+        extract = Extractor()
+    if retry is None:
+        # try each request just the once
+        retry = RetryPolicy(max_attempts=1)
+    retry = retry.with_errors(*async_retry_errors())
+
+    with Stage(observer, 'form', station):
+        form_data = FormData(config)
+        form_data.set_datasets(start_date, end_date, station, cadence,
+                               service)
+    cached_files = drop_cached(form_data, cache)
+    if not form_data.datasets:
+        return FetchResult(station, cached_files)
+
+    # the running loop; `get_running_loop` would need Python 3.7
+    loop = asyncio.get_event_loop()
+    retried = []
+
+    def unpack(datasets, response):
+        """check, extract and convert a response; run in the executor"""
+        with Stage(observer, 'validate', station, datasets):
+            fzip = check_response(response.status_code, response.content)
+        with fzip, Stage(observer, 'extract', station, datasets):
+            files = extract(fzip, saveroot)
+        if convert is not None:
+            with Stage(observer, 'convert', station, datasets):
+                files = convert(files)
+        if cache is not None:
+            cache.record(datasets, files, form_data.file_format)
+        return files
+
+    async def attempt(chunk, datasets):
+        """request and unpack the datasets of one chunk, once"""
+        request = AsyncDataRequest()
+        request.read_attributes(config)
+        request.set_form_data(chunk.as_dict())
+        with Stage(observer, 'request', station, datasets) as timing:
+            response = await request.send_async(session)
+            timing.nbytes = len(response.content)
+        return await loop.run_in_executor(None, unpack, datasets, response)
+
+    async def fetch_chunk(chunk):
+        """request and unpack one chunk, retrying as `retry` allows"""
+        datasets = chunk.datasets.split(',')
+        tries = 1
+        while True:
+            try:
+                return await attempt(chunk, datasets)
+            except Exception as err:  # pylint: disable=broad-except
+                delay = retry.retry_delay(tries, err)
+                if delay is None:
+                    raise
+                retried.append(err)
+                if observer is not None:
+                    observer(Event('retry', station, datasets, delay, None,
+                                   err))
+                await asyncio.sleep(delay)
+                tries += 1
+
+    chunks = form_data.split(max_datasets=max_datasets, max_bytes=max_bytes)
+    if len(chunks) == 1:
+        files = await fetch_chunk(chunks[0])
+        return FetchResult(station, cached_files + files,
+                           retries=len(retried))
+    semaphore = asyncio.Semaphore(chunk_concurrency)
+
+    async def fetch_bounded(chunk):
+        """wait for a free slot, then fetch `chunk`"""
+        async with semaphore:
+            return await fetch_chunk(chunk)
+
+    outcomes = await asyncio.gather(
+        *[fetch_bounded(chunk) for chunk in chunks], return_exceptions=True
+    )
+    files = list(cached_files)
+    errors = {}
+    for chunk, outcome in zip(chunks, outcomes):
+        if isinstance(outcome, Exception):
+            errors[chunk.datasets] = outcome
+        else:
+            files.extend(outcome)
+    result = FetchResult(station, files, retries=len(retried))
+    if errors:
+        raise ChunkError(result, errors)
+    return result
+
+
+def async_retry_errors():
+    """
+    The aiohttp and asyncio counterparts of `transport.RETRY_ERRORS`:
+    failures to connect, or to receive the whole response, in time
+
+    Returns
+    -------
+    tuple of Exception types, for `RetryPolicy.with_errors`
+    """
+    try:
+        import aiohttp  # pylint: disable=import-error
+    except ImportError:  # the session is not aiohttp's
+        return (asyncio.TimeoutError,)
+    return (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+            asyncio.TimeoutError)
+
+
+def _make_session(pool_size):
+    """
+    an `aiohttp.ClientSession` with at most `pool_size` connections open
+    """
+    try:
+        import aiohttp  # pylint: disable=import-error
+    except ImportError:
+        raise ImportError('the async API needs aiohttp: '
+                          'pip install gmdata_webinterface[async]')
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size)
+    )
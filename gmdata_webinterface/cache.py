@@ -0,0 +1,228 @@
+"""
+cache module
+
+An on-disk record of the datasets already downloaded by `fetch_data`,
+so that repeat runs only request the datasets that are missing.
+
+Datasets are keyed as in `FormData.set_datasets`, e.g.
+'/wdc/datasets/minute/esk201501', i.e. on service, cadence, station and
+period, and on the file format they were fetched in, so the same
+dataset held as IAGA-2002 and as WDC format are two entries (see
+`cache_key`). A JSON manifest alongside the data records which files each
+dataset unpacked to, their size, and when they were fetched and last used.
+
+Definitive data almost never change, so by default they are kept
+forever. Recent periods, which may still be provisional, are re-fetched
+once they are older than `provisional_ttl`.
+
+@author: W. Brown
+"""
+import calendar
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from gmdata_webinterface.consume_webservices import parse_dataset
+from gmdata_webinterface.jsonfile import load_json, save_json
+from gmdata_webinterface.sandboxed_format import safe_format
+
+MANIFEST_NAME = '.gmdata_cache.json'
+# periods which ended longer ago than this are treated as definitive
+DEFINITIVE_AFTER = timedelta(days=548)
+PROVISIONAL_TTL = timedelta(days=1)
+
+
+def period_end(dataset):
+    """
+    The last day covered by `dataset`,
+    e.g. 2015-01-31 for '/wdc/datasets/minute/esk201501'
+    """
+    parsed = parse_dataset(dataset)
+    if parsed.month is None:
+        return date(parsed.year, 12, 31)
+    _, last_day = calendar.monthrange(parsed.year, parsed.month)
+    return date(parsed.year, parsed.month, last_day)
+
+
+def cache_key(dataset, file_format=None):
+    """
+    The manifest key of `dataset` fetched in `file_format`, e.g.
+    '/wdc/datasets/minute/esk201501.iaga2002'; just `dataset`
+    if the format is not given
+    """
+    if file_format is None:
+        return dataset
+    return safe_format('{}.{}', dataset, file_format)
+
+
+class DatasetCache(object):
+    """
+    Which datasets do we already hold under `root`?
+
+    Safe to share between the threads of a concurrent `fetch_data`.
+    Each method taking datasets also takes the `file_format` they are
+    wanted in, e.g. 'iaga2002' (see `FormData.file_format`).
+
+    Parameters
+    ----------
+    root: file path as string
+        directory the data are downloaded to,
+        i.e. the `saveroot` of `fetch_data`. The manifest lives here.
+    max_bytes: int or (default) `None`
+        once the cached files total more than this, the least recently
+        used datasets are deleted. `None` for no limit.
+    provisional_ttl: `datetime.timedelta` or `None`
+        how long provisional datasets are trusted before being
+        fetched again. `None` to keep them forever.
+    definitive_ttl: `datetime.timedelta` or (default) `None`
+        as `provisional_ttl`, for definitive datasets
+    definitive_after: `datetime.timedelta`
+        datasets for periods which ended longer ago than this
+        are treated as definitive
+    clock: callable, default `time.time`
+        returns the current time in seconds since the epoch
+
+    Attributes
+    ----------
+    manifest_path: file path as string
+        where we record what is cached
+    """
+    def __init__(self, root, max_bytes=None, provisional_ttl=PROVISIONAL_TTL,
+                 definitive_ttl=None, definitive_after=DEFINITIVE_AFTER,
+                 clock=time.time):
+        """ see class docstring """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.provisional_ttl = provisional_ttl
+        self.definitive_ttl = definitive_ttl
+        self.definitive_after = definitive_after
+        self.clock = clock
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self._lock = threading.RLock()
+        self._entries = load_json(self.manifest_path)
+
+    def __repr__(self):
+        return safe_format('{}({}, max_bytes={})', self.__class__.__name__,
+                           repr(self.root), repr(self.max_bytes))
+
+    def __contains__(self, dataset):
+        return self.is_fresh(dataset)
+
+    @property
+    def datasets(self):
+        """sorted list of every dataset in the manifest, see `cache_key`"""
+        with self._lock:
+            return sorted(self._entries)
+
+    @property
+    def total_bytes(self):
+        """total size of the files of every cached dataset"""
+        with self._lock:
+            return sum(entry['bytes'] for entry in self._entries.values())
+
+    def is_definitive(self, dataset):
+        """has the period of `dataset` ended long enough ago to be final?"""
+        today = date.fromtimestamp(self.clock())
+        return period_end(dataset) + self.definitive_after < today
+
+    def is_fresh(self, dataset, file_format=None):
+        """
+        do we hold every file of `dataset` in `file_format`,
+        fetched recently enough to trust?
+        """
+        with self._lock:
+            entry = self._entries.get(cache_key(dataset, file_format))
+            if entry is None:
+                return False
+            if not all(os.path.isfile(path)
+                       for path in self._paths(entry)):
+                return False
+            ttl = self.definitive_ttl if self.is_definitive(dataset) \
+                else self.provisional_ttl
+            if ttl is None:
+                return True
+            return self.clock() - entry['fetched'] < ttl.total_seconds()
+
+    def missing(self, datasets, file_format=None):
+        """
+        Which of `datasets` must be fetched in `file_format`?
+        Those we do hold are marked as used, for the LRU eviction
+
+        Returns
+        -------
+        list of datasets not freshly cached, in the order given
+        """
+        with self._lock:
+            now = self.clock()
+            missing = []
+            for dataset in datasets:
+                if self.is_fresh(dataset, file_format):
+                    key = cache_key(dataset, file_format)
+                    self._entries[key]['last_used'] = now
+                else:
+                    missing.append(dataset)
+            save_json(self.manifest_path, self._entries)
+            return missing
+
+    def files_for(self, datasets, file_format=None):
+        """list of paths to the cached files of `datasets` in `file_format`"""
+        with self._lock:
+            keys = [cache_key(dataset, file_format) for dataset in datasets]
+            return [path for key in keys if key in self._entries
+                    for path in self._paths(self._entries[key])]
+
+    def record(self, datasets, files, file_format=None):
+        """
+        Record that `files` were fetched for `datasets`, in `file_format`.
+        Each file belongs to the dataset whose station and period
+        start its name, e.g. 'esk201501dmin.min' to
+        '/wdc/datasets/minute/esk201501'. Others, e.g. READMEs,
+        are not cached.
+
+        Evicts least recently used datasets if we are then over
+        `max_bytes`.
+        """
+        with self._lock:
+            now = self.clock()
+            for dataset in datasets:
+                prefix = dataset.rsplit('/', 1)[-1]
+                owned = [
+                    file_ for file_ in files
+                    if os.path.basename(file_).lower().startswith(prefix)
+                ]
+                if not owned:
+                    continue
+                self._entries[cache_key(dataset, file_format)] = {
+                    'files': [os.path.relpath(file_, self.root)
+                              for file_ in owned],
+                    'bytes': sum(os.path.getsize(file_) for file_ in owned),
+                    'fetched': now,
+                    'last_used': now,
+                }
+            self._evict(keep={cache_key(dataset, file_format)
+                              for dataset in datasets})
+            save_json(self.manifest_path, self._entries)
+
+    def _evict(self, keep=()):
+        """
+        delete least recently used datasets until we are within
+        `max_bytes`, sparing any in `keep` if we can
+        """
+        if self.max_bytes is None:
+            return
+        by_age = sorted(
+            self._entries,
+            key=lambda dset: (dset in keep, self._entries[dset]['last_used'])
+        )
+        for dataset in by_age:
+            if self.total_bytes <= self.max_bytes:
+                break
+            entry = self._entries.pop(dataset)
+            for path in self._paths(entry):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def _paths(self, entry):
+        """full paths to the files of a manifest `entry`"""
+        return [os.path.join(self.root, file_) for file_ in entry['files']]
@@ -0,0 +1,398 @@
+"""
+cli module
+
+The `gmdata-fetch` command. Fetch data for stations named on the
+command line, e.g.
+
+    gmdata-fetch ESK LER --start 2015-01-01 --end 2015-12-31 \\
+        --cadence minute --saveroot /tmp/data
+
+or for every job in a batch manifest, several at once:
+
+    gmdata-fetch --manifest jobs.csv --saveroot /tmp/data --workers 4 \\
+        --cache --summary results.json
+
+A manifest is a CSV file with a header row, a JSON list of objects or
+(with PyYAML installed) a YAML list of mappings, each job having the
+fields 'station' (one or more codes, space separated), 'start', 'end'
+(YYYY-MM-DD) and optionally 'cadence' (default 'minute'), 'format'
+('iaga2002' or 'wdc', by default as configured) and 'service'
+(default 'WDC'):
+
+    station,start,end,cadence,format
+    ESK,2015-01-01,2015-12-31,minute,iaga2002
+    NGK LER,2010-01-01,2015-12-31,hour,wdc
+
+With `--dry-run` the plan of each job (see `planner`) is printed and
+nothing is sent; otherwise the same plans are executed.
+
+Only the standard library is imported until a job is planned, so that
+`gmdata-fetch --help` and bad arguments are answered quickly.
+
+@author: W. Brown
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from gmdata_webinterface.sandboxed_format import safe_format
+
+MANIFEST_FIELDS = ['station', 'start', 'end', 'cadence', 'format', 'service']
+JOB_DEFAULTS = {'cadence': 'minute', 'format': None, 'service': 'WDC'}
+
+
+class ManifestError(ValueError):
+    """A batch manifest cannot be read"""
+    pass
+
+
+def read_manifest(path):
+    """
+    The jobs listed in the manifest at `path`, a '.csv', '.json' or
+    '.yaml'/'.yml' file, see the module docstring
+
+    Returns
+    -------
+    list of `dict` with keys `MANIFEST_FIELDS`; 'station' a list
+        of station codes, 'start' and 'end' `datetime.date`
+
+    Raises
+    ------
+    ManifestError if the manifest cannot be read, or a job lacks
+        a required field or has one of the wrong type
+
+    ImportError if it is YAML, and PyYAML is not installed
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path) as file_:
+        if extension == '.csv':
+            rows = list(csv.DictReader(
+                line for line in file_ if not line.lstrip().startswith('#')
+            ))
+        elif extension == '.json':
+            rows = json.load(file_)
+        elif extension in ('.yaml', '.yml'):
+            try:
+                import yaml  # pylint: disable=import-error
+            except ImportError:
+                raise ImportError('reading a YAML manifest needs PyYAML: '
+                                  'pip install gmdata_webinterface[yaml]')
+            rows = yaml.safe_load(file_)
+        else:
+            raise ManifestError(safe_format(
+                'cannot read manifest {}: expected a .csv, .json or .yaml '
+                'file', path
+            ))
+    if not isinstance(rows, list):
+        raise ManifestError(safe_format('manifest {} is not a list of jobs',
+                                        path))
+    return [_job(row, path, num) for num, row in enumerate(rows, 1)]
+
+
+def _job(row, path, num):
+    """one job of a manifest from its `row`, see `read_manifest`"""
+    if not isinstance(row, dict):
+        raise ManifestError(safe_format('job {} of {} is not a mapping of '
+                                        'fields', num, path))
+    unknown = sorted(set(row) - set(MANIFEST_FIELDS))
+    if unknown:
+        raise ManifestError(safe_format('job {} of {} has unknown fields {}',
+                                        num, path, unknown))
+    job = dict(JOB_DEFAULTS)
+    job.update((key, value) for key, value in row.items()
+               if value not in (None, ''))
+    try:
+        stations = job['station']
+        job['start'] = _as_date(job['start'])
+        job['end'] = _as_date(job['end'])
+    except KeyError as err:
+        raise ManifestError(safe_format('job {} of {} has no {}',
+                                        num, path, err))
+    except ValueError as err:
+        raise ManifestError(safe_format('job {} of {}: {}', num, path, err))
+    if isinstance(stations, str):
+        stations = stations.split()
+    if not isinstance(stations, list) or not stations or \
+            not all(isinstance(station, str) for station in stations):
+        raise ManifestError(safe_format(
+            'job {} of {}: station should be one or more station codes, '
+            'not {}', num, path, repr(stations)
+        ))
+    job['station'] = stations
+    for field in ('cadence', 'format', 'service'):
+        if job[field] is not None and not isinstance(job[field], str):
+            raise ManifestError(safe_format('job {} of {}: {} should be '
+                                            'text, not {}', num, path, field,
+                                            repr(job[field])))
+    return job
+
+
+def _as_date(value):
+    """`value`, a `datetime.date` or 'YYYY-MM-DD', as a `datetime.date`"""
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(safe_format('{} is not a date like 2015-01-31',
+                                     repr(value)))
+
+
+def _date(text):
+    """argparse type for a date, see `_as_date`"""
+    try:
+        return _as_date(text)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+
+def build_parser():
+    """the `argparse.ArgumentParser` for `main`"""
+    parser = argparse.ArgumentParser(
+        prog='gmdata-fetch',
+        description='fetch geomagnetic observatory data '
+                    'from the WDC webservice'
+    )
+    parser.add_argument('stations', nargs='*',
+                        help="IAGA station codes, e.g. 'ESK LER'")
+    parser.add_argument('--manifest',
+                        help='CSV, JSON or YAML file listing the jobs to run, '
+                             'in place of STATIONS')
+    parser.add_argument('--start', type=_date,
+                        help='first date wanted, YYYY-MM-DD')
+    parser.add_argument('--end', type=_date,
+                        help='last date wanted, YYYY-MM-DD')
+    parser.add_argument('--cadence', default='minute',
+                        help="'minute' (default) or 'hour'")
+    parser.add_argument('--format', dest='file_format',
+                        help="'iaga2002' or 'wdc'; by default as configured")
+    parser.add_argument('--service', default='WDC')
+    parser.add_argument('--saveroot', default='.',
+                        help='directory to save the data to')
+    parser.add_argument('--config', dest='configpath',
+                        help='configuration file, by default the one '
+                             'installed with the package')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='most stations fetched at once')
+    parser.add_argument('--chunk-workers', type=int, default=1,
+                        help="most requests sent at once for each station's "
+                             'chunks, see --max-datasets')
+    parser.add_argument('--max-datasets', type=int,
+                        help='most datasets in one request')
+    parser.add_argument('--max-bytes', type=int,
+                        help='most (estimated) bytes in one request')
+    parser.add_argument('--retries', type=int, default=0,
+                        help='times to retry a request failing transiently')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume downloads cut short')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep a record of what has been fetched in '
+                             'SAVEROOT, and skip fetching it again')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print what would be fetched, then stop')
+    parser.add_argument('--json', action='store_true',
+                        help='print the plans as JSON')
+    parser.add_argument('--summary',
+                        help="write a JSON summary of the results to this "
+                             "file, or '-' for standard output (the plans "
+                             "then go to standard error)")
+    parser.add_argument('--quiet', action='store_true',
+                        help='no progress output')
+    return parser
+
+
+def main(argv=None):
+    """
+    Run the `gmdata-fetch` command with arguments `argv`,
+    by default those the program was run with
+
+    Returns
+    -------
+    int exit status: 0 if everything was fetched (or planned),
+        1 if any job failed, 2 for bad arguments
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.chunk_workers < 1:
+        parser.error('--chunk-workers must be at least 1')
+    if args.retries < 0:
+        parser.error('--retries must not be negative')
+    if args.summary == '-' and args.json and not args.dry_run:
+        parser.error("give --json or --summary -, not both")
+    if args.manifest:
+        if args.stations:
+            parser.error('give STATIONS or --manifest, not both')
+        try:
+            jobs = read_manifest(args.manifest)
+        except (OSError, ImportError, ValueError) as err:
+            parser.error(str(err))
+    elif args.stations and args.start and args.end:
+        jobs = [{'station': args.stations, 'start': args.start,
+                 'end': args.end, 'cadence': args.cadence,
+                 'format': args.file_format, 'service': args.service}]
+    else:
+        parser.error('give STATIONS with --start and --end, or --manifest')
+
+    try:
+        plans = _plan(jobs, args)
+    except ValueError as err:  # includes ConfigError
+        parser.error(str(err))
+    if args.json:
+        print(json.dumps([plan.as_dict() for job_plans in plans
+                          for plan in job_plans], indent=1))
+    elif args.dry_run or not args.quiet:
+        # keep standard output for the JSON summary alone
+        out = sys.stderr if args.summary == '-' and not args.dry_run \
+            else sys.stdout
+        for job, job_plans in zip(jobs, plans):
+            print(safe_format('{}:\n{}', _describe(job), '\n'.join(
+                plan.summary() for plan in job_plans
+            )), file=out)
+    if args.dry_run:
+        return 0
+
+    outcomes = _execute(jobs, plans, args)
+    summary = _summarise(jobs, plans, outcomes)
+    if args.summary == '-':
+        print(json.dumps(summary, indent=1))
+    elif args.summary:
+        with open(args.summary, 'w') as file_:
+            json.dump(summary, file_, indent=1)
+    return 0 if summary['ok'] else 1
+
+
+def _plan(jobs, args):
+    """
+    for each of `jobs`, a `planner.JobPlan` for each of its stations,
+    so each station can be run as a unit of its own
+    """
+    from gmdata_webinterface.consume_webservices import load_config
+    from gmdata_webinterface.planner import plan_fetch
+
+    cache = None
+    if args.cache:
+        from gmdata_webinterface.cache import DatasetCache
+        cache = DatasetCache(args.saveroot)
+    plans = []
+    for job in jobs:
+        config = load_config(args.configpath, job['service'])
+        if job['format'] is not None:
+            config = config.with_file_format(job['format'])
+        plans.append([plan_fetch(
+            start_date=job['start'], end_date=job['end'],
+            station_list=[station], cadence=job['cadence'],
+            service=job['service'], saveroot=args.saveroot, config=config,
+            max_datasets=args.max_datasets, max_bytes=args.max_bytes,
+            cache=cache
+        ) for station in job['station']])
+    return plans
+
+
+def _execute(jobs, plans, args):
+    """
+    execute `plans`, a station at a time on each of `args.workers`
+    threads, and up to `args.chunk_workers` requests at a time for each
+    station, reporting progress
+
+    Returns
+    -------
+    list of (`FetchResult`, seconds taken) for each plan,
+        as nested in `plans`
+    """
+    from gmdata_webinterface.consume_webservices import FetchResult
+    from gmdata_webinterface.transport import RetryPolicy, make_session
+
+    retry = RetryPolicy(max_attempts=args.retries + 1)
+    units = [(job, plan) for job, job_plans in zip(jobs, plans)
+             for plan in job_plans]
+    lock = threading.Lock()
+    done = []
+
+    def run(job, plan):
+        """execute one plan, returning rather than raising its failure"""
+        station = plan.stations[0]
+        retries = []
+        started = time.perf_counter()
+        try:
+            result = plan.execute(
+                session=session, retry=retry, resume=args.resume,
+                chunk_workers=args.chunk_workers,
+                observer=lambda event: retries.append(event)
+                if event.stage == 'retry' else None
+            )[station]
+        except Exception as err:  # pylint: disable=broad-except
+            # reported with the rest
+            result = FetchResult(station, error=err)
+        result.retries = len(retries)
+        seconds = time.perf_counter() - started
+        with lock:
+            done.append(plan)
+            if not args.quiet:
+                _progress(len(done), len(units), job, result, seconds)
+        return result, seconds
+
+    # a connection for every chunk in flight, so none waits on the pool
+    with make_session(pool_size=args.workers * args.chunk_workers) \
+            as session:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            outcomes = iter(list(pool.map(lambda unit: run(*unit), units)))
+    return [[next(outcomes) for _ in job_plans] for job_plans in plans]
+
+
+def _progress(num, total, job, result, seconds):
+    """print how station `num` of `total` went to standard error"""
+    print(safe_format(
+        '[{}/{}] {} {}..{} {}: {} files, {} retries, {:.1f} s{}', num, total,
+        result.station, job['start'], job['end'], job['cadence'],
+        len(result.files), result.retries, seconds,
+        '' if result.ok else safe_format('; FAILED: {}', result.error)
+    ), file=sys.stderr)
+
+
+def _describe(job):
+    """a one line description of `job`"""
+    return safe_format('{} {}..{} {}{}', ' '.join(job['station']),
+                       job['start'], job['end'], job['cadence'],
+                       ' ' + job['format'] if job['format'] else '')
+
+
+def _summarise(jobs, plans, outcomes):
+    """a JSON-able `dict` of how every job went"""
+    summary = {'ok': True, 'jobs': []}
+    for job, job_plans, job_outcomes in zip(jobs, plans, outcomes):
+        stations = {}
+        for result, seconds in job_outcomes:
+            stations[result.station] = {
+                'ok': result.ok,
+                'files': result.files,
+                'retries': result.retries,
+                'seconds': round(seconds, 3),
+                'error': None if result.error is None else str(result.error),
+            }
+            summary['ok'] = summary['ok'] and result.ok
+        summary['jobs'].append({
+            'station': job['station'],
+            'start': job['start'].isoformat(),
+            'end': job['end'].isoformat(),
+            'cadence': job['cadence'],
+            'format': job['format'],
+            'service': job['service'],
+            'requests': sum(len(plan.requests) for plan in job_plans),
+            'datasets': sum(len(plan.datasets) for plan in job_plans),
+            'estimated_bytes': sum(plan.estimated_bytes
+                                   for plan in job_plans),
+            'stations': stations,
+        })
+    return summary
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,25 +10,68 @@ Lots of the server interaction is controlled
 by the `.ini` configuration file, as is
 the download file structure.
 
+requests, and the other modules only needed to fetch and unpack data,
+are imported on first use (see `lazy.LazyModule`), so tools importing
+this module for its other parts do not pay for them.
+
 @author: L Billingham; W. Brown
 """
+import copy
+import hashlib
+import json
 import os
-import zipfile
-from datetime import timedelta
+import re
+import threading
+from collections import namedtuple
 from configparser import ConfigParser, NoOptionError
-import requests as rq
-from six import BytesIO
+from datetime import date, datetime
+from gmdata_webinterface.instrument import Event, Stage
+from gmdata_webinterface.jsonfile import load_json, save_json
+from gmdata_webinterface.lazy import LazyModule
 from gmdata_webinterface.sandboxed_format import safe_format
 
+# imported on first use, so importing this module stays cheap
+#   for code which never fetches anything
+concurrent_futures = LazyModule('concurrent.futures')
+rq = LazyModule('requests')
+six = LazyModule('six')
+tempfile = LazyModule('tempfile')
+zipfile = LazyModule('zipfile')
+transport = LazyModule('gmdata_webinterface.transport')
+
+
+CADENCES = ['minute', 'hour']
+FILE_FORMATS = ['iaga2002', 'wdc']
+ENGINES = ['thread']
+# streamed responses are held in memory up to this size, then on disk
+SPOOL_MAX_SIZE = 16 * 1024 ** 2
+STREAM_CHUNK_SIZE = 64 * 1024
+# rough (uncompressed) size of one dataset, by cadence; a 31-day month of
+#   IAGA-2002 minute data, or a station-year of WDC-format hourly data
+ESTIMATED_DATASET_BYTES = {'minute': 3100000, 'hour': 177000}
+# where `sync_data` keeps each station's high-water mark, under `saveroot`
+SYNC_STATE_NAME = '.gmdata_sync.json'
+DEFAULT_CONFIGPATH = os.path.join(os.path.dirname(__file__),
+                                  'consume_rest.ini')
+# `load_config` cache of `ParsedConfigFile`, keyed on path and service
+_CONFIGS = {}
+_CONFIGS_LOCK = threading.Lock()
+
 
 def fetch_data(*, start_date, end_date, station_list, cadence, service,
-               saveroot, configpath=None):
+               saveroot, configpath=None, max_workers=1, engine='thread',
+               session=None, stream=False, max_datasets=None,
+               max_bytes=None, chunk_workers=1, cache=None, extract=None,
+               convert=None, observer=None, retry=None, resume=False):
     """
     Wrapper for the wrapper `fetch_station_data()`...
     `fetch_station_data()` handles a single observatory, for a range of
     dates. Here, simply accept a list of `station` codes, and pass each value
     to `fetch_station_data()` with the remaining criteria kept constant.
 
+    With `max_workers` > 1 the stations are fetched concurrently, with at
+    most `max_workers` requests in flight to the server at any one time.
+
     Parameters
     ----------
     start_date:  datetime.date
@@ -51,10 +94,43 @@ def fetch_data(*, start_date, end_date, station_list, cadence, service,
     configpath: file path as string
         location of the configuration file we want to read, by default
         this will be the version included in the package install
+    max_workers: int, default 1
+        maximum number of stations fetched at the same time.
+        The default of 1 fetches one station after another.
+    engine: string, default 'thread'
+        how concurrent fetches are run when `max_workers` > 1; only
+        'thread' (a thread pool) for now. From asyncio code, use
+        `async_webservices.async_fetch_data` instead.
+    session: `requests.Session` or (default) `None`
+        HTTP session shared by every station's request, e.g. from
+        `transport.make_session(...)`. By default we make one with a
+        connection pool of `max_workers * chunk_workers` and close it
+        when we are done.
+    stream: bool, default `False`
+        stream each response through a temporary file rather than
+        holding it in memory, see `fetch_station_data`
+    max_datasets, max_bytes, chunk_workers:
+        split each station's request into chunks,
+        see `fetch_station_data`
+    cache: `cache.DatasetCache` or (default) `None`
+        skip requesting datasets already held, see `fetch_station_data`
+    extract: callable or (default) `None`
+        how each response is unpacked, see `fetch_station_data`
+    convert: callable or (default) `None`
+        post-extraction stage run on each station's files,
+        see `fetch_station_data`
+    observer: callable or (default) `None`
+        told how long each stage of each request took,
+        see `fetch_station_data`
+    retry: `transport.RetryPolicy` or (default) `None`
+        retry each request that fails transiently,
+        see `fetch_station_data`
+    resume: bool, default `False`
+        keep partial downloads to resume, see `fetch_station_data`
 
     Returns
     -------
-    None
+    `dict` of `FetchResult`, keyed on station code
 
     Notes
     -----
@@ -63,7 +139,8 @@ def fetch_data(*, start_date, end_date, station_list, cadence, service,
     Raises
     ------
     ValueError if `cadence` is not something we can use
-        (currently only 'minute' or 'hour')
+        (currently only 'minute' or 'hour'), or if `max_workers` or
+        `engine` are not something we can use
 
     ConfigError if any of the required header values
         are not options within the config file
@@ -72,21 +149,188 @@ def fetch_data(*, start_date, end_date, station_list, cadence, service,
         on data provided via function arguments or the `configpath`
 
     InvalidResponse if the response is not the desired HTTP status code
+
+    FetchError if `max_workers` > 1 and fetching any station failed.
+        Stations are not abandoned when another fails; the error
+        carries the `FetchResult` for every station.
     """
 
     if isinstance(station_list, str):
         station_list = station_list.split()
+    with Stage(observer, 'config', None):
+        config = load_config(configpath, service)
+
+    def fetch_one(station_, session_):
+        """fetch a single station with the shared criteria"""
+        return fetch_station_data(
+            start_date=start_date, end_date=end_date, station=station_,
+            cadence=cadence, service=service, saveroot=saveroot,
+            config=config, session=session_, stream=stream,
+            max_datasets=max_datasets, max_bytes=max_bytes,
+            chunk_workers=chunk_workers, cache=cache, extract=extract,
+            convert=convert, observer=observer, retry=retry, resume=resume
+        )
+
+    return fetch_stations(fetch_one, station_list, max_workers, engine,
+                          session, chunk_workers)
+
+
+def sync_data(station_list, cadence, saveroot, *, since=None, end_date=None,
+              service='WDC', configpath=None, max_workers=1,
+              engine='thread', session=None, **fetch_kwargs):
+    """
+    Bring the data held in `saveroot` for each station up to date.
+
+    A high-water mark is kept for each station (and `cadence`, `service`)
+    in `saveroot`: the latest date fetched so far, never moved back by a
+    run with an earlier `end_date`. Each run asks only for
+    the period (month for 'minute', year for 'hour' cadence) holding that
+    mark, which may still have been growing, and anything newer.
+    Stations with no mark yet are fetched from `since`.
+
+    Parameters
+    ----------
+    station_list: string, list of string
+        IAGA-style station code e.g. 'ESK' or a list of such
+    cadence: string
+        frequency of the data. 'minute' or 'hour'
+    saveroot: file path as string
+        root directory at which data are saved,
+        and the high-water marks kept
+    since: datetime.date or (default) `None`
+        earliest date wanted for stations not synced before.
+        Required if any station has no high-water mark.
+    end_date: datetime.date or (default) `None`
+        latest date wanted, by default today
+    service: string, default 'WDC'
+        webservice to target
+    configpath, max_workers, engine, session:
+        as for `fetch_data`
+    fetch_kwargs:
+        passed on to `fetch_station_data`, e.g. `stream`, `cache`
+
+    Returns
+    -------
+    `dict` of `FetchResult`, keyed on station code
+
+    Raises
+    ------
+    ValueError if a station has never been synced and `since` is `None`,
+        or as for `fetch_data`
+
+    FetchError as for `fetch_data`. Stations which did succeed still
+        have their high-water marks moved on.
+    """
+    if isinstance(station_list, str):
+        station_list = station_list.split()
+    if end_date is None:
+        end_date = date.today()
+    marks_path = os.path.join(saveroot, SYNC_STATE_NAME)
+    marks = load_json(marks_path)
+    marks_lock = threading.Lock()
+
+    starts = {}
+    for station_ in station_list:
+        mark = marks.get(_sync_key(service, cadence, station_))
+        if mark is not None:
+            starts[station_] = _period_start(
+                datetime.strptime(mark, '%Y-%m-%d').date(), cadence
+            )
+        elif since is not None:
+            starts[station_] = since
+        else:
+            mess = ('no record of syncing {} {} data for {} before,\n'
+                    'say where to start with `since`')
+            raise ValueError(safe_format(mess, service, cadence, station_))
+    config = load_config(configpath, service)
+
+    def fetch_one(station_, session_):
+        """fetch a single station from its high-water mark"""
+        result = fetch_station_data(
+            start_date=starts[station_], end_date=end_date,
+            station=station_, cadence=cadence, service=service,
+            saveroot=saveroot, config=config, session=session_,
+            **fetch_kwargs
+        )
+        key = _sync_key(service, cadence, station_)
+        with marks_lock:
+            # a backfill must not move the mark back; ISO dates sort
+            marks[key] = max(marks.get(key, ''), end_date.isoformat())
+            save_json(marks_path, marks)
+        return result
+
+    return fetch_stations(fetch_one, station_list, max_workers, engine,
+                          session, fetch_kwargs.get('chunk_workers', 1))
+
+
+def _sync_key(service, cadence, station):
+    """key for a station's high-water mark, see `sync_data`"""
+    return '/'.join([service.lower(), cadence, station.lower()])
+
+
+def _period_start(day, cadence):
+    """first day of the month ('minute') or year ('hour') holding `day`"""
+    if cadence == 'hour':
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
 
-    [
-        fetch_station_data(start_date=start_date, end_date=end_date,
-                           station=station_, cadence=cadence, service=service,
-                           saveroot=saveroot, configpath=configpath)
-        for station_ in station_list
-    ]
+
+def fetch_stations(fetch_one, station_list, max_workers, engine, session,
+                   chunk_workers=1):
+    """
+    Call `fetch_one(station, session)` for each station in `station_list`,
+    one after another or concurrently, see `fetch_data`.
+    We make (and close) a pooled session if `session` is `None`, with a
+    connection for each of the `chunk_workers` of each station in flight.
+
+    Returns
+    -------
+    `dict` of `FetchResult`, keyed on station code
+
+    Raises
+    ------
+    ValueError if `max_workers` or `engine` are not something we can use
+
+    FetchError if `max_workers` > 1 and any station failed
+    """
+    if engine not in ENGINES:
+        mess = 'engine {} cannot be handled.\nShould be one of: {}'
+        raise ValueError(safe_format(mess, engine, ENGINES))
+    if max_workers < 1:
+        raise ValueError(safe_format('max_workers must be >= 1, not {}',
+                                     max_workers))
+
+    own_session = session is None
+    if own_session:
+        session = transport.make_session(
+            pool_size=max_workers * chunk_workers
+        )
+
+    def fetch_with_session(station_):
+        """fetch `station_` over the shared session"""
+        return fetch_one(station_, session)
+
+    try:
+        if max_workers == 1:
+            return {station_: fetch_with_session(station_)
+                    for station_ in station_list}
+        results = _fetch_with_threads(fetch_with_session, station_list,
+                                      max_workers)
+    finally:
+        if own_session:
+            session.close()
+    if any(not result.ok for result in results.values()):
+        raise FetchError(results)
+    return results
 
 
 def fetch_station_data(*, start_date, end_date, station, cadence, service,
-                       saveroot, configpath=None):
+                       saveroot, configpath=None, config=None, session=None,
+                       stream=False,
+                       spool_max_size=SPOOL_MAX_SIZE, max_datasets=None,
+                       max_bytes=None, chunk_workers=1, cache=None,
+                       extract=None, convert=None, observer=None,
+                       retry=None, resume=False):
     """
     Ask webservice `service` for observatory data
     and download it to folder `saveroot`.
@@ -116,10 +360,65 @@ def fetch_station_data(*, start_date, end_date, station, cadence, service,
     configpath: file path as string
         location of the configuration file we want to read, by default
         this will be the version included in the package install
+    config: `ParsedConfigFile` or (default) `None`
+        the configuration already read, e.g. by `load_config`, used
+        instead of `configpath`. `fetch_data` reads it once and passes it
+        to every station.
+    session: `requests.Session` or (default) `None`
+        HTTP session to send the request with, so connections can be
+        reused between calls. By default a one-off connection is made.
+    stream: bool, default `False`
+        stream the response to a temporary file in chunks, rather than
+        holding it all in memory, so peak memory stays flat however
+        much data is requested
+    spool_max_size: int, default `SPOOL_MAX_SIZE`
+        when streaming, bytes of response kept in memory before the
+        temporary file is moved to disk
+    max_datasets: int or (default) `None`
+        most datasets (months or years of data) asked for in one request.
+        Longer date ranges are split into several requests, so that a
+        failure costs only one chunk, not the whole range.
+    max_bytes: int or (default) `None`
+        most data, estimated with `ESTIMATED_DATASET_BYTES`, asked for
+        in one request
+    chunk_workers: int, default 1
+        how many chunked requests are sent at once
+    cache: `cache.DatasetCache` or (default) `None`
+        datasets this cache already holds are not requested again;
+        whatever we do fetch is recorded in it
+    extract: callable or (default) `None`
+        called with each response's open `zipfile.ZipFile` and `saveroot`
+        to unpack it, returning the paths of the files extracted, e.g.
+        `extract.Extractor(members='*.min', workers=4)` to skip the README
+        and decompress in parallel. By default every member is unpacked
+        in turn by `extract.Extractor()`. Either way each file is written
+        through a temporary file and its CRC checked.
+    convert: callable or (default) `None`
+        post-extraction stage, called with the list of paths unpacked
+        from each response and returning the paths to keep in their
+        place, e.g. `readers.NpzConverter(numpy.float32)` to re-save the
+        data in a compact columnar format. Runs before `cache` records
+        the files.
+    observer: callable or (default) `None`
+        called with an `instrument.Event` as each stage of each request
+        finishes, giving its duration and bytes transferred, e.g. an
+        `instrument.MetricsAggregator`. See `instrument` for the stages.
+    retry: `transport.RetryPolicy` or (default) `None`
+        when and how often to retry a request (each chunk on its own)
+        that fails transiently, e.g. with a 500 from the server. By
+        default each request is tried once.
+    resume: bool, default `False`
+        stream each response to a '.part' file under `saveroot`, with a
+        checkpoint of how much has arrived, so that a request cut short
+        is resumed with a 'Range' request when sent again (by `retry`,
+        or a later call) rather than downloaded from the start. See
+        `resume.PartialDownload`. Implies `stream`.
 
     Returns
     -------
-    None
+    `FetchResult` listing the files extracted to `saveroot`,
+        including any already held by `cache`, and how many `retries`
+        it took
 
     Notes
     -----
@@ -137,29 +436,337 @@ def fetch_station_data(*, start_date, end_date, station, cadence, service,
         on data provided via function arguments or the `configpath`
 
     InvalidResponse if the response is not the desired HTTP status code
+
+    ChunkError if the request was split into chunks and any of them failed;
+        every chunk is still tried
     """
 
-    if configpath is None:
-        configpath = os.path.join(os.path.dirname(__file__),
-                                  'consume_rest.ini')
+    if config is None:
+        with Stage(observer, 'config', station):
+            config = load_config(configpath, service)
+    with Stage(observer, 'form', station):
+        form_data = FormData(config)
+        form_data.set_datasets(start_date, end_date, station, cadence,
+                               service)
+    cached_files = drop_cached(form_data, cache)
+    if not form_data.datasets:
+        return FetchResult(station, cached_files)
+    chunks = form_data.split(max_datasets=max_datasets, max_bytes=max_bytes)
+    return fetch_station_chunks(
+        station, chunks, cached_files, config=config, saveroot=saveroot,
+        session=session, stream=stream, spool_max_size=spool_max_size,
+        chunk_workers=chunk_workers, cache=cache, extract=extract,
+        convert=convert, observer=observer, retry=retry, resume=resume
+    )
 
-    config = ParsedConfigFile(configpath, service)
-    form_data = FormData(config)
-    form_data.set_datasets(start_date, end_date, station, cadence, service)
+
+def fetch_station_chunks(station, chunks, cached_files, *, config, saveroot,
+                         session=None, stream=False,
+                         spool_max_size=SPOOL_MAX_SIZE, chunk_workers=1,
+                         cache=None, extract=None, convert=None,
+                         observer=None, retry=None, resume=False):
+    """
+    Send a request for each `FormData` in `chunks` and unpack the
+    responses, see `fetch_station_data`. `planner.JobPlan` sends the
+    chunks it planned through here too.
+
+    Returns
+    -------
+    `FetchResult` listing the files extracted, after `cached_files`
+
+    Raises
+    ------
+    As `fetch_station_data`
+    """
+    http = rq if session is None else session
+    if extract is None:
+        from gmdata_webinterface.extract import Extractor
+        extract = Extractor()
+    if retry is None:
+        # try each request just the once
+        retry = transport.RetryPolicy(max_attempts=1)
+    retried = []
+
+    def fetch_chunk(chunk):
+        """request and unpack the datasets of one chunk"""
+        datasets = chunk.datasets.split(',')
+
+        def stage(name):
+            """time stage `name` of this chunk"""
+            return Stage(observer, name, station, datasets)
+
+        def on_retry(err, delay):
+            """count the retry, telling `observer` of the wait"""
+            retried.append(err)
+            if observer is not None:
+                observer(Event('retry', station, datasets, delay, None, err))
+
+        files, _ = retry.call(
+            lambda: _request_and_extract(config, chunk, http, saveroot,
+                                         stream, spool_max_size, extract,
+                                         stage, resume),
+            on_retry=on_retry
+        )
+        if convert is not None:
+            with stage('convert'):
+                files = convert(files)
+        if cache is not None:
+            cache.record(datasets, files, chunk.file_format)
+        return files
+
+    if len(chunks) == 1:
+        files = fetch_chunk(chunks[0])
+        return FetchResult(station, cached_files + files,
+                           retries=len(retried))
+    try:
+        result = _fetch_chunks(station, fetch_chunk, chunks, chunk_workers)
+    except ChunkError as err:
+        err.result.files[:0] = cached_files
+        err.result.retries = len(retried)
+        raise
+    result.files[:0] = cached_files
+    result.retries = len(retried)
+    return result
+
+
+def drop_cached(form_data, cache):
+    """
+    Remove the datasets `cache` already holds from `form_data`
+
+    Returns
+    -------
+    list of paths to the cached files of the datasets removed
+    """
+    if cache is None:
+        return []
+    datasets = form_data.datasets.split(',')
+    missing = cache.missing(datasets, form_data.file_format)
+    form_data.datasets = ','.join(missing)
+    return cache.files_for([dset for dset in datasets if dset not in missing],
+                           form_data.file_format)
+
+
+def _request_and_extract(config, form_data, http, saveroot, stream,
+                         spool_max_size, extract, stage, resume=False):
+    """
+    Send one request for the datasets in `form_data`
+    and unpack the response to `saveroot` with `extract`,
+    timing each part with `stage(name)`, an `instrument.Stage`
+
+    Returns
+    -------
+    list of paths to the files extracted
+    """
     request = DataRequest()
     request.read_attributes(config)
     request.set_form_data(form_data.as_dict())
-    response = rq.post(
-        request.url, data=request.form_data, headers=request.headers
+    if resume:
+        return _resume_to(saveroot, http, request, extract, stage)
+    if stream:
+        return _stream_to(saveroot, http, request, spool_max_size, extract,
+                          stage)
+
+    with stage('request') as timing:
+        response = http.post(
+            request.url, data=request.form_data, headers=request.headers
+        )
+        timing.nbytes = len(response.content)
+    with stage('validate'):
+        fzip = check_response(response.status_code, response.content,
+                              response.headers)
+    with fzip, stage('extract') as timing:
+        files = extract(fzip, saveroot)
+        timing.nbytes = _unpacked_size(fzip, files, saveroot)
+    return files
+
+
+def _fetch_chunks(station, fetch_chunk, chunks, chunk_workers):
+    """
+    Fetch every chunk of `FormData` in `chunks` with `fetch_chunk`,
+    up to `chunk_workers` at a time, carrying on past any failures
+
+    Returns
+    -------
+    `FetchResult` listing the files from every chunk
+
+    Raises
+    ------
+    ChunkError if any chunk failed
+    """
+    def capture(chunk):
+        """fetch `chunk`, returning rather than raising any error"""
+        try:
+            return fetch_chunk(chunk), None
+        except Exception as err:  # pylint: disable=broad-except
+            # reported once every chunk has been tried
+            return [], err
+
+    with concurrent_futures.ThreadPoolExecutor(
+            max_workers=chunk_workers) as pool:
+        outcomes = list(pool.map(capture, chunks))
+    files = [file_ for chunk_files, _ in outcomes for file_ in chunk_files]
+    result = FetchResult(station, files)
+    errors = {
+        chunk.datasets: err for chunk, (_, err) in zip(chunks, outcomes)
+        if err is not None
+    }
+    if errors:
+        raise ChunkError(result, errors)
+    return result
+
+
+def _stream_to(saveroot, http, request, spool_max_size, extract, stage):
+    """
+    Send `request` and stream the zipped response through a temporary
+    file which is opened once as an archive and unpacked with `extract`,
+    timing each part with `stage(name)`
+
+    Returns
+    -------
+    list of paths to the files extracted
+    """
+    with tempfile.SpooledTemporaryFile(max_size=spool_max_size) as spool:
+        with stage('request') as timing:
+            response = http.post(
+                request.url, data=request.form_data,
+                headers=request.headers, stream=True
+            )
+            try:
+                check_status(response.status_code, response.headers)
+                timing.nbytes = 0
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    spool.write(chunk)
+                    timing.nbytes += len(chunk)
+            finally:
+                response.close()
+        spool.seek(0)
+        # the memory buffer or file spooled to: before Python 3.11 the
+        #   spool itself has no `seekable`, which `ZipFile.open` needs
+        body = spool._file  # pylint: disable=protected-access
+        with stage('validate'):
+            fzip = zipfile.ZipFile(body)
+            try:
+                _check_filelist(response.status_code, fzip.filelist)
+            except ValueError:
+                fzip.close()
+                raise
+        with fzip, stage('extract') as timing:
+            files = extract(fzip, saveroot)
+            timing.nbytes = _unpacked_size(fzip, files, saveroot)
+        return files
+
+
+def _resume_to(saveroot, http, request, extract, stage):
+    """
+    Send `request` and stream the zipped response to a `PartialDownload`
+    under `saveroot`, asking only for what is missing if an earlier
+    attempt was cut short, then unpack it with `extract`, timing each
+    part with `stage(name)`
+
+    Returns
+    -------
+    list of paths to the files extracted
+
+    Raises
+    ------
+    InvalidResponse if the server refuses the range, or sends the wrong
+        part, even once asked for the whole body
+    """
+    from gmdata_webinterface.resume import IDENTITY, PartialDownload
+
+    partial = PartialDownload(saveroot, request.fingerprint)
+    with stage('request') as timing:
+        timing.nbytes = 0
+        # with any range, then (should that be refused) once without
+        for _ in range(2):
+            headers = dict(request.headers, **IDENTITY)
+            headers.update(partial.range_headers())
+            response = http.post(
+                request.url, data=request.form_data, headers=headers,
+                stream=True
+            )
+            try:
+                if response.status_code not in (
+                        rq.codes.partial_content,
+                        rq.codes.requested_range_not_satisfiable):
+                    check_status(response.status_code, response.headers)
+                if partial.accepts(response):
+                    resumed_from = partial.nbytes
+                    try:
+                        partial.receive(response, STREAM_CHUNK_SIZE)
+                    finally:
+                        timing.nbytes += partial.nbytes - resumed_from
+                    break
+            finally:
+                response.close()
+            # the range was refused and the partial download discarded
+        else:
+            mess = ('server answered {} (Content-Range {}) '
+                    'when asked for the whole body')
+            raise InvalidResponse(
+                safe_format(mess, response.status_code,
+                            repr(response.headers.get('Content-Range'))),
+                response.status_code
+            )
+    try:
+        with partial.open() as body:
+            with stage('validate'):
+                fzip = zipfile.ZipFile(body)
+                try:
+                    _check_filelist(response.status_code, fzip.filelist)
+                except ValueError:
+                    fzip.close()
+                    raise
+            with fzip, stage('extract') as timing:
+                files = extract(fzip, saveroot)
+                timing.nbytes = _unpacked_size(fzip, files, saveroot)
+    except (zipfile.BadZipFile, ValueError):
+        # corrupt or empty, so not worth resuming: start again if retried
+        partial.discard()
+        raise
+    partial.discard()
+    return files
+
+
+def _unpacked_size(fzip, files, saveroot):
+    """total uncompressed size of the members of `fzip` unpacked as `files`"""
+    unpacked = {os.path.normpath(file_) for file_ in files}
+    return sum(
+        info.file_size for info in fzip.infolist()
+        if os.path.normpath(os.path.join(saveroot, info.filename)) in unpacked
     )
-    check_response(response.status_code, response.content)
 
-    # TODO: make this work with > 1 file without wrapper function
-    with zipfile.ZipFile(BytesIO(response.content)) as fzip:
-        fzip.extractall(saveroot)
+
+def _capture_fetch(fetch_one, station):
+    """
+    Run `fetch_one(station)`, turning any error into a failed
+    `FetchResult` so one bad station does not abandon the others
+    """
+    try:
+        return fetch_one(station)
+    except Exception as err:  # pylint: disable=broad-except; reported later
+        return FetchResult.failed(station, err)
+
+
+def _fetch_with_threads(fetch_one, station_list, max_workers):
+    """
+    Fetch each station in `station_list` on a pool of
+    `max_workers` threads.
+
+    Returns
+    -------
+    `dict` of `FetchResult`, keyed on station code, in `station_list` order
+    """
+    with concurrent_futures.ThreadPoolExecutor(
+            max_workers=max_workers) as pool:
+        futures = [
+            (station_, pool.submit(_capture_fetch, fetch_one, station_))
+            for station_ in station_list
+        ]
+        return {station_: future.result() for station_, future in futures}
 
 
-def check_response(status_code, content):
+def check_response(status_code, content, headers=None):
     """
     Check if the server response is 'ok' (see `requests.codes`).
     It's probably 'ok' 200, or 'internal_server_error' 500 because the server
@@ -171,36 +778,63 @@ def check_response(status_code, content):
 
     content: stream content from post request response
 
+    headers: `dict` of response headers or (default) `None`;
+        any 'Retry-After' is passed on in an `InvalidResponse`
+
     Returns
     -------
-    none
+    `zipfile.ZipFile` of `content`, already opened and checked, to extract
+        the members from without parsing the archive again.
+        Close it when done, e.g. use it as a context manager.
 
     Raises
     ------
-    ValueError: if http code is not 'ok' (200), or is 'ok' but empty
-        `filelist` returned
+    InvalidResponse: if http code is not 'ok' (200)
+
+    ValueError: if http code is 'ok' but empty `filelist` returned
 
+    """
+    check_status(status_code, headers)
+    # An empty zipfile will still send back some bytes but can check if
+    #   the returned filelist is empty.
+    fzip = zipfile.ZipFile(six.BytesIO(content))
+    try:
+        _check_filelist(status_code, fzip.filelist)
+    except ValueError:
+        fzip.close()
+        raise
+    return fzip
+
+
+def check_status(status_code, headers=None):
+    """
+    raise InvalidResponse if `status_code` is not 'ok' (200),
+    see `check_response`
     """
     if status_code != rq.codes.ok:
         mess = ("unexpected http response code from server: " +
                 "{}, '{}'")
         mess = mess.format(status_code,
                            rq.status_codes._codes[status_code][0])
-        raise ValueError(mess)
+        retry_after = transport.parse_retry_after(
+            (headers or {}).get('Retry-After')
+        )
+        raise InvalidResponse(mess, status_code, retry_after)
 
-    elif status_code == rq.codes.ok:
-        """An empty zipfile will still send back some bytes but can check if
-        the returned filelist is empty.
-        """
-        content = zipfile.ZipFile(BytesIO(content))
-        if not content.filelist:
-            mess = ("no valid files returned.\n" +
-                    "http response code is: {}, '{}'\n" +
-                    "data may not be available for date range " +
-                    "requested, or server is misbehaving.")
-            mess = mess.format(status_code,
-                               rq.status_codes._codes[status_code][0])
-            raise ValueError(mess)
+
+def _check_filelist(status_code, filelist):
+    """
+    raise ValueError if the `filelist` of a returned zip is empty,
+    see `check_response`
+    """
+    if not filelist:
+        mess = ("no valid files returned.\n" +
+                "http response code is: {}, '{}'\n" +
+                "data may not be available for date range " +
+                "requested, or server is misbehaving.")
+        mess = mess.format(status_code,
+                           rq.status_codes._codes[status_code][0])
+        raise ValueError(mess)
 
 
 class ConfigError(Exception):
@@ -216,6 +850,129 @@ class InvalidRequest(ValueError):
     pass
 
 
+class InvalidResponse(ValueError):
+    """
+    The server did not answer 'ok' (200)
+
+    Attributes
+    ----------
+    status_code: int
+        the HTTP status code it did answer with
+    retry_after: float or `None`
+        seconds the server asked us to wait before trying again,
+        from any 'Retry-After' header
+    """
+    def __init__(self, message, status_code, retry_after=None):
+        super(InvalidResponse, self).__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class FetchError(ValueError):
+    """
+    Fetching data failed for one or more stations.
+
+    Attributes
+    ----------
+    results: `dict` of `FetchResult`
+        outcome for every station requested, keyed on station code,
+        including those which succeeded
+    errors: `dict` of Exception
+        the error raised for each station that failed
+    """
+    def __init__(self, results):
+        self.results = results
+        self.errors = {
+            station: result.error for station, result in results.items()
+            if not result.ok
+        }
+        mess = safe_format(
+            'failed to fetch data for {} of {} stations:\n{}',
+            len(self.errors),
+            len(results),
+            '\n'.join(
+                safe_format('    {}: {}', station, repr(err))
+                for station, err in self.errors.items()
+            )
+        )
+        super(FetchError, self).__init__(mess)
+
+
+class ChunkError(ValueError):
+    """
+    Fetching one or more chunks of a station's datasets failed.
+
+    Attributes
+    ----------
+    result: `FetchResult`
+        the files fetched by the chunks that succeeded
+    errors: `dict` of Exception
+        the error raised for each chunk that failed,
+        keyed on the chunk's comma-separated datasets
+    """
+    def __init__(self, result, errors):
+        self.result = result
+        self.errors = errors
+        mess = safe_format(
+            'failed to fetch {} chunk(s) of data for {}:\n{}',
+            len(errors),
+            result.station,
+            '\n'.join(
+                safe_format('    {}: {}', datasets, repr(err))
+                for datasets, err in errors.items()
+            )
+        )
+        super(ChunkError, self).__init__(mess)
+
+
+class FetchResult(object):
+    """
+    The outcome of fetching data for a single station
+
+    Attributes
+    ----------
+    station: string
+        IAGA-style station code e.g. 'ESK'
+    files: list of file paths as string
+        files extracted from the response to `saveroot`
+    error: Exception or `None`
+        the error that stopped us fetching the data, if any
+    retries: int
+        how many requests were retried before succeeding (or giving up)
+    """
+    def __init__(self, station, files=None, error=None, retries=0):
+        self.station = station
+        self.files = [] if files is None else files
+        self.error = error
+        self.retries = retries
+
+    def __repr__(self):
+        return safe_format(
+            '{}({}, files={}, error={}, retries={})',
+            self.__class__.__name__,
+            repr(self.station),
+            repr(self.files),
+            repr(self.error),
+            self.retries
+        )
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        """did we fetch the data without error?"""
+        return self.error is None
+
+    @classmethod
+    def failed(cls, station, error):
+        """
+        The result for `station` once fetching it raised `error`, keeping
+        the files and retries of a `ChunkError` that carries them
+        """
+        if isinstance(error, ChunkError):
+            return cls(station, error.result.files, error,
+                       error.result.retries)
+        return cls(station, error=error)
+
+
 class DataRequest(object):
     """
     The HTTP POST request for getting
@@ -280,10 +1037,32 @@ class DataRequest(object):
         """
         return bool(self.headers and self.form_data and self.url)
 
-    def send(self):
+    @property
+    def fingerprint(self):
+        """
+        hex digest identifying this request by its url, headers and form
+        data; the same for equal requests in any process, so can key
+        caches and de-duplicate requests
+        """
+        return request_fingerprint({
+            'url': self.url,
+            'headers': {
+                key.lower(): value for key, value in self.headers.items()
+            },
+            'form_data': self.form_data,
+        })
+
+    def send(self, session=None):
         """
         Send a populated DataRequest
 
+        Parameters
+        ----------
+        session: `requests.Session` or (default) `None`
+            HTTP session to send the request with, so connections can be
+            shared with other requests. By default a one-off connection
+            is made.
+
         Notes
         -----
         Makes an HTTP request over the network
@@ -295,8 +1074,9 @@ class DataRequest(object):
         if not self.can_send:
             self._error_with_message()
         else:
-            response = rq.post(url=self.url,
-                               data=self.form_data, headers=self.headers)
+            http = rq if session is None else session
+            response = http.post(url=self.url,
+                                 data=self.form_data, headers=self.headers)
             response.raise_for_status()
             return response
 
@@ -404,6 +1184,23 @@ class FormData(object):
     def __ne__(self, other):
         return not self == other
 
+    @property
+    def file_format(self):
+        """short name of the `format` asked for, e.g. 'iaga2002'"""
+        return self.format.rsplit('-', 1)[-1]
+
+    @property
+    def fingerprint(self):
+        """
+        hex digest identifying the form data, the same for equal
+        data in any process, see also `DataRequest.fingerprint`
+
+        Raises
+        ------
+        ValueError if datasets not yet set, see `as_dict`
+        """
+        return request_fingerprint(self.as_dict())
+
     @property
     def _dict(self):
         """don't rely on this dict representation from outside"""
@@ -425,6 +1222,45 @@ class FormData(object):
             raise ValueError('datasets not valid, use '
                              '`set_datasets` method to populate')
 
+    def split(self, max_datasets=None, max_bytes=None):
+        """
+        Split our datasets into chunks, each small enough to be
+        sent as its own request.
+
+        Parameters
+        ----------
+        max_datasets: int or (default) `None`
+            most datasets in any one chunk
+        max_bytes: int or (default) `None`
+            most bytes of data in any one chunk, estimated per dataset
+            with `ESTIMATED_DATASET_BYTES`. A dataset bigger than this
+            still gets a chunk of its own.
+
+        Returns
+        -------
+        list of `FormData`, one per chunk, in dataset order.
+            Just `[self]` if no limits are given.
+
+        Raises
+        ------
+        ValueError:
+            if we do not have valid data because we still need to
+            work out e.g. the list of datasets for the form, or
+            `max_datasets` or `max_bytes` are less than 1
+        """
+        self.as_dict()
+        if max_datasets is None and max_bytes is None:
+            return [self]
+        chunks = plan_chunks(self.datasets.split(','),
+                             max_datasets=max_datasets, max_bytes=max_bytes)
+        split = []
+        for chunk in chunks:
+            part = self.__class__(self._from_req_parser)
+            part.format = self.format
+            part.datasets = ','.join(chunk)
+            split.append(part)
+        return split
+
     def set_datasets(self, start_date, end_date, station, cadence, service):
         """
         List of datasets for the POST request form data.
@@ -452,35 +1288,170 @@ class FormData(object):
         Returns
         -------
         datasets for the POST request form in a a comma-seperated
-            string.
+            string, in chronological order.
 
         Raises
         ------
         ValueError if `cadence` is not either 'minute' or 'hour'
         """
         root = '/'.join(['', service.lower(), 'datasets', cadence, ''])
-        cadences_supported = ['minute', 'hour']
+        periods = iter_dataset_periods(start_date, end_date, cadence)
         if cadence == 'hour':
             base = root + station.lower() + '{:d}'
-            years = range(start_date.year, end_date.year + 1)
-            dsets = (safe_format(base, year) for year in years)
-        elif cadence == 'minute':
-            base = root + station.lower() + '{:d}{:02d}'
-            # note the creation of per-diem date stamps followed by a
-            #   set comprehension over their strings appears wasteful because
-            #   it creates ~30X more date objects than we strictly need.
-            #   but doing the maths correctly ourselves
-            #   including edge and corner cases is
-            #   messy, complex, and easy to screw up
-
-            # +1 so we _include_ the end date in range
-            num_days = (end_date - start_date).days + 1
-            all_days = (start_date + timedelta(day) for day in range(num_days))
-            dsets = {safe_format(base, dt.year, dt.month) for dt in all_days}
         else:
-            mess = 'cadence {} cannot be handled.\nShould be one of: {}'
-            raise ValueError(safe_format(mess, cadence, cadences_supported))
-        self.datasets = ','.join(dset for dset in dsets)
+            base = root + station.lower() + '{:d}{:02d}'
+        self.datasets = ','.join(safe_format(base, *period)
+                                 for period in periods)
+
+
+def request_fingerprint(parts):
+    """
+    SHA-256 hex digest of the JSON-able `parts` of a request,
+    independent of dictionary ordering
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def iter_dataset_periods(start_date, end_date, cadence):
+    """
+    The periods of data, one per dataset, spanning `start_date`
+    to `end_date` inclusive: months for 'minute' cadence,
+    years for 'hour' cadence.
+
+    Parameters
+    ----------
+    start_date:  datetime.date
+        earliest date at which data wanted.
+    end_date:  datetime.date
+        latest date at which data wanted.
+    cadence: string
+        frequency of the data. 'minute' or 'hour'
+
+    Returns
+    -------
+    iterator over `(year, month)` tuples for 'minute' cadence, or `(year,)`
+        tuples for 'hour' cadence, in chronological order
+
+    Raises
+    ------
+    ValueError if `cadence` is not either 'minute' or 'hour'
+    """
+    if cadence == 'hour':
+        years = range(start_date.year, end_date.year + 1)
+        return ((year,) for year in years)
+    elif cadence == 'minute':
+        if end_date < start_date:
+            return iter(())
+        # count months from year 0 so a range spans year boundaries
+        first = start_date.year * 12 + start_date.month - 1
+        last = end_date.year * 12 + end_date.month - 1
+        return ((month // 12, month % 12 + 1)
+                for month in range(first, last + 1))
+    mess = 'cadence {} cannot be handled.\nShould be one of: {}'
+    raise ValueError(safe_format(mess, cadence, CADENCES))
+
+
+DatasetPeriod = namedtuple('DatasetPeriod',
+                           ['service', 'cadence', 'station', 'year', 'month'])
+_DATASET_PATTERN = re.compile(
+    r'^/(?P<service>[^/]+)/datasets/(?P<cadence>[^/]+)/'
+    r'(?P<station>[a-z]+)(?P<year>\d{4})(?P<month>\d{2})?$'
+)
+
+
+def parse_dataset(dataset):
+    """
+    Split a dataset from `FormData.set_datasets` into its parts,
+    e.g. '/wdc/datasets/minute/esk201501' or '/wdc/datasets/hour/ngk2015'
+
+    Returns
+    -------
+    `DatasetPeriod` of service, cadence, station, year and month,
+        where month is `None` for yearly datasets
+
+    Raises
+    ------
+    ValueError if `dataset` is not of the expected form
+    """
+    match = _DATASET_PATTERN.match(dataset)
+    if match is None:
+        raise ValueError(safe_format('cannot parse dataset {}',
+                                     repr(dataset)))
+    month = match.group('month')
+    return DatasetPeriod(
+        match.group('service'),
+        match.group('cadence'),
+        match.group('station'),
+        int(match.group('year')),
+        None if month is None else int(month)
+    )
+
+
+def estimate_dataset_bytes(dataset):
+    """
+    Rough size of the data file for one `dataset`,
+    e.g. '/wdc/datasets/minute/esk201501', from its cadence.
+    See `ESTIMATED_DATASET_BYTES`.
+
+    Raises
+    ------
+    ValueError if the cadence of `dataset` cannot be handled
+    """
+    cadence = dataset.rstrip('/').split('/')[-2]
+    try:
+        return ESTIMATED_DATASET_BYTES[cadence]
+    except KeyError:
+        mess = ('cadence {} of dataset {} cannot be handled.\n'
+                'Should be one of: {}')
+        raise ValueError(safe_format(mess, cadence, dataset,
+                                     sorted(ESTIMATED_DATASET_BYTES)))
+
+
+def plan_chunks(datasets, max_datasets=None, max_bytes=None):
+    """
+    Group `datasets` into consecutive chunks, each to be sent
+    as its own request
+
+    Parameters
+    ----------
+    datasets: list of string
+        e.g. ['/wdc/datasets/minute/esk201501', ...]
+    max_datasets: int or (default) `None`
+        most datasets in any one chunk
+    max_bytes: int or (default) `None`
+        most bytes of data in any one chunk, estimated
+        with `estimate_dataset_bytes`
+
+    Returns
+    -------
+    list of lists of datasets, preserving their order
+
+    Raises
+    ------
+    ValueError if `max_datasets` or `max_bytes` are less than 1
+    """
+    for name, limit in (('max_datasets', max_datasets),
+                        ('max_bytes', max_bytes)):
+        if limit is not None and limit < 1:
+            raise ValueError(safe_format('{} must be >= 1, not {}',
+                                         name, limit))
+    chunks = []
+    chunk, chunk_bytes = [], 0
+    for dataset in datasets:
+        dataset_bytes = 0 if max_bytes is None else \
+            estimate_dataset_bytes(dataset)
+        too_many = max_datasets is not None and len(chunk) >= max_datasets
+        too_big = max_bytes is not None and \
+            chunk_bytes + dataset_bytes > max_bytes
+        if chunk and (too_many or too_big):
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(dataset)
+        chunk_bytes += dataset_bytes
+    if chunk:
+        chunks.append(chunk)
+    return chunks
 
 
 class ParsedConfigFile(object):
@@ -658,6 +1629,24 @@ class ParsedConfigFile(object):
         final_format = safe_format(outfmt_template, outfiletype)
         return final_format
 
+    def with_file_format(self, file_format):
+        """
+        A copy of this configuration asking for data in `file_format`,
+        e.g. 'iaga2002', in place of the configured 'FileFormat'
+
+        Raises
+        ------
+        ValueError if `file_format` is not one of `FILE_FORMATS`
+        """
+        if file_format not in FILE_FORMATS:
+            mess = 'file format {} cannot be handled.\nShould be one of: {}'
+            raise ValueError(safe_format(mess, file_format, FILE_FORMATS))
+        config = copy.copy(self)
+        config.dataformat = safe_format(
+            self._config.get(self.service, '_format_template'), file_format
+        )
+        return config
+
     def _check_service(self, service):
         """
         Validate the `service` by ensuring the config file has a section
@@ -681,5 +1670,51 @@ class ParsedConfigFile(object):
             raise ConfigError(formatted_mess)
 
 
+def load_config(configpath, service):
+    """
+    The `ParsedConfigFile` of `configpath` for `service`, read only once
+    however many times we are asked, unless the file has since changed
+
+    Parameters
+    ----------
+    configpath: file path as string or `None`
+        location of the configuration file, or `None` for
+        `DEFAULT_CONFIGPATH`, the version included in the package install
+    service: string
+        webservice to target, only 'WDC' for now
+
+    Returns
+    -------
+    `ParsedConfigFile`, shared with other callers: do not modify it
+
+    Raises
+    ------
+    ConfigError as `ParsedConfigFile`
+    """
+    if configpath is None:
+        configpath = DEFAULT_CONFIGPATH
+    key = (os.path.abspath(configpath), service)
+    try:
+        stat = os.stat(configpath)
+    except OSError:
+        # let the parser report on it
+        return ParsedConfigFile(configpath, service)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _CONFIGS_LOCK:
+        held = _CONFIGS.get(key)
+        if held is not None and held[0] == stamp:
+            return held[1]
+    config = ParsedConfigFile(configpath, service)
+    with _CONFIGS_LOCK:
+        _CONFIGS[key] = (stamp, config)
+    return config
+
+
+def clear_config_cache():
+    """forget every configuration read by `load_config`"""
+    with _CONFIGS_LOCK:
+        _CONFIGS.clear()
+
+
 if __name__ == '__main__':
     pass  # this is module is only for being imported
@@ -0,0 +1,151 @@
+"""
+extract module
+
+Unpack the zip archives returned by the webservice.
+
+Each member is decompressed to a temporary file beside its destination
+and renamed into place only once it has been written in full and its
+CRC checked, so an interrupted download never leaves a half-written data
+file. Members can be unpacked in parallel (zlib releases the GIL while
+decompressing) and filtered by name.
+
+@author: W. Brown
+"""
+import fnmatch
+import os
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import BadZipFile
+
+from gmdata_webinterface.sandboxed_format import safe_format
+
+COPY_CHUNK_SIZE = 64 * 1024
+# the mode `open` gives a new file, where `tempfile.mkstemp` gives 0o600;
+#   reading the umask means setting it, so it is read once, on import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+class Extractor(object):
+    """
+    Unpacks the members of an open `zipfile.ZipFile`, for the `extract`
+    argument of `consume_webservices.fetch_station_data`
+
+    Parameters
+    ----------
+    members: string, list of string or (default) `None`
+        glob-style pattern(s) of the member names to unpack,
+        e.g. '*.min' to skip the README; by default every member
+    workers: int, default 1
+        how many members are decompressed at once
+
+    Raises
+    ------
+    ValueError if `workers` is less than 1
+    """
+    def __init__(self, members=None, workers=1):
+        """ see class docstring """
+        if workers < 1:
+            raise ValueError(safe_format('workers must be >= 1, not {}',
+                                         workers))
+        if isinstance(members, str):
+            members = [members]
+        self.members = members
+        self.workers = workers
+
+    def __repr__(self):
+        return safe_format('{}(members={}, workers={})',
+                           self.__class__.__name__, repr(self.members),
+                           repr(self.workers))
+
+    def __call__(self, fzip, saveroot):
+        """
+        Unpack the wanted members of `fzip` to under `saveroot`
+
+        Returns
+        -------
+        list of paths to the files extracted, in archive order
+
+        Raises
+        ------
+        `zipfile.BadZipFile` if any member fails its CRC check or is
+            truncated; no file is left behind for it
+        """
+        wanted = [info for info in fzip.infolist() if self.wants(info)]
+        if self.workers == 1 or len(wanted) < 2:
+            paths = [extract_member(fzip, info, saveroot) for info in wanted]
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                paths = list(pool.map(
+                    lambda info: extract_member(fzip, info, saveroot), wanted
+                ))
+        return [path for path in paths if path is not None]
+
+    def wants(self, info):
+        """should member `info` (a `zipfile.ZipInfo`) be unpacked?"""
+        if self.members is None:
+            return True
+        name = info.filename.rsplit('/', 1)[-1]
+        return any(fnmatch.fnmatch(name, pattern) or
+                   fnmatch.fnmatch(info.filename, pattern)
+                   for pattern in self.members)
+
+
+def extract_member(fzip, info, saveroot):
+    """
+    Unpack member `info` of `fzip` to under `saveroot`, through a
+    temporary file renamed into place once its size and CRC are checked
+
+    Returns
+    -------
+    path to the file extracted, or `None` if `info` is a directory
+
+    Raises
+    ------
+    `zipfile.BadZipFile` if the member fails its CRC check or is truncated
+    """
+    path = member_path(saveroot, info.filename)
+    if info.filename.endswith('/'):
+        os.makedirs(path, exist_ok=True)
+        return None
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    handle, partial = tempfile.mkstemp(
+        dir=folder, prefix='.' + os.path.basename(path), suffix='.part'
+    )
+    try:
+        crc, size = 0, 0
+        with os.fdopen(handle, 'wb') as target, fzip.open(info) as source:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                target.write(chunk)
+        if size != info.file_size or crc != info.CRC:
+            raise BadZipFile(safe_format(
+                'member {} of the archive is corrupt: {} bytes, CRC {:08x}; '
+                'expected {} bytes, CRC {:08x}',
+                info.filename, size, crc, info.file_size, info.CRC
+            ))
+        os.chmod(partial, FILE_MODE)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return path
+
+
+def member_path(saveroot, name):
+    """
+    where member `name` of an archive is unpacked to under `saveroot`,
+    with any drive, leading slash, '.' and '..' dropped from `name`
+    as `zipfile.ZipFile.extract` does, so it cannot escape `saveroot`
+    """
+    name = name.replace('\\', '/')
+    parts = [
+        part for part in os.path.splitdrive(name)[1].split('/')
+        if part not in ('', '.', '..')
+    ]
+    return os.path.join(saveroot, *parts)
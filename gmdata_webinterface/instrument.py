@@ -0,0 +1,189 @@
+"""
+instrument module
+
+Where does the time go when fetching data? Pass an `observer` to
+`fetch_data` (or `fetch_station_data`) and it is called with an `Event`
+as each stage of each request finishes:
+
+    'config'    reading the configuration file
+    'form'      building the form data, i.e. the datasets to request
+    'request'   sending the request and receiving the response
+                (`nbytes` is the size of the zip downloaded)
+    'validate'  checking the response and opening the zip archive
+    'extract'   unpacking the archive (`nbytes` unpacked)
+    'convert'   any `convert` stage run on the files unpacked
+    'retry'     a request failed and will be tried again (`duration` is
+                the wait before it is, `error` why it failed)
+
+`MetricsAggregator` is an observer which totals the events, to print a
+summary or export as Prometheus or StatsD counters.
+
+@author: W. Brown
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from gmdata_webinterface.sandboxed_format import safe_format
+
+STAGES = ['config', 'form', 'request', 'validate', 'extract', 'convert',
+          'retry']
+
+# `datasets` is the list of datasets the stage worked on, if any;
+#   `error` the exception it raised, or `None` if it succeeded
+Event = namedtuple('Event', ['stage', 'station', 'datasets', 'duration',
+                             'nbytes', 'error'])
+
+
+class Stage(object):
+    """
+    Context manager timing one stage of a fetch, telling `observer`
+    how it went on leaving.
+
+    Parameters
+    ----------
+    observer: callable or `None`
+        called with the `Event`; if `None` nothing is timed
+    stage: string
+        name of the stage, e.g. 'request'
+    station: string
+        IAGA code of the station being fetched
+    datasets: list of string or (default) `None`
+
+    Attributes
+    ----------
+    nbytes: int or `None`
+        set within the `with` block to report bytes transferred
+    """
+    def __init__(self, observer, stage, station, datasets=None):
+        """ see class docstring """
+        self.observer = observer
+        self.stage = stage
+        self.station = station
+        self.datasets = datasets
+        self.nbytes = None
+        self._started = None
+
+    def __enter__(self):
+        if self.observer is not None:
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, _, error, __):
+        if self.observer is not None:
+            self.observer(Event(
+                self.stage, self.station, self.datasets,
+                time.perf_counter() - self._started, self.nbytes, error
+            ))
+
+
+class MetricsAggregator(object):
+    """
+    An observer for `fetch_data` which totals the count, errors,
+    duration and bytes of each stage, and the bytes of each station.
+
+    Safe to share between the threads of a concurrent `fetch_data`.
+
+    Attributes
+    ----------
+    stages: `OrderedDict` of dict
+        for each stage seen, in `STAGES` order, the totals 'count',
+        'errors', 'seconds', 'max_seconds' and 'bytes'
+    stations: dict
+        bytes downloaded ('request' stage) for each station
+
+    Example
+    -------
+    >>> metrics = MetricsAggregator()
+    >>> fetch_data(..., observer=metrics)
+    >>> print(metrics.summary())
+    """
+    def __init__(self):
+        """ see class docstring """
+        self.stages = OrderedDict()
+        self.stations = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return safe_format('{}(<{} events>)', self.__class__.__name__,
+                           sum(totals['count']
+                               for totals in self.stages.values()))
+
+    def __call__(self, event):
+        """total `event` with those before"""
+        with self._lock:
+            if event.stage not in self.stages:
+                self.stages[event.stage] = {
+                    'count': 0, 'errors': 0, 'seconds': 0.0,
+                    'max_seconds': 0.0, 'bytes': 0
+                }
+                order = {stage: num for num, stage in enumerate(STAGES)}
+                self.stages = OrderedDict(sorted(
+                    self.stages.items(),
+                    key=lambda item: order.get(item[0], len(STAGES))
+                ))
+            totals = self.stages[event.stage]
+            totals['count'] += 1
+            totals['errors'] += event.error is not None
+            totals['seconds'] += event.duration
+            totals['max_seconds'] = max(totals['max_seconds'],
+                                        event.duration)
+            totals['bytes'] += event.nbytes or 0
+            if event.stage == 'request':
+                self.stations[event.station] = \
+                    self.stations.get(event.station, 0) + (event.nbytes or 0)
+
+    def summary(self):
+        """a table of the totals for each stage, as a string"""
+        with self._lock:
+            lines = [safe_format('{:<10}{:>7}{:>7}{:>11}{:>11}{:>14}',
+                                 'stage', 'count', 'errors', 'total s',
+                                 'max s', 'bytes')]
+            for stage, totals in self.stages.items():
+                lines.append(safe_format(
+                    '{:<10}{:>7}{:>7}{:>11.3f}{:>11.3f}{:>14}', stage,
+                    totals['count'], totals['errors'], totals['seconds'],
+                    totals['max_seconds'], totals['bytes']
+                ))
+            return '\n'.join(lines)
+
+    def prometheus(self, prefix='gmdata'):
+        """
+        the totals in the Prometheus text exposition format,
+        e.g. for a node_exporter textfile collector
+        """
+        metrics = [
+            ('stage_count_total', 'count', 'stages run'),
+            ('stage_errors_total', 'errors', 'stages which failed'),
+            ('stage_seconds_total', 'seconds', 'seconds spent in stages'),
+            ('stage_bytes_total', 'bytes', 'bytes transferred by stages'),
+        ]
+        lines = []
+        with self._lock:
+            for name, key, help_ in metrics:
+                name = prefix + '_' + name
+                lines.append(safe_format('# HELP {} {}', name, help_))
+                lines.append(safe_format('# TYPE {} counter', name))
+                for stage, totals in self.stages.items():
+                    lines.append(safe_format('{}{{stage="{}"}} {}', name,
+                                             stage, totals[key]))
+        return '\n'.join(lines) + '\n'
+
+    def statsd(self, prefix='gmdata'):
+        """
+        the totals as StatsD lines, e.g. 'gmdata.request.count:3|c',
+        to send to a StatsD server
+        """
+        lines = []
+        with self._lock:
+            for stage, totals in self.stages.items():
+                name = prefix + '.' + stage
+                lines.append(safe_format('{}.count:{}|c', name,
+                                         totals['count']))
+                lines.append(safe_format('{}.errors:{}|c', name,
+                                         totals['errors']))
+                lines.append(safe_format('{}.bytes:{}|c', name,
+                                         totals['bytes']))
+                lines.append(safe_format('{}.time:{}|ms', name,
+                                         int(round(totals['seconds'] * 1e3))))
+        return lines
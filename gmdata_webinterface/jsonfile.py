@@ -0,0 +1,31 @@
+"""
+jsonfile module
+
+The small JSON files kept alongside downloaded data: the `cache`
+manifest, the `archive` index and the `sync_data` high-water marks.
+Each is rewritten whole through a temporary file and renamed into place,
+so a reader never sees it half written.
+
+@author: W. Brown
+"""
+import json
+import os
+
+
+def load_json(path):
+    """contents of the JSON file at `path`, or `{}` if there is none"""
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as file_:
+        return json.load(file_)
+
+
+def save_json(path, contents):
+    """write `contents` as JSON to `path`, replacing any old one in one step"""
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    partial = path + '.tmp'
+    with open(partial, 'w') as file_:
+        json.dump(contents, file_, indent=1, sort_keys=True)
+    os.replace(partial, path)
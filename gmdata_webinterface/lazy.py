@@ -0,0 +1,48 @@
+"""
+lazy module
+
+Stand-ins for modules which are slow to import and needed only on some
+code paths, e.g. requests (and urllib3, certifi, ...) only once we
+actually fetch something. The module is imported on first use, so that
+`import gmdata_webinterface.consume_webservices` stays cheap for tools
+which never touch the network.
+
+@author: W. Brown
+"""
+import importlib
+import threading
+
+from gmdata_webinterface.sandboxed_format import safe_format
+
+
+class LazyModule(object):
+    """
+    Stands in for the module `name`, importing it the first time
+    one of its attributes is looked up
+
+    Example
+    -------
+    >>> rq = LazyModule('requests')  # nothing imported yet
+    >>> rq.codes.ok                  # requests imported here
+    200
+    """
+    def __init__(self, name):
+        """ see class docstring """
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return safe_format('{}({}, loaded={})', self.__class__.__name__,
+                           repr(self._name), self._module is not None)
+
+    def __getattr__(self, attr):
+        # only called for attributes not set on the stand-in itself
+        if attr in ('_name', '_module', '_lock'):
+            # not initialised, e.g. while being copied
+            raise AttributeError(attr)
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
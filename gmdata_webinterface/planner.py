@@ -0,0 +1,295 @@
+"""
+planner module
+
+What will a `fetch_data` run involve? `plan_fetch` works out, without
+contacting the server, the requests it would send: the datasets in each,
+their estimated size and the files expected back, and which datasets
+are already held locally and so will not be asked for. Only a
+`cache.DatasetCache` is trusted to say what is held: a file found in
+`saveroot` without one may be empty, cut short or since revised, so it
+is noted but fetched again.
+
+The `JobPlan` returned can be printed for a dry run, saved as JSON, or
+`execute`d to send exactly the requests planned.
+
+@author: W. Brown
+"""
+import os
+from collections import OrderedDict, namedtuple
+
+from gmdata_webinterface.consume_webservices import (
+    FetchResult, FormData, estimate_dataset_bytes, load_config,
+    parse_dataset, plan_chunks, fetch_station_chunks, fetch_stations
+)
+from gmdata_webinterface.sandboxed_format import safe_format
+
+# names of the files each dataset unpacks to, by file format and cadence;
+#   only those seen from the server are listed
+FILE_NAME_TEMPLATES = {
+    ('iaga2002', 'minute'): '{station}{year:d}{month:02d}dmin.min',
+    ('wdc', 'hour'): '{station}{year:d}.wdc',
+}
+
+# one request of a plan: `form_data` is what is sent
+PlannedRequest = namedtuple('PlannedRequest', [
+    'station', 'form_data', 'datasets', 'estimated_bytes', 'file_names'
+])
+
+
+def expected_file_names(dataset, file_format):
+    """
+    Names of the files `dataset` should unpack to in format
+    `file_format`, e.g. ['esk201501dmin.min'] for
+    '/wdc/datasets/minute/esk201501' in 'iaga2002'.
+
+    Returns
+    -------
+    list of string, empty if we do not know what to expect
+    """
+    parsed = parse_dataset(dataset)
+    template = FILE_NAME_TEMPLATES.get((file_format, parsed.cadence))
+    if template is None:
+        return []
+    return [safe_format(template, station=parsed.station, year=parsed.year,
+                        month=parsed.month or 0)]
+
+
+def plan_fetch(*, start_date, end_date, station_list, cadence, service,
+               saveroot, configpath=None, config=None, max_datasets=None,
+               max_bytes=None, cache=None):
+    """
+    Plan fetching data for every station in `station_list`,
+    as `consume_webservices.fetch_data` would, without sending anything
+
+    Parameters
+    ----------
+    start_date, end_date, station_list, cadence, service, saveroot,
+    configpath, max_datasets, max_bytes:
+        as for `consume_webservices.fetch_data`
+    config: `consume_webservices.ParsedConfigFile` or (default) `None`
+        configuration to use, rather than reading `configpath`
+    cache: `cache.DatasetCache` or (default) `None`
+        datasets it holds are satisfied locally. Without one every
+        dataset is requested, and those whose expected files are all in
+        `saveroot` already are listed in `JobPlan.on_disk`.
+
+    Returns
+    -------
+    `JobPlan`
+
+    Raises
+    ------
+    As `consume_webservices.fetch_data`
+    """
+    if isinstance(station_list, str):
+        station_list = station_list.split()
+    if config is None:
+        config = load_config(configpath, service)
+    plan = JobPlan(config, saveroot, cache)
+    file_format = plan.file_format
+    for station in station_list:
+        form_data = FormData(config)
+        form_data.set_datasets(start_date, end_date, station, cadence,
+                               service)
+        held = plan.satisfied[station] = OrderedDict()
+        on_disk = plan.on_disk[station] = OrderedDict()
+        missing = []
+        for dataset in form_data.datasets.split(','):
+            files = _held_files(dataset, file_format, cache)
+            if files:
+                held[dataset] = files
+                continue
+            missing.append(dataset)
+            files = _files_on_disk(dataset, file_format, saveroot)
+            if files:
+                on_disk[dataset] = files
+        for datasets in plan_chunks(missing, max_datasets, max_bytes):
+            chunk = FormData(config)
+            chunk.datasets = ','.join(datasets)
+            plan.requests.append(PlannedRequest(
+                station, chunk, datasets,
+                sum(estimate_dataset_bytes(dset) for dset in datasets),
+                [name for dset in datasets
+                 for name in expected_file_names(dset, file_format)]
+            ))
+    return plan
+
+
+def _held_files(dataset, file_format, cache):
+    """
+    paths to the files `cache` holds for `dataset`, or `[]` if it must be
+    fetched, as it must without a cache
+    """
+    if cache is None or not cache.is_fresh(dataset, file_format):
+        return []
+    return cache.files_for([dataset], file_format)
+
+
+def _files_on_disk(dataset, file_format, saveroot):
+    """
+    paths to the files expected of `dataset` if all are in `saveroot`,
+    complete or not, or else `[]`
+    """
+    paths = [os.path.join(saveroot, name)
+             for name in expected_file_names(dataset, file_format)]
+    if paths and all(os.path.isfile(path) for path in paths):
+        return paths
+    return []
+
+
+class JobPlan(object):
+    """
+    The requests a fetch will send, see `plan_fetch`
+
+    Parameters
+    ----------
+    config: `consume_webservices.ParsedConfigFile`
+    saveroot: file path as string
+        directory the data are to be saved to
+    cache: `cache.DatasetCache` or (default) `None`
+        consulted while planning; records what `execute` fetches
+
+    Attributes
+    ----------
+    requests: list of `PlannedRequest`
+        in station order
+    satisfied: `OrderedDict` of `OrderedDict`
+        for each station, the datasets already held locally
+        and the paths to their files
+    on_disk: `OrderedDict` of `OrderedDict`
+        for each station, the datasets requested although their files
+        are in `saveroot`, unconfirmed by a cache, and those files
+    """
+    def __init__(self, config, saveroot, cache=None):
+        """ see class docstring """
+        self.config = config
+        self.saveroot = saveroot
+        self.cache = cache
+        self.requests = []
+        self.satisfied = OrderedDict()
+        self.on_disk = OrderedDict()
+
+    def __repr__(self):
+        return safe_format('{}(<{} requests, {} datasets held>)',
+                           self.__class__.__name__, len(self.requests),
+                           self.n_satisfied)
+
+    @property
+    def file_format(self):
+        """short name of the format asked for, e.g. 'iaga2002'"""
+        return self.config.dataformat.rsplit('-', 1)[-1]
+
+    @property
+    def stations(self):
+        """list of the stations planned for, in order"""
+        return list(self.satisfied)
+
+    @property
+    def datasets(self):
+        """list of every dataset to be requested"""
+        return [dset for request in self.requests
+                for dset in request.datasets]
+
+    @property
+    def n_satisfied(self):
+        """how many datasets are already held locally"""
+        return sum(len(held) for held in self.satisfied.values())
+
+    @property
+    def estimated_bytes(self):
+        """rough total size of the data to be downloaded"""
+        return sum(request.estimated_bytes for request in self.requests)
+
+    def summary(self):
+        """a description of the plan, as a string, e.g. for a dry run"""
+        lines = [safe_format(
+            '{} requests for {} datasets, about {:.1f} MB; '
+            '{} datasets already held',
+            len(self.requests), len(self.datasets),
+            self.estimated_bytes / 1e6, self.n_satisfied
+        )]
+        for request in self.requests:
+            first = request.datasets[0].rsplit('/', 1)[-1]
+            last = request.datasets[-1].rsplit('/', 1)[-1]
+            lines.append(safe_format(
+                '  {:<5}{:>24}{:>5} datasets{:>9.1f} MB  {}',
+                request.station,
+                first if first == last else first + '..' + last,
+                len(request.datasets), request.estimated_bytes / 1e6,
+                ' '.join(request.file_names)
+            ))
+        for station, held in self.satisfied.items():
+            if held:
+                lines.append(safe_format('  {:<5} held: {}', station, ' '.join(
+                    os.path.basename(path)
+                    for paths in held.values() for path in paths
+                )))
+        for station, on_disk in self.on_disk.items():
+            if on_disk:
+                lines.append(safe_format(
+                    '  {:<5} on disk, fetched again: {}', station, ' '.join(
+                        os.path.basename(path)
+                        for paths in on_disk.values() for path in paths
+                    )
+                ))
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        """the plan as a JSON-able `dict`"""
+        return {
+            'saveroot': self.saveroot,
+            'estimated_bytes': self.estimated_bytes,
+            'requests': [{
+                'station': request.station,
+                'datasets': request.datasets,
+                'estimated_bytes': request.estimated_bytes,
+                'file_names': request.file_names,
+            } for request in self.requests],
+            'satisfied': self.satisfied,
+            'on_disk': self.on_disk,
+        }
+
+    def execute(self, *, session=None, max_workers=1, engine='thread',
+                **fetch_kwargs):
+        """
+        Send the requests planned, and only those
+
+        Parameters
+        ----------
+        session, max_workers, engine:
+            as for `consume_webservices.fetch_data`
+        fetch_kwargs:
+            passed on as to `fetch_station_data`, e.g. `stream`,
+            `chunk_workers`, `retry`, `observer`
+
+        Returns
+        -------
+        `dict` of `FetchResult`, keyed on station code, with the files
+            already held listed first
+
+        Raises
+        ------
+        FetchError as for `consume_webservices.fetch_data`
+        """
+        by_station = OrderedDict((station, []) for station in self.stations)
+        for request in self.requests:
+            by_station[request.station].append(request.form_data)
+        if self.cache is not None:
+            # mark what we are relying on as used
+            self.cache.missing([dset for held in self.satisfied.values()
+                                for dset in held], self.file_format)
+
+        def fetch_one(station, session_):
+            """send the requests planned for `station`"""
+            held = [path for paths in self.satisfied[station].values()
+                    for path in paths]
+            if not by_station[station]:
+                return FetchResult(station, held)
+            return fetch_station_chunks(
+                station, by_station[station], held, config=self.config,
+                saveroot=self.saveroot, session=session_, cache=self.cache,
+                **fetch_kwargs
+            )
+
+        return fetch_stations(fetch_one, self.stations, max_workers, engine,
+                              session, fetch_kwargs.get('chunk_workers', 1))
@@ -0,0 +1,904 @@
+"""
+readers module
+
+Read the data files downloaded by `consume_webservices.fetch_data`
+(IAGA-2002 minute and WDC-format hourly data) into NumPy arrays.
+
+The data blocks of these formats are fixed width, so rather than
+parsing them line by line we view a whole block as a 2-D array of bytes
+(one row per line) and convert each column in one vectorised step.
+
+Needs NumPy: `pip install gmdata_webinterface[readers]`
+
+@author: W. Brown
+"""
+import glob
+import json
+import mmap
+import os
+
+import numpy as np
+
+from gmdata_webinterface.sandboxed_format import safe_format
+
+# IAGA-2002 values at or above this mean 'missing' (99999) or
+#   'not recorded' (88888)
+IAGA2002_MISSING = 88888.0
+_IAGA2002_COLUMNS_START = 30
+_IAGA2002_COLUMN_WIDTH = 10
+# WDC format hourly values (and daily means) of this are missing
+WDC_MISSING = 9999
+_WDC_RECORD_WIDTH = 120
+_WDC_ANGLES = [ord('D'), ord('I')]
+# place value of each character of 'YYYY-MM-DD HH:MM:SS.mmm' in the
+#   year, month, day, hour, minute, second, millisecond
+_IAGA2002_TIME_PLACES = np.zeros((23, 7))
+for _field, (_start, _stop) in enumerate([(0, 4), (5, 7), (8, 10), (11, 13),
+                                          (14, 16), (17, 19), (20, 23)]):
+    _IAGA2002_TIME_PLACES[_start:_stop, _field] = \
+        10.0 ** np.arange(_stop - _start - 1, -1, -1)
+# names in a `write_npz` archive of any metadata which are arrays
+_NPZ_METADATA_PREFIX = 'metadata_'
+# converted to float where present in a header
+_NUMERIC_HEADERS = ['geodetic_latitude', 'geodetic_longitude', 'elevation']
+
+
+class ReaderError(ValueError):
+    """A data file is not in the format we expect"""
+    pass
+
+
+class GeomagData(object):
+    """
+    Time series of geomagnetic field components from one station
+
+    Parameters
+    ----------
+    times: `numpy.ndarray` of `datetime64[ms]`
+        time of each sample
+    values: `numpy.ndarray` of float, shape (len(times), len(components))
+        the samples, with missing values as NaN
+    components: list of string
+        name of each column of `values` e.g. ['X', 'Y', 'Z', 'F']
+    metadata: dict or (default) `None`
+        anything else known about the data, e.g. from a file header
+
+    Attributes
+    ----------
+    as Parameters
+    """
+    def __init__(self, times, values, components, metadata=None):
+        """ see class docstring """
+        self.times = times
+        self.values = values
+        self.components = list(components)
+        self.metadata = {} if metadata is None else metadata
+
+    def __repr__(self):
+        return safe_format(
+            '<{} {} {} samples of {} from {} to {}>',
+            self.__class__.__name__,
+            self.metadata.get('iaga_code', '?'),
+            len(self.times),
+            ''.join(self.components),
+            self.times[0] if len(self.times) else None,
+            self.times[-1] if len(self.times) else None,
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, component):
+        """view of the samples of `component`, e.g. `data['X']`"""
+        try:
+            return self.values[:, self.components.index(component)]
+        except ValueError:
+            raise KeyError(component)
+
+
+def concatenate(data_list):
+    """
+    Join several `GeomagData` of the same components, e.g. consecutive
+    monthly files, into one, sorted by time
+
+    Returns
+    -------
+    `GeomagData` with the metadata of the first of `data_list`
+
+    Raises
+    ------
+    ValueError if `data_list` is empty or the components differ
+    """
+    if not data_list:
+        raise ValueError('nothing to concatenate')
+    components = data_list[0].components
+    for data in data_list[1:]:
+        if data.components != components:
+            raise ValueError(safe_format(
+                'cannot concatenate components {} with {}',
+                data.components, components
+            ))
+    times = np.concatenate([data.times for data in data_list])
+    values = np.concatenate([data.values for data in data_list])
+    order = np.argsort(times, kind='mergesort')
+    return GeomagData(times[order], values[order], components,
+                      dict(data_list[0].metadata))
+
+
+def read_iaga2002(path):
+    """
+    Read an IAGA-2002 format file, e.g. 'esk201501dmin.min'
+
+    Parameters
+    ----------
+    path: file path as string
+
+    Returns
+    -------
+    `GeomagData`, with the header fields as `metadata`: keys in
+        lower_snake_case (e.g. 'iaga_code', 'reported',
+        'data_interval_type'), latitude, longitude and elevation as float,
+        comment lines under 'comments'
+
+    Raises
+    ------
+    ReaderError if the file is not IAGA-2002 format
+    """
+    with open(path, 'rb') as file_:
+        content = file_.read()
+    return parse_iaga2002(content)
+
+
+def parse_iaga2002(content):
+    """
+    Parse the bytes of an IAGA-2002 format file, see `read_iaga2002`
+    """
+    metadata, components, data_start = _iaga2002_layout(content)
+    times, values = _parse_iaga2002_block(content[data_start:],
+                                          len(components))
+    return GeomagData(times, values, components, metadata)
+
+
+def _iaga2002_layout(content):
+    """
+    the header `metadata`, the `components` and the offset at which the
+    data block starts, from the bytes `content` of an IAGA-2002 file,
+    which need only run to the end of the 'DATE TIME DOY...' line
+    """
+    header_start = _find_iaga2002_column_header(content)
+    data_start = content.find(b'\n', header_start) + 1
+    if data_start == 0:
+        data_start = len(content)
+    metadata = parse_iaga2002_header(content[:header_start])
+    column_names = bytes(content[header_start:data_start]).decode('ascii')
+    # e.g. DATE TIME DOY ESKX ESKY ESKZ ESKF |
+    value_names = [name for name in column_names.split()[3:] if name != '|']
+    code = metadata.get('iaga_code', '')
+    components = [
+        name[len(code):] if code and name.startswith(code) else name
+        for name in value_names
+    ]
+    return metadata, components, data_start
+
+
+def parse_iaga2002_header(header):
+    """
+    The header fields (and comments) of an IAGA-2002 file,
+    from the bytes preceding the 'DATE TIME DOY...' line.
+    See `read_iaga2002` for the keys.
+    """
+    metadata = {}
+    comments = []
+    for line in header.decode('ascii', 'replace').splitlines():
+        line = line.rstrip().rstrip('|')
+        if not line.strip():
+            continue
+        if line.lstrip().startswith('#'):
+            comments.append(line.lstrip().lstrip('#').strip())
+            continue
+        # field names fill the first 24 columns, values follow
+        key = '_'.join(line[:24].lower().split())
+        metadata[key] = line[24:].strip()
+    for key in _NUMERIC_HEADERS:
+        try:
+            metadata[key] = float(metadata[key])
+        except (KeyError, ValueError):
+            pass
+    if comments:
+        metadata['comments'] = comments
+    return metadata
+
+
+def _find_iaga2002_column_header(content):
+    """offset of the 'DATE TIME DOY...' line ending the header"""
+    if content[:5] == b'DATE ':
+        return 0
+    offset = content.find(b'\nDATE ')
+    if offset < 0:
+        raise ReaderError('no IAGA-2002 "DATE TIME DOY" column header found')
+    return offset + 1
+
+
+def _parse_iaga2002_block(data, num_components):
+    """
+    `times`, `values` arrays of the IAGA-2002 data block `data`,
+    all lines of which are parsed together where they are of equal width
+    """
+    if not data.strip():
+        return (np.empty(0, dtype='datetime64[ms]'),
+                np.empty((0, num_components)))
+    stop = _IAGA2002_COLUMNS_START + num_components * _IAGA2002_COLUMN_WIDTH
+    block = _as_fixed_width(data)
+    if block is None or block.shape[1] < stop:
+        return _parse_ragged_iaga2002_block(data, num_components)
+
+    return (_decode_iaga2002_times(block),
+            _decode_iaga2002_values(block, range(num_components)))
+
+
+def _decode_iaga2002_times(block):
+    """
+    `datetime64[ms]` times of the rows of a fixed width IAGA-2002 `block`
+    """
+    # year, month, day, hour, minute, second, millisecond from
+    #   'YYYY-MM-DD HH:MM:SS.mmm' in one matrix product
+    digits, _ = _digit_values(block[:, :23])
+    stamp = digits.dot(_IAGA2002_TIME_PLACES).astype(np.int64)
+    days = _days_since_epoch(stamp[:, 0], stamp[:, 1], stamp[:, 2])
+    millis = stamp[:, 3:].dot([3600000, 60000, 1000, 1])
+    return (days * 86400000 + millis).astype('datetime64[ms]')
+
+
+def _decode_iaga2002_values(block, columns):
+    """
+    float values, missing as NaN, of the value `columns` (0 for the first
+    component) of the rows of a fixed width IAGA-2002 `block`
+    """
+    values = np.column_stack([
+        _fixed_point_columns(
+            block[:, start:start + _IAGA2002_COLUMN_WIDTH],
+            _IAGA2002_COLUMN_WIDTH
+        )
+        for start in (_IAGA2002_COLUMNS_START +
+                      column * _IAGA2002_COLUMN_WIDTH for column in columns)
+    ]) if len(columns) else np.empty((len(block), 0))
+    values[values >= IAGA2002_MISSING] = np.nan
+    return values
+
+
+class MappedIAGA2002(object):
+    """
+    Lazy, memory-mapped access to one IAGA-2002 file.
+
+    Only the header is read when we are opened. The data block is
+    fixed width with one row per sample interval, so the row holding
+    any time is computed from its timestamp and only the rows wanted
+    are ever read and decoded.
+
+    Parameters
+    ----------
+    path: file path as string
+
+    Attributes
+    ----------
+    path: file path as string
+    metadata: dict
+        header fields, as for `read_iaga2002`
+    components: list of string
+        e.g. ['X', 'Y', 'Z', 'F']
+    start: `numpy.datetime64`
+        time of the first sample
+    end: `numpy.datetime64`
+        time just after the last sample
+    interval: `numpy.timedelta64`
+        time between the first two samples
+    rows: `numpy.ndarray` of `uint8`, shape (samples, line width)
+        a view of the mapped data block; each row is one line, without
+        its line ending
+
+    Raises
+    ------
+    ReaderError if the file is not IAGA-2002 format
+    """
+    def __init__(self, path):
+        """ see class docstring """
+        self.path = path
+        with open(path, 'rb') as file_:
+            self._map = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.metadata, self.components, data_start = \
+                _iaga2002_layout(self._map)
+            self.rows = self._index_rows(data_start)
+        except Exception:
+            self.close()
+            raise
+        self._row_times = None
+        if len(self.rows):
+            first_last = _decode_iaga2002_times(self.rows[[0, -1]])
+            self.start = first_last[0]
+            self.interval = (
+                _decode_iaga2002_times(self.rows[1:2])[0] - self.start
+                if len(self.rows) > 1 else np.timedelta64(1, 'm')
+            )
+            self.end = first_last[1] + self.interval
+            if first_last[1] != \
+                    self.start + (len(self.rows) - 1) * self.interval:
+                # rows not evenly spaced: search the times instead
+                self._row_times = _decode_iaga2002_times(self.rows)
+        else:
+            self.start = self.end = np.datetime64('NaT', 'ms')
+            self.interval = np.timedelta64(1, 'm')
+
+    def __repr__(self):
+        return safe_format('{}({})', self.__class__.__name__,
+                           repr(self.path))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """release the memory map"""
+        self.rows = None
+        self._map.close()
+
+    def row_span(self, start=None, end=None):
+        """
+        `(first, stop)` rows of the samples at or after `start` and before
+        `end`, either of which may be `None` for no limit
+        """
+        first, stop = 0, len(self.rows)
+        if self._row_times is not None:
+            if start is not None:
+                first = self._row_times.searchsorted(_as_ms(start))
+            if end is not None:
+                stop = self._row_times.searchsorted(_as_ms(end))
+            return first, max(first, stop)
+        if start is not None:
+            first = -((self.start - _as_ms(start)) // self.interval)
+        if end is not None:
+            stop = -((self.start - _as_ms(end)) // self.interval)
+        first = int(min(max(first, 0), len(self.rows)))
+        stop = int(min(max(stop, first), len(self.rows)))
+        return first, stop
+
+    def read(self, start=None, end=None, components=None):
+        """
+        Decode the samples at or after `start` and before `end`
+
+        Parameters
+        ----------
+        start, end: `datetime.datetime`, `numpy.datetime64`, string,
+            or (default) `None` for the start or end of the file
+        components: list of string or (default) `None` for all
+
+        Returns
+        -------
+        `GeomagData` of just the samples and components wanted
+
+        Raises
+        ------
+        KeyError if any of `components` are not in the file
+        """
+        if components is None:
+            components = self.components
+        columns = [self._column(component) for component in components]
+        first, stop = self.row_span(start, end)
+        rows = self.rows[first:stop]
+        return GeomagData(_decode_iaga2002_times(rows),
+                          _decode_iaga2002_values(rows, columns),
+                          components, dict(self.metadata))
+
+    def _column(self, component):
+        """index of `component` amongst the value columns"""
+        try:
+            return self.components.index(component)
+        except ValueError:
+            raise KeyError(component)
+
+    def _index_rows(self, data_start):
+        """
+        view the mapped data block as a 2-D array of rows, or, if the
+        lines differ in width, copy them into one padded to fixed width
+
+        The width of every row is taken from the first, and checked only
+        against the size of the block and where its last line ends, so
+        the rows between are not read until they are asked for.
+        """
+        data = np.frombuffer(self._map, dtype=np.uint8)[data_start:]
+        if len(data) == 0:
+            return np.empty((0, _IAGA2002_COLUMNS_START), dtype=np.uint8)
+        first_newline = self._map.find(b'\n', data_start)
+        if first_newline < 0:  # a single line, lacking its line ending
+            first_newline = len(self._map)
+        width = first_newline - data_start + 1
+        ending = 2 if width > 1 and data[width - 2] == ord('\r') else 1
+        nbytes = len(data)
+        if data[-1] != ord('\n'):
+            # the last line lacks its line ending
+            nbytes += ending
+        if nbytes % width == 0:
+            return np.lib.stride_tricks.as_strided(
+                data, shape=(nbytes // width, width - ending),
+                strides=(width, 1), writeable=False
+            )
+        lines = bytes(data).replace(b'\r', b'').splitlines()
+        width = max(len(line) for line in lines)
+        padded = b''.join(line.ljust(width) for line in lines)
+        return np.frombuffer(padded, dtype=np.uint8).reshape(-1, width)
+
+
+class IAGA2002Archive(object):
+    """
+    Lazy access to a directory of IAGA-2002 files, such as the `saveroot`
+    that `consume_webservices.fetch_data` downloads minute data to.
+
+    Each file is memory-mapped by `MappedIAGA2002`; only their headers are
+    read until samples are asked for, and then only the files and rows
+    covering the time wanted.
+
+    Parameters
+    ----------
+    root: file path as string
+        directory holding the files
+    pattern: string, default '*.min'
+        glob pattern of the file names within `root`
+
+    Attributes
+    ----------
+    files: list of `MappedIAGA2002`
+        sorted by station, then start time
+    stations: list of string
+        IAGA codes of every station in the archive
+    """
+    def __init__(self, root, pattern='*.min'):
+        """ see class docstring """
+        self.root = root
+        self.files = []
+        try:
+            for path in sorted(glob.glob(os.path.join(root, pattern))):
+                self.files.append(MappedIAGA2002(path))
+        except Exception:
+            self.close()
+            raise
+        self.files.sort(key=lambda mapped: (self._code(mapped),
+                                            mapped.start))
+        self.stations = sorted({self._code(mapped) for mapped in self.files})
+
+    def __repr__(self):
+        return safe_format('{}({})', self.__class__.__name__,
+                           repr(self.root))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """release the memory maps of every file"""
+        for mapped in self.files:
+            mapped.close()
+
+    def read(self, station=None, start=None, end=None, components=None):
+        """
+        Decode the samples of `station` at or after `start` and before
+        `end`, from only the files covering that time
+
+        Parameters
+        ----------
+        station: string or (default) `None`
+            IAGA code e.g. 'ESK'; may be left out if the archive
+            holds only one station
+        start, end, components:
+            as for `MappedIAGA2002.read`
+
+        Returns
+        -------
+        `GeomagData`, sorted by time
+
+        Raises
+        ------
+        KeyError if we hold no data for `station`
+        ValueError if `station` is left out and we hold several
+        """
+        if station is None:
+            if len(self.stations) != 1:
+                raise ValueError(safe_format(
+                    'say which station to read, from {}', self.stations
+                ))
+            station = self.stations[0]
+        station = station.upper()
+        files = [mapped for mapped in self.files
+                 if self._code(mapped) == station]
+        if not files:
+            raise KeyError(station)
+        wanted = [
+            mapped for mapped in files if len(mapped) and
+            (start is None or mapped.end > _as_ms(start)) and
+            (end is None or mapped.start < _as_ms(end))
+        ] or files[:1]
+        return concatenate([mapped.read(start, end, components)
+                            for mapped in wanted])
+
+    @staticmethod
+    def _code(mapped):
+        """IAGA code of the station of a mapped file"""
+        code = mapped.metadata.get('iaga_code') or \
+            os.path.basename(mapped.path)[:3]
+        return code.upper()
+
+
+def _as_ms(when):
+    """`when` as a `numpy.datetime64` in milliseconds"""
+    return np.datetime64(when, 'ms')
+
+
+def read_wdc(path):
+    """
+    Read a WDC format file of hourly values, e.g. 'ngk2015.wdc'
+
+    Each 120 character record holds one element for one day: a tabular
+    base, 24 hourly values relative to it, and a daily mean. The whole
+    file is decoded at once, as fixed-width columns.
+
+    Parameters
+    ----------
+    path: file path as string
+
+    Returns
+    -------
+    `GeomagData` with one row per hour, stamped at the middle of the hour,
+        from the first to the last day in the file (days with no record
+        are NaN), and a column for each element, in the order they first
+        appear. Intensities are in nT; angles (D, I) in minutes of arc.
+        `metadata` holds the 'iaga_code', plus 'daily_means', an array
+        of one row per day.
+
+    Raises
+    ------
+    ReaderError if the file is not WDC format, or holds more than
+        one station
+    """
+    with open(path, 'rb') as file_:
+        content = file_.read()
+    return parse_wdc(content)
+
+
+def parse_wdc(content):
+    """
+    Parse the bytes of a WDC format file, see `read_wdc`
+    """
+    block = _as_fixed_width(content) if content.strip() else None
+    if block is None or block.shape[1] != _WDC_RECORD_WIDTH:
+        raise ReaderError(safe_format(
+            'WDC format needs records of exactly {} characters',
+            _WDC_RECORD_WIDTH
+        ))
+    codes = np.unique(np.ascontiguousarray(block[:, :3]).view('S3'))
+    if len(codes) != 1:
+        raise ReaderError(safe_format('expected one station, found {}',
+                                      [code.decode() for code in codes]))
+
+    # year in century and month, then day, the Q/D-day flags and their
+    #   element letter (not decoded), and century
+    year_month = _signed_integers(block[:, 3:7], [2, 2])
+    day = _signed_integers(block[:, 8:10], [2])[:, 0]
+    century = _signed_integers(block[:, 14:16], [2])[:, 0]
+    century = np.where(century == 0, 19, century)
+    days = _days_since_epoch(century * 100 + year_month[:, 0],
+                             year_month[:, 1], day)
+    day_index = days - days.min()
+    # order components as they first appear, e.g. X Y Z F
+    elements, first_seen, element_index = np.unique(
+        block[:, 7], return_index=True, return_inverse=True
+    )
+    order = np.argsort(first_seen)
+    elements = elements[order]
+    component_index = np.argsort(order)[element_index.ravel()]
+
+    numbers = _signed_integers(block[:, 16:], [4] * 26)
+    base, hourly, daily = numbers[:, :1], numbers[:, 1:25], numbers[:, 25]
+    hourly = hourly.astype(np.float64)
+    daily = daily.astype(np.float64)
+    hourly[hourly == WDC_MISSING] = np.nan
+    daily[daily == WDC_MISSING] = np.nan
+    is_angle = np.isin(block[:, 7], _WDC_ANGLES)
+    # base in 100 nT; or for angles, degrees with values in 0.1 minute
+    scale = np.where(is_angle, 0.1, 1.0)
+    offset = np.where(is_angle, 60.0, 100.0) * base[:, 0]
+    hourly = hourly * scale[:, None] + offset[:, None]
+    daily = daily * scale + offset
+
+    num_days = day_index.max() + 1
+    values = np.full((num_days, 24, len(elements)), np.nan)
+    values[day_index, :, component_index] = hourly
+    daily_means = np.full((num_days, len(elements)), np.nan)
+    daily_means[day_index, component_index] = daily
+
+    first_day = np.datetime64(int(days.min()), 'D').astype('datetime64[ms]')
+    times = first_day + np.arange(num_days * 24).astype('timedelta64[h]') \
+        + np.timedelta64(30, 'm')
+    metadata = {
+        'iaga_code': codes[0].decode('ascii'),
+        'daily_means': daily_means,
+    }
+    return GeomagData(times, values.reshape(num_days * 24, len(elements)),
+                      [chr(element) for element in elements], metadata)
+
+
+def write_npz(data, path, dtype=None):
+    """
+    Save `data` to a compressed NumPy archive, e.g. 'esk201501dmin.npz',
+    which `read_npz` loads back
+
+    Parameters
+    ----------
+    data: `GeomagData`
+    path: file path as string
+    dtype: NumPy dtype or (default) `None`
+        store the values as this, e.g. `numpy.float32` for half the size;
+        by default as they are
+
+    Notes
+    -----
+    Written to a temporary file then renamed, so `path` is never left
+    half written. The metadata are kept as JSON, bar any arrays
+    (e.g. WDC 'daily_means'), which are kept as arrays.
+    """
+    values = data.values if dtype is None else data.values.astype(dtype)
+    arrays = {
+        _NPZ_METADATA_PREFIX + key: value
+        for key, value in data.metadata.items()
+        if isinstance(value, np.ndarray)
+    }
+    metadata = {key: value for key, value in data.metadata.items()
+                if not isinstance(value, np.ndarray)}
+    partial = path + '.tmp'
+    with open(partial, 'wb') as file_:
+        np.savez_compressed(
+            file_, times=data.times.astype('datetime64[ms]'), values=values,
+            components=np.array(data.components),
+            metadata=np.array(json.dumps(metadata, sort_keys=True)),
+            **arrays
+        )
+    os.replace(partial, path)
+
+
+def read_npz(path):
+    """
+    Load a `GeomagData` saved by `write_npz`
+
+    Raises
+    ------
+    ReaderError if the file was not written by `write_npz`
+    """
+    archive = np.load(path)
+    if not isinstance(archive, np.lib.npyio.NpzFile):
+        raise ReaderError(safe_format('{} is not a saved GeomagData', path))
+    with archive:
+        try:
+            metadata = json.loads(str(archive['metadata']))
+            times = archive['times']
+            values = archive['values']
+            components = [str(name) for name in archive['components']]
+        except KeyError as err:
+            raise ReaderError(safe_format(
+                '{} is not a saved GeomagData: no {}', path, err
+            ))
+        for name in archive.files:
+            if name.startswith(_NPZ_METADATA_PREFIX):
+                metadata[name[len(_NPZ_METADATA_PREFIX):]] = archive[name]
+    return GeomagData(times, values, components, metadata)
+
+
+# reader for each file name extension of the text formats we convert
+TEXT_READERS = {'.min': read_iaga2002, '.wdc': read_wdc}
+
+
+class NpzConverter(object):
+    """
+    Post-extraction stage for `consume_webservices.fetch_station_data`
+    (its `convert` argument): re-save each downloaded data file as a
+    compressed NumPy archive alongside it, via `write_npz`.
+
+    A month of IAGA-2002 minute text is ~3MB; as float32 it is ~0.7MB
+    before compression, and loads without parsing.
+
+    Parameters
+    ----------
+    dtype: NumPy dtype or (default) `None`
+        as for `write_npz`, e.g. `numpy.float32`
+    keep_text: bool, default `True`
+        keep the original text files, or delete them once converted
+
+    Example
+    -------
+    >>> fetch_data(..., convert=NpzConverter(numpy.float32, keep_text=False))
+    """
+    def __init__(self, dtype=None, keep_text=True):
+        """ see class docstring """
+        self.dtype = dtype
+        self.keep_text = keep_text
+
+    def __repr__(self):
+        return safe_format('{}({}, keep_text={})', self.__class__.__name__,
+                           repr(self.dtype), repr(self.keep_text))
+
+    def __call__(self, files):
+        """
+        convert `files` (paths) where we know their format; others,
+        e.g. READMEs, are passed over
+
+        Returns
+        -------
+        list of the paths to the converted files, the original text
+            if kept, and any files not converted
+        """
+        kept = []
+        for path in files:
+            stem, ext = os.path.splitext(path)
+            if ext.lower() not in TEXT_READERS:
+                kept.append(path)
+                continue
+            data = TEXT_READERS[ext.lower()](path)
+            write_npz(data, stem + '.npz', self.dtype)
+            kept.append(stem + '.npz')
+            if self.keep_text:
+                kept.append(path)
+            else:
+                os.remove(path)
+        return kept
+
+
+def _signed_integers(region, widths):
+    """
+    the integers written in the fields of `widths` characters across
+    `region`, one column per field, with blanks as 0.
+    Place-value arithmetic where `region` is plain digits, spaces and
+    minus signs, otherwise numpy's own string conversion.
+
+    Raises
+    ------
+    ReaderError if a field is not an integer, giving its line number,
+        counting each row of `region` as a line
+    """
+    digits, plain = _digit_values(region)
+    starts = np.cumsum([0] + list(widths))
+    places = np.zeros((region.shape[1], len(widths)))
+    for field, (start, stop) in enumerate(zip(starts[:-1], starts[1:])):
+        places[start:stop, field] = 10.0 ** np.arange(stop - start - 1, -1, -1)
+    if not plain:
+        return np.column_stack([
+            _parse_integer_field(np.ascontiguousarray(
+                region[:, start:stop]).view('S' + str(stop - start)).ravel())
+            for start, stop in zip(starts[:-1], starts[1:])
+        ])
+    integers = digits.dot(places).astype(np.int64)
+    minus = (region == ord('-')).astype(np.float64).dot(places) > 0
+    integers[minus] *= -1
+    return integers
+
+
+def _parse_integer_field(field):
+    """
+    the integers in `field`, an array of byte strings, with blanks as 0,
+    see `_signed_integers`
+    """
+    field = np.where(np.char.strip(field) == b'', b'0', field)
+    try:
+        return field.astype(np.int64)
+    except ValueError:
+        for line_num, text in enumerate(field, 1):
+            try:
+                int(text)
+            except ValueError:
+                raise ReaderError(safe_format(
+                    'line {}: expected an integer, not {}', line_num,
+                    repr(text.decode('ascii', 'replace'))
+                ))
+        raise
+
+
+def _digit_values(chars):
+    """
+    float array of the digit values of the ASCII `chars`, 0 where not a
+    digit, and whether all of `chars` could be part of a plain number
+    (digits, space and punctuation, but no letters)
+    """
+    # characters before '0' wrap around to >= 208 in uint8
+    digits = chars - np.uint8(ord('0'))
+    is_digit = digits < 10
+    plain = not (~is_digit & (digits < 256 - ord('0') + ord(' '))).any()
+    return (digits * is_digit).astype(np.float64), plain
+
+
+def _fixed_point_columns(region, width):
+    """
+    the floats written in each `width` character field across `region`,
+    one column per field.
+    Place-value arithmetic when each field has its decimal point in the
+    same place on every row (as IAGA-2002's F10.2), otherwise numpy's
+    own string conversion.
+    """
+    num_fields = region.shape[1] // width
+    if not len(region):
+        return np.empty((0, num_fields))
+    digits, plain = _digit_values(region)
+    places = np.zeros((region.shape[1], num_fields))
+    for field in range(num_fields):
+        start = field * width
+        first_row = region[0, start:start + width]
+        point_at = start + (first_row == ord('.')).argmax()
+        if not (plain and (region[:, point_at] == ord('.')).all()):
+            return np.column_stack([
+                np.ascontiguousarray(region[:, col:col + width]).view(
+                    'S' + str(width)).ravel().astype(np.float64)
+                for col in range(0, region.shape[1], width)
+            ])
+        places[start:point_at, field] = \
+            10.0 ** np.arange(point_at - start - 1, -1, -1)
+        places[point_at + 1:start + width, field] = \
+            10.0 ** -np.arange(1, start + width - point_at)
+    values = digits.dot(places)
+    negative = (region == ord('-')).reshape(len(region), num_fields, width)
+    values[negative.any(axis=2)] *= -1
+    return values
+
+
+def _days_since_epoch(year, month, day):
+    """
+    days since 1970-01-01 of arrays of proleptic Gregorian dates,
+    after Howard Hinnant's `days_from_civil`
+    """
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 \
+        + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 \
+        + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def _parse_ragged_iaga2002_block(data, num_components):
+    """
+    slower fallback to `_parse_iaga2002_block`, for data blocks whose
+    lines are not all the same width
+    """
+    lines = data.decode('ascii').split()
+    width = 3 + num_components
+    if len(lines) % width:
+        raise ReaderError('IAGA-2002 data block has incomplete lines')
+    fields = np.array(lines, dtype=object).reshape(-1, width)
+    times = (fields[:, 0] + 'T' + fields[:, 1]).astype('datetime64[ms]')
+    values = fields[:, 3:].astype(np.float64)
+    values[values >= IAGA2002_MISSING] = np.nan
+    return times, values
+
+
+def _as_fixed_width(data):
+    """
+    View `data` as a 2-D `uint8` array with one row per line
+    (without line endings), or `None` if the lines differ in width
+    """
+    first_end = data.find(b'\n')
+    if first_end < 0:
+        data += b'\n'
+        first_end = len(data) - 1
+    elif not data.endswith(b'\n'):
+        data += b'\n'
+    width = first_end + 1
+    if len(data) % width:
+        return None
+    block = np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+    if not (block[:, -1] == ord('\n')).all():
+        return None
+    # drop '\n' and any '\r'
+    ending = 2 if width > 1 and block[0, -2] == ord('\r') else 1
+    return block[:, :width - ending]
@@ -0,0 +1,188 @@
+"""
+resume module
+
+Downloads which survive a dropped connection. The response body is
+written to a '.part' file under the download directory, with a JSON
+checkpoint beside it recording which request it answers, how many bytes
+have arrived and the ETag or Last-Modified the server sent. When the
+request is sent again (by a `transport.RetryPolicy`, or a later run)
+only the bytes still missing are asked for, with a 'Range' header.
+
+The server may ignore the range and answer in full, or refuse it; either
+way we start again from byte zero. Ranges count bytes of the body as
+sent, so we ask for it uncompressed (`IDENTITY`); a body the server
+compresses anyway is not resumed.
+
+@author: W. Brown
+"""
+import json
+import os
+import re
+
+import requests as rq
+
+from gmdata_webinterface.jsonfile import save_json
+from gmdata_webinterface.sandboxed_format import safe_format
+
+PART_SUFFIX = '.part'
+CHECKPOINT_SUFFIX = '.part.json'
+# how often, in bytes received, the checkpoint is brought up to date
+CHECKPOINT_INTERVAL = 1024 ** 2
+RECEIVE_CHUNK_SIZE = 64 * 1024
+# headers asking for the body as it is, not compressed in transit
+IDENTITY = {'Accept-Encoding': 'identity'}
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class PartialDownload(object):
+    """
+    The body of one response, downloaded to `folder`, or as much of it
+    as has arrived so far
+
+    Parameters
+    ----------
+    folder: file path as string
+        directory the '.part' file and its checkpoint are kept in
+    fingerprint: string
+        identifies the request answered, e.g. `DataRequest.fingerprint`;
+        a checkpoint for any other request is ignored
+
+    Attributes
+    ----------
+    path: string
+        path of the '.part' file
+    nbytes: int
+        bytes received so far
+    etag, last_modified: string or `None`
+        the response validators, from its headers
+    """
+    def __init__(self, folder, fingerprint):
+        """ see class docstring """
+        self.fingerprint = fingerprint
+        self.path = os.path.join(folder, '.gmdata-' + fingerprint +
+                                 PART_SUFFIX)
+        self.checkpoint_path = os.path.join(
+            folder, '.gmdata-' + fingerprint + CHECKPOINT_SUFFIX
+        )
+        self.nbytes = 0
+        self.etag = None
+        self.last_modified = None
+        self._load()
+
+    def __repr__(self):
+        return safe_format('{}({}, nbytes={})', self.__class__.__name__,
+                           repr(self.path), self.nbytes)
+
+    def _load(self):
+        """pick up from any checkpoint left for this request"""
+        try:
+            with open(self.checkpoint_path) as file_:
+                checkpoint = json.load(file_)
+            size = os.path.getsize(self.path)
+        except (OSError, ValueError):
+            return
+        if checkpoint.get('fingerprint') != self.fingerprint:
+            return
+        # bytes written after the last checkpoint cannot be trusted
+        self.nbytes = min(checkpoint.get('bytes', 0), size)
+        self.etag = checkpoint.get('etag')
+        self.last_modified = checkpoint.get('last_modified')
+
+    def checkpoint(self):
+        """record how far we have got, replacing the old record in one step"""
+        save_json(self.checkpoint_path, {
+            'fingerprint': self.fingerprint,
+            'bytes': self.nbytes,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+        })
+
+    def range_headers(self):
+        """
+        headers asking for the rest of the body, or `{}` if there is
+        nothing to resume. 'If-Range' makes the server send the whole
+        body instead should it have changed since.
+        """
+        validator = self.etag or self.last_modified
+        if not self.nbytes or validator is None:
+            return {}
+        return {'Range': safe_format('bytes={}-', self.nbytes),
+                'If-Range': validator}
+
+    def accepts(self, response):
+        """
+        Can the body of `response` be written to the '.part' file?
+        A full (200) response restarts it from byte zero; a partial
+        (206) one must carry on from where we got to.
+
+        Returns
+        -------
+        `False`, having discarded what we had, if the server refused the
+            range, sent the wrong one or compressed it, and the request
+            should be sent again without it
+        """
+        encoded = response.headers.get('Content-Encoding',
+                                       'identity') != 'identity'
+        if response.status_code == rq.codes.partial_content:
+            match = _CONTENT_RANGE.match(
+                response.headers.get('Content-Range', '')
+            )
+            if match and int(match.group(1)) == self.nbytes and \
+                    not encoded:
+                return True
+        elif response.status_code != \
+                rq.codes.requested_range_not_satisfiable:
+            self.nbytes = 0
+            if encoded:
+                # we write it decoded, so cannot resume it by offset
+                self.etag = self.last_modified = None
+            else:
+                self.etag = response.headers.get('ETag')
+                self.last_modified = response.headers.get('Last-Modified')
+            return True
+        self.discard()
+        return False
+
+    def receive(self, response, chunk_size=RECEIVE_CHUNK_SIZE):
+        """
+        Append the body of `response`, accepted by `accepts`, to the
+        '.part' file, checkpointing as it arrives and if it stops short
+
+        Returns
+        -------
+        int bytes received
+        """
+        received = 0
+        since_checkpoint = 0
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode) as file_:
+            file_.seek(self.nbytes)
+            file_.truncate()
+            try:
+                for chunk in response.iter_content(chunk_size):
+                    file_.write(chunk)
+                    self.nbytes += len(chunk)
+                    received += len(chunk)
+                    since_checkpoint += len(chunk)
+                    if since_checkpoint >= CHECKPOINT_INTERVAL:
+                        file_.flush()
+                        self.checkpoint()
+                        since_checkpoint = 0
+            finally:
+                file_.flush()
+                self.checkpoint()
+        return received
+
+    def open(self):
+        """the '.part' file, open for reading"""
+        return open(self.path, 'rb')
+
+    def discard(self):
+        """delete the '.part' file and its checkpoint"""
+        for path in (self.path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.nbytes = 0
+        self.etag = None
+        self.last_modified = None
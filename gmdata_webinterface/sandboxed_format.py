@@ -2,9 +2,17 @@
 Based on
 [Armin Robnacher's post](http://lucumr.pocoo.org/2016/12/29/careful-with-str-format/)
 about not exposing internals by letting users access `str().format()`
+
+Format strings are parsed once into a `SafeTemplate`, kept in an LRU
+cache, so formatting the same string repeatedly (e.g. in a loop) only
+pays for the rendering.
 """
 from string import Formatter
-from collections import Mapping
+from collections.abc import Mapping
+from functools import lru_cache
+
+# most distinct format strings kept parsed by `get_template`
+TEMPLATE_CACHE_SIZE = 256
 
 
 class MagicFormatMapping(Mapping):
@@ -108,7 +116,87 @@ def safe_getattr(obj, attr):
     return getattr(obj, attr)
 
 
+class SafeTemplate(object):
+    """
+    A format string parsed once, to be rendered many times with the same
+    attribute-safety checks as `SafeFormatter`.
+
+    Parameters
+    ----------
+    fmt: string
+        `str.format` style format string e.g. 'esk{}{:02d}'
+
+    Raises
+    ------
+    ValueError if `fmt` is not a valid format string
+    """
+    def __init__(self, fmt):
+        """ see class docstring """
+        self.fmt = fmt
+        self._parts = []
+        auto_index = 0
+        manual = False
+        for literal, field_name, spec, conversion in Formatter().parse(fmt):
+            if field_name is None:
+                self._parts.append((literal, None, None, None, None))
+                continue
+            if '{' in spec:
+                # nested fields in the spec: leave it all to the formatter
+                self._parts = None
+                return
+            if field_name == '' or field_name[0] in '.[':
+                if manual:
+                    raise ValueError('cannot switch from manual field '
+                                     'specification to automatic field '
+                                     'numbering')
+                field_name = str(auto_index) + field_name
+                auto_index += 1
+            elif field_name.isdigit():
+                if auto_index:
+                    raise ValueError('cannot switch from automatic field '
+                                     'numbering to manual field '
+                                     'specification')
+                manual = True
+            first, rest = formatter_field_name_split(field_name)
+            self._parts.append((literal, first, list(rest), spec, conversion))
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, repr(self.fmt))
+
+    def render(self, *args, **kwargs):
+        """`self.fmt` formatted with `args` and `kwargs`"""
+        if self._parts is None:
+            return SafeFormatter().vformat(
+                self.fmt, args, MagicFormatMapping(args, kwargs)
+            )
+        out = []
+        for literal, first, rest, spec, conversion in self._parts:
+            out.append(literal)
+            if first is None:
+                continue
+            obj = args[first] if isinstance(first, int) else kwargs[first]
+            for is_attr, i in rest:
+                if is_attr:
+                    obj = safe_getattr(obj, i)
+                else:
+                    obj = obj[i]
+            if conversion == 's':
+                obj = str(obj)
+            elif conversion == 'r':
+                obj = repr(obj)
+            elif conversion == 'a':
+                obj = ascii(obj)
+            elif conversion is not None:
+                raise ValueError('Unknown conversion specifier ' + conversion)
+            out.append(format(obj, spec))
+        return ''.join(out)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_template(fmt):
+    """the `SafeTemplate` of `fmt`, parsed only the first time asked for"""
+    return SafeTemplate(fmt)
+
+
 def safe_format(_string, *args, **kwargs):
-    formatter = SafeFormatter()
-    kwargs = MagicFormatMapping(args, kwargs)
-    return formatter.vformat(_string, args, kwargs)
+    return get_template(_string).render(*args, **kwargs)
@@ -0,0 +1,105 @@
+"""tests for indexing and querying a directory of downloaded data"""
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from gmdata_webinterface import archive
+from gmdata_webinterface.archive import ArchiveIndex
+from gmdata_webinterface.readers import (
+    read_iaga2002, read_wdc, concatenate, NpzConverter
+)
+
+ORACLEPATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'test_data', 'known_good'
+)
+MONTHS = ['esk2015{:02d}dmin.min'.format(month) for month in (1, 2, 3)]
+
+
+@pytest.fixture
+def saveroot(tmpdir):
+    """a download directory holding three months of ESK and a year of NGK"""
+    for name in MONTHS + ['ngk2015.wdc']:
+        shutil.copy(os.path.join(ORACLEPATH, name), str(tmpdir))
+    return str(tmpdir)
+
+
+def test_index_entries(saveroot):
+    """station, cadence and period found from the files themselves"""
+    index = ArchiveIndex(saveroot)
+    index.scan()
+    assert index.stations == ['ESK', 'NGK']
+    assert [entry['key'] for entry in index.entries()] == [
+        'ESK/minute/201501', 'ESK/minute/201502', 'ESK/minute/201503',
+        'NGK/hour/2015'
+    ]
+    jan = index.entries('esk')[0]
+    assert jan['path'] == os.path.join(saveroot, MONTHS[0])
+    assert jan['bytes'] == os.path.getsize(jan['path'])
+    assert jan['first'] == '2015-01-01T00:00:00.000'
+    assert jan['last'] == '2015-01-31T23:59:00.000'
+    assert jan['components'] == ['X', 'Y', 'Z', 'F']
+    # saved alongside the data
+    assert len(ArchiveIndex(saveroot)) == 4
+
+
+def test_query_opens_only_needed(saveroot, monkeypatch):
+    """a window is read from just the files covering it"""
+    index = ArchiveIndex(saveroot)
+    index.scan()
+    opened = []
+    real_read_window = archive._read_window  # pylint: disable=protected-access
+
+    def spy_read_window(path, *args):
+        opened.append(os.path.basename(path))
+        return real_read_window(path, *args)
+
+    monkeypatch.setattr(archive, '_read_window', spy_read_window)
+    got = index.query('ESK', '2015-01-31T12:00', '2015-02-01T12:00', ['Z'])
+    assert opened == MONTHS[:2]
+    full = concatenate([read_iaga2002(os.path.join(saveroot, name))
+                        for name in MONTHS[:2]])
+    wanted = (full.times >= np.datetime64('2015-01-31T12:00')) & \
+        (full.times < np.datetime64('2015-02-01T12:00'))
+    np.testing.assert_array_equal(got.times, full.times[wanted])
+    np.testing.assert_array_equal(got['Z'], full['Z'][wanted])
+    assert got.components == ['Z']
+
+    hourly = index.query('NGK', start='2015-06-01', end='2015-06-02')
+    assert len(hourly) == 24
+    assert hourly.components == read_wdc(
+        os.path.join(saveroot, 'ngk2015.wdc')).components
+
+
+def test_query_bad(saveroot):
+    """unknown stations, components and ambiguous cadences"""
+    index = ArchiveIndex(saveroot)
+    index.scan()
+    with pytest.raises(KeyError):
+        index.query('HAD')
+    with pytest.raises(KeyError):
+        index.query('ESK', components=['Q'])
+    with pytest.raises(KeyError):
+        index.query('ESK', cadence='hour')
+    assert len(index.query('ESK', '2016-01-01', '2016-02-01')) == 0
+
+
+def test_index_as_convert_stage(saveroot):
+    """indexed as converted; the columnar copy preferred to the text"""
+    index = ArchiveIndex(saveroot)
+    index.scan()
+    converter = NpzConverter(np.float32)
+    index(converter([os.path.join(saveroot, MONTHS[0])]))
+    jan = index.entries('ESK')[0]
+    assert jan['path'].endswith('esk201501dmin.npz')
+    got = index.query('ESK', '2015-01-31T23:00', '2015-02-01T01:00')
+    assert len(got) == 120
+    # re-indexing the text does not displace it
+    index.add([os.path.join(saveroot, MONTHS[0])])
+    assert index.entries('ESK')[0]['path'].endswith('.npz')
+    # unless it has gone
+    os.remove(jan['path'])
+    index.scan()
+    assert index.entries('ESK')[0]['path'].endswith('.min')
@@ -0,0 +1,228 @@
+"""
+tests for the asyncio API, with the HTTP client replaced by
+canned zip responses
+"""
+import asyncio
+from datetime import date
+import os
+
+import pytest
+
+from gmdata_webinterface import async_webservices as aws
+from gmdata_webinterface.consume_webservices import (
+    ChunkError, FetchError, InvalidRequest, InvalidResponse
+)
+from gmdata_webinterface.tests.helpers import make_zip
+from gmdata_webinterface.tests.mock_server import MockWDCServer
+from gmdata_webinterface.transport import RetryPolicy
+
+FETCH_ARGS = {
+    'start_date': date(2015, 1, 15),
+    'end_date': date(2015, 3, 2),
+    'cadence': 'minute',
+    'service': 'WDC',
+}
+STATIONS = ['ESK', 'LER', 'HAD', 'NGK', 'ABK']
+
+
+def run(coroutine):
+    """run `coroutine` to completion on a fresh event loop"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+# small Mock classes can be weird
+# pylint: disable=missing-docstring, too-few-public-methods
+class MockAsyncResponse(object):
+    def __init__(self, content, status=200, headers=None):
+        self.content = content
+        self.status = status
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    async def read(self):
+        await asyncio.sleep(0.01)
+        return self.content
+
+
+class MockAsyncSession(object):
+    """answers each request with a zip of the months asked for"""
+    def __init__(self, fail_for=()):
+        self.fail_for = fail_for
+        self.requested = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def post(self, url, data, headers):  # pylint: disable=unused-argument
+        datasets = data['datasets'].split(',')
+        self.requested.append(datasets)
+        if any(dset.split('/')[-1][:3] in self.fail_for
+               for dset in datasets):
+            return MockAsyncResponse(b'', 500)
+        return self._respond(make_zip({
+            dset.split('/')[-1] + 'dmin.min': b'data' for dset in datasets
+        }))
+
+    def _respond(self, content):
+        session = self
+
+        class Counted(MockAsyncResponse):
+            async def __aenter__(self):
+                session.in_flight += 1
+                session.max_in_flight = max(session.max_in_flight,
+                                            session.in_flight)
+                return self
+
+            async def __aexit__(self, *_):
+                session.in_flight -= 1
+
+        return Counted(content)
+# pylint: enable=missing-docstring, too-few-public-methods
+
+
+def test_fetch_bounded_by_semaphore(tmpdir):
+    """every station fetched, never more than `max_concurrency` at once"""
+    session = MockAsyncSession()
+    results = run(aws.async_fetch_data(
+        station_list=STATIONS, saveroot=str(tmpdir), session=session,
+        max_concurrency=2, **FETCH_ARGS
+    ))
+    assert list(results) == STATIONS
+    assert session.max_in_flight == 2
+    assert len(os.listdir(str(tmpdir))) == 3 * len(STATIONS)
+    assert sorted(os.path.basename(file_) for file_ in results['LER'].files) \
+        == ['ler201501dmin.min', 'ler201502dmin.min', 'ler201503dmin.min']
+
+
+def test_failures_reported_per_station(tmpdir):  # pylint: disable=invalid-name
+    """a failing station does not abandon the rest"""
+    session = MockAsyncSession(fail_for=('ler',))
+    with pytest.raises(FetchError) as err:
+        run(aws.async_fetch_data(station_list=STATIONS, saveroot=str(tmpdir),
+                                 session=session, **FETCH_ARGS))
+    assert list(err.value.errors) == ['LER']
+    assert err.value.results['ESK'].ok
+    assert len(session.requested) == len(STATIONS)
+
+
+def test_failed_chunks_keep_retries(tmpdir):
+    """a station failing part way still reports its files and retries"""
+    # pylint: disable=too-few-public-methods
+    class FailMarch(MockAsyncSession):
+        def post(self, url, data, headers):
+            if data['datasets'].endswith('201503'):
+                return MockAsyncResponse(b'', 500)
+            return super(FailMarch, self).post(url, data, headers)
+
+    with pytest.raises(FetchError) as err:
+        run(aws.async_fetch_data(
+            station_list=['ESK'], saveroot=str(tmpdir), session=FailMarch(),
+            max_datasets=1, retry=RetryPolicy(max_attempts=2, backoff=0),
+            **FETCH_ARGS
+        ))
+    result = err.value.results['ESK']
+    assert isinstance(result.error, ChunkError)
+    assert len(result.files) == 2
+    assert result.retries == 1
+
+
+def test_chunks_fetched_concurrently(tmpdir):  # pylint: disable=invalid-name
+    """split requests are gathered; a failed chunk costs only itself"""
+    session = MockAsyncSession()
+    result = run(aws.async_fetch_station_data(
+        station='ESK', saveroot=str(tmpdir), session=session, max_datasets=1,
+        **FETCH_ARGS
+    ))
+    assert len(session.requested) == 3
+    assert session.max_in_flight == 3
+    assert len(result.files) == 3
+
+    session = MockAsyncSession()
+    run(aws.async_fetch_station_data(
+        station='ESK', saveroot=str(tmpdir), session=session, max_datasets=1,
+        chunk_concurrency=2, **FETCH_ARGS
+    ))
+    assert len(session.requested) == 3
+    assert session.max_in_flight == 2
+
+    # pylint: disable=too-few-public-methods
+    class FailMarch(MockAsyncSession):
+        def post(self, url, data, headers):
+            if data['datasets'].endswith('201503'):
+                return MockAsyncResponse(b'', 500)
+            return super(FailMarch, self).post(url, data, headers)
+
+    with pytest.raises(ChunkError) as err:
+        run(aws.async_fetch_station_data(
+            station='ESK', saveroot=str(tmpdir), session=FailMarch(),
+            max_datasets=1, **FETCH_ARGS
+        ))
+    assert list(err.value.errors) == ['/wdc/datasets/minute/esk201503']
+    assert len(err.value.result.files) == 2
+
+
+def test_retried_after_server_asks(tmpdir):  # pylint: disable=invalid-name
+    """a 503 with 'Retry-After' is waited out, then retried"""
+    class Busy(MockAsyncSession):  # pylint: disable=too-few-public-methods
+        def post(self, url, data, headers):
+            if not self.requested:
+                self.requested.append(None)
+                return MockAsyncResponse(b'', 503, {'Retry-After': '0'})
+            return super(Busy, self).post(url, data, headers)
+
+    session = Busy()
+    result = run(aws.async_fetch_station_data(
+        station='ESK', saveroot=str(tmpdir), session=session,
+        retry=RetryPolicy(max_attempts=2), **FETCH_ARGS
+    ))
+    assert result.retries == 1
+    assert len(result.files) == 3
+
+    with pytest.raises(InvalidResponse) as err:
+        run(aws.async_fetch_station_data(
+            station='ESK', saveroot=str(tmpdir), session=Busy(),
+            **FETCH_ARGS
+        ))
+    assert err.value.status_code == 503
+    assert err.value.retry_after == 0
+
+
+def test_dropped_connection_retried(tmpdir):  # pylint: disable=invalid-name
+    """aiohttp's errors for a body cut short are retried"""
+    pytest.importorskip('aiohttp')
+    saveroot = tmpdir.mkdir('data')
+    retry = RetryPolicy(max_attempts=10, backoff=0)
+    with MockWDCServer(drop_rate=0.5, seed=1) as server:
+        results = run(aws.async_fetch_data(
+            station_list=['ESK'], saveroot=str(saveroot), retry=retry,
+            configpath=server.write_config(tmpdir), **FETCH_ARGS
+        ))
+    assert results['ESK'].retries > 0
+    assert len(server.requests) == results['ESK'].retries + 1
+    assert len(os.listdir(str(saveroot))) == 3
+
+
+def test_unpopulated_request_raises():  # pylint: disable=invalid-name
+    """an empty AsyncDataRequest cannot be sent"""
+    with pytest.raises(InvalidRequest):
+        run(aws.AsyncDataRequest().send_async(MockAsyncSession()))
+
+
+def test_bad_concurrency(tmpdir):
+    """need at least one slot"""
+    with pytest.raises(ValueError) as err:
+        run(aws.async_fetch_data(station_list=STATIONS, saveroot=str(tmpdir),
+                                 max_concurrency=0, **FETCH_ARGS))
+    assert 'max_concurrency' in str(err.value)
+    with pytest.raises(ValueError) as err:
+        run(aws.async_fetch_data(station_list=STATIONS, saveroot=str(tmpdir),
+                                 chunk_concurrency=0, **FETCH_ARGS))
+    assert 'chunk_concurrency' in str(err.value)
@@ -0,0 +1,117 @@
+"""tests for the on-disk record of datasets already downloaded"""
+from datetime import date, datetime, timedelta
+import os
+
+import pytest
+
+from gmdata_webinterface.cache import DatasetCache, period_end, MANIFEST_NAME
+
+JAN = '/wdc/datasets/minute/esk201501'
+FEB = '/wdc/datasets/minute/esk201502'
+MAR = '/wdc/datasets/minute/esk201503'
+NOW = datetime(2015, 3, 10, 12).timestamp()
+
+
+class Clock(object):  # pylint: disable=too-few-public-methods
+    """a clock we can move on by hand"""
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def write_files(root, names, size=100):
+    """create files of `size` bytes called `names` under `root`"""
+    paths = []
+    for name in names:
+        path = os.path.join(str(root), name)
+        with open(path, 'wb') as file_:
+            file_.write(b'x' * size)
+        paths.append(path)
+    return paths
+
+
+def test_period_end():
+    """last day of the month or year of a dataset"""
+    assert period_end(JAN) == date(2015, 1, 31)
+    assert period_end('/wdc/datasets/minute/esk201602') == date(2016, 2, 29)
+    assert period_end('/wdc/datasets/hour/ngk2015') == date(2015, 12, 31)
+    with pytest.raises(ValueError):
+        period_end('/wdc/datasets/hour/not-a-dataset')
+
+
+def test_record_and_miss(tmpdir):
+    """recorded datasets are not missing, and survive a reload"""
+    root = str(tmpdir)
+    cache = DatasetCache(root, provisional_ttl=None, clock=Clock())
+    assert cache.missing([JAN, FEB]) == [JAN, FEB]
+    files = write_files(root, ['esk201501dmin.min', 'esk201502dmin.min',
+                               'README.txt'])
+    cache.record([JAN, FEB], files)
+    assert cache.missing([JAN, FEB, MAR]) == [MAR]
+    assert cache.files_for([FEB]) == [files[1]]
+    assert cache.total_bytes == 200
+    assert os.path.isfile(os.path.join(root, MANIFEST_NAME))
+
+    reloaded = DatasetCache(root, provisional_ttl=None, clock=Clock())
+    assert reloaded.datasets == [JAN, FEB]
+    assert JAN in reloaded
+    # files deleted behind our back are missing again
+    os.remove(files[0])
+    assert reloaded.missing([JAN, FEB]) == [JAN]
+
+
+def test_formats_cached_apart(tmpdir):
+    """a dataset held in one format is still missing in another"""
+    root = str(tmpdir)
+    cache = DatasetCache(root, provisional_ttl=None, clock=Clock())
+    files = write_files(root, ['esk201501dmin.min'])
+    cache.record([JAN], files, 'iaga2002')
+    assert cache.missing([JAN], 'iaga2002') == []
+    assert cache.missing([JAN], 'wdc') == [JAN]
+    assert cache.files_for([JAN], 'wdc') == []
+    assert cache.files_for([JAN], 'iaga2002') == files
+    assert cache.datasets == [JAN + '.iaga2002']
+
+
+def test_provisional_definitive_ttl(tmpdir):
+    """recent periods expire, definitive ones are kept"""
+    root = str(tmpdir)
+    clock = Clock()
+    old = '/wdc/datasets/minute/esk201201'
+    cache = DatasetCache(root, provisional_ttl=timedelta(hours=6),
+                         clock=clock)
+    assert cache.is_definitive(old)
+    assert not cache.is_definitive(FEB)
+    cache.record([old, FEB], write_files(root, ['esk201201dmin.min',
+                                                'esk201502dmin.min']))
+    assert cache.missing([old, FEB]) == []
+    clock.now += timedelta(hours=7).total_seconds()
+    assert cache.missing([old, FEB]) == [FEB]
+
+    cache.definitive_ttl = timedelta(days=30)
+    clock.now += timedelta(days=31).total_seconds()
+    assert cache.missing([old, FEB]) == [old, FEB]
+
+
+def test_lru_eviction(tmpdir):
+    """least recently used datasets are deleted to stay under max_bytes"""
+    root = str(tmpdir)
+    clock = Clock()
+    cache = DatasetCache(root, max_bytes=250, provisional_ttl=None,
+                         clock=clock)
+    jan, feb = write_files(root, ['esk201501dmin.min', 'esk201502dmin.min'])
+    cache.record([JAN], [jan])
+    clock.now += 1
+    cache.record([FEB], [feb])
+    clock.now += 1
+    # use January, so February is the least recently used
+    assert cache.missing([JAN]) == []
+    clock.now += 1
+    mar = write_files(root, ['esk201503dmin.min'])
+    cache.record([MAR], mar)
+    assert cache.datasets == [JAN, MAR]
+    assert not os.path.isfile(feb)
+    assert os.path.isfile(jan)
+    assert cache.total_bytes == 200
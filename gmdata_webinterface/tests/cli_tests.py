@@ -0,0 +1,213 @@
+"""
+tests for the `gmdata-fetch` command, with the webservice
+replaced by canned zip responses
+"""
+import json
+import os
+
+import pytest
+
+from gmdata_webinterface import cli, transport
+from gmdata_webinterface.cli import ManifestError, read_manifest
+from gmdata_webinterface.tests.helpers import MockResponse, make_zip
+
+DATAPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'test_data')
+IAGA_CONFIG = os.path.join(DATAPATH, 'wdc_minute_data_iaga2002output.ini')
+MANIFEST = """station,start,end,cadence,format
+# comments are skipped
+ESK LER,2015-01-15,2015-03-01,minute,iaga2002
+NGK,2014-06-01,2015-02-01,hour,wdc
+HAD,2015-01-01,2015-01-31,,
+"""
+
+
+# small Mock classes can be weird
+# pylint: disable=missing-docstring, too-few-public-methods
+class MockSession(object):
+    """answers with a zip of the datasets asked for; fails for `fail_for`"""
+    def __init__(self, fail_for=()):
+        self.fail_for = fail_for
+        self.requested = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    def post(self, url, data, headers, **kwargs):
+        # pylint: disable=unused-argument
+        datasets = data['datasets'].split(',')
+        self.requested.append((data['format'], datasets))
+        names = [dset.split('/')[-1] for dset in datasets]
+        if any(name.startswith(self.fail_for) for name in names):
+            return MockResponse(b'', 503)
+        return MockResponse(make_zip({name + '.dat': b'data'
+                                      for name in names}))
+# pylint: enable=missing-docstring, too-few-public-methods
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """the session `gmdata-fetch` sends its requests with"""
+    mock = MockSession()
+    monkeypatch.setattr(transport, 'make_session', lambda **_: mock)
+    return mock
+
+
+def test_read_manifest(tmpdir):
+    """CSV and JSON manifests, with defaults filled in"""
+    path = tmpdir.join('jobs.csv')
+    path.write(MANIFEST)
+    jobs = read_manifest(str(path))
+    assert [job['station'] for job in jobs] == [['ESK', 'LER'], ['NGK'],
+                                                ['HAD']]
+    assert jobs[1]['start'].isoformat() == '2014-06-01'
+    assert (jobs[2]['cadence'], jobs[2]['format'], jobs[2]['service']) == \
+        ('minute', None, 'WDC')
+
+    path = tmpdir.join('jobs.json')
+    path.write(json.dumps([{'station': ['ESK'], 'start': '2015-01-01',
+                            'end': '2015-02-01', 'cadence': 'hour'}]))
+    assert read_manifest(str(path))[0]['cadence'] == 'hour'
+
+
+@pytest.mark.parametrize('contents, message', [
+    ('station,start\nESK,2015-01-01\n', 'has no'),
+    ('station,start,end,colour\nESK,2015-01-01,2015-02-01,red\n', 'unknown'),
+    ('station,start,end\nESK,2015-01-01,next week\n', 'not a date'),
+])
+def test_bad_manifest(tmpdir, contents, message):
+    """the job at fault is named"""
+    path = tmpdir.join('jobs.csv')
+    path.write(contents)
+    with pytest.raises(ManifestError) as err:
+        read_manifest(str(path))
+    assert message in str(err.value)
+    assert 'job 1' in str(err.value)
+
+
+@pytest.mark.parametrize('job', [
+    {'station': 42, 'start': '2015-01-01', 'end': '2015-02-01'},
+    {'station': ['ESK', None], 'start': '2015-01-01', 'end': '2015-02-01'},
+    {'station': 'ESK', 'start': '2015-01-01', 'end': '2015-02-01',
+     'cadence': 60},
+    'ESK,2015-01-01,2015-02-01',
+])
+def test_bad_json_manifest(tmpdir, capsys, job):
+    """fields of the wrong type are reported, not a traceback"""
+    path = tmpdir.join('jobs.json')
+    path.write(json.dumps([job]))
+    with pytest.raises(ManifestError) as err:
+        read_manifest(str(path))
+    assert 'job 1' in str(err.value)
+    with pytest.raises(SystemExit) as err:
+        cli.main(['--manifest', str(path)])
+    assert err.value.code == 2
+    assert 'job 1' in capsys.readouterr()[1]
+
+
+def test_dry_run(tmpdir, capsys, session):
+    """the plans are printed, nothing is sent"""
+    status = cli.main(['ESK', '--start', '2015-01-15', '--end', '2015-03-01',
+                       '--config', IAGA_CONFIG, '--saveroot', str(tmpdir),
+                       '--dry-run'])
+    assert status == 0
+    out = capsys.readouterr()[0]
+    assert out.startswith('ESK 2015-01-15..2015-03-01 minute:\n'
+                          '1 requests for 3 datasets')
+    assert 'esk201503dmin.min' in out
+    assert os.listdir(str(tmpdir)) == []
+    assert session.requested == []
+
+    cli.main(['ESK', '--start', '2015-01-15', '--end', '2015-03-01',
+              '--config', IAGA_CONFIG, '--dry-run', '--json'])
+    plans = json.loads(capsys.readouterr()[0])
+    assert plans[0]['requests'][0]['station'] == 'ESK'
+
+
+def test_manifest_run(tmpdir, capsys, session):
+    """every job run, in its own format, progress and summary reported"""
+    manifest = tmpdir.join('jobs.csv')
+    manifest.write(MANIFEST)
+    saveroot = tmpdir.mkdir('data')
+    summary = tmpdir.join('summary.json')
+    status = cli.main(['--manifest', str(manifest), '--saveroot',
+                       str(saveroot), '--workers', '2', '--cache',
+                       '--summary', str(summary), '--quiet'])
+    assert status == 0
+    assert sorted((fmt, len(datasets)) for fmt, datasets
+                  in session.requested) == [
+                      ('text/x-iaga2002', 3), ('text/x-iaga2002', 3),
+                      ('text/x-wdc', 1), ('text/x-wdc', 2)
+                  ]
+    out, err = capsys.readouterr()
+    assert out == ''
+    assert err == ''
+    results = json.loads(summary.read())
+    assert results['ok']
+    assert [job['requests'] for job in results['jobs']] == [2, 1, 1]
+    assert len(results['jobs'][0]['stations']['LER']['files']) == 3
+
+    # cached, so nothing more to fetch
+    session.requested = []
+    assert cli.main(['--manifest', str(manifest), '--saveroot',
+                     str(saveroot), '--cache']) == 0
+    assert session.requested == []
+    err = capsys.readouterr()[1]
+    assert '[4/4] HAD' in err
+
+
+def test_cache_kept_apart_by_format(tmpdir, session):
+    """the same data in another format are fetched, not taken from cache"""
+    saveroot = str(tmpdir.mkdir('data'))
+    for fmt in ('iaga2002', 'wdc'):
+        assert cli.main(['NGK', '--start', '2015-01-01', '--end',
+                         '2015-01-31', '--cadence', 'hour', '--format', fmt,
+                         '--saveroot', saveroot, '--cache', '--quiet']) == 0
+    assert [fmt for fmt, _ in session.requested] == ['text/x-iaga2002',
+                                                     'text/x-wdc']
+
+
+def test_failures_reported(tmpdir, capsys, session):
+    """a failed job sets the exit status, the rest still run"""
+    session.fail_for = ('ler',)
+    status = cli.main(['ESK', 'LER', '--start', '2015-01-15', '--end',
+                       '2015-02-01', '--saveroot', str(tmpdir),
+                       '--retries', '1', '--summary', '-', '--quiet'])
+    assert status == 1
+    assert len(session.requested) == 3
+    results = json.loads(capsys.readouterr()[0])
+    stations = results['jobs'][0]['stations']
+    assert stations['ESK']['ok']
+    assert stations['LER']['retries'] == 1
+    assert '503' in stations['LER']['error']
+
+    # plans are printed to standard error, leaving the JSON alone
+    cli.main(['ESK', 'LER', '--start', '2015-01-15', '--end', '2015-02-01',
+              '--saveroot', str(tmpdir), '--summary', '-'])
+    out, err = capsys.readouterr()
+    assert not json.loads(out)['ok']
+    assert 'requests for' in err
+
+
+@pytest.mark.parametrize('argv', [
+    [],
+    ['ESK', '--start', '2015-01-01'],
+    ['ESK', '--start', '2015-13-01', '--end', '2015-12-01'],
+    ['ESK', '--manifest', 'jobs.csv'],
+    ['--manifest', 'no/such/jobs.csv'],
+    ['ESK', '--start', '2015-01-01', '--end', '2015-12-01', '--workers', '0'],
+    ['ESK', '--start', '2015-01-01', '--end', '2015-12-01',
+     '--chunk-workers', '0'],
+    ['ESK', '--start', '2015-01-01', '--end', '2015-12-01', '--format', 'x'],
+    ['ESK', '--start', '2015-01-01', '--end', '2015-12-01', '--json',
+     '--summary', '-'],
+])
+def test_bad_arguments(argv, capsys):
+    """usage errors, before anything is fetched"""
+    with pytest.raises(SystemExit) as err:
+        cli.main(argv)
+    assert err.value.code == 2
+    assert 'gmdata-fetch' in capsys.readouterr()[1]
@@ -1,4 +1,7 @@
 """test building up a request to a Geomag data webservice"""
+import io
+import zipfile
+
 import pytest
 import requests
 
@@ -75,6 +78,29 @@ def test_sending_request_happy_path(monkeypatch):
     print(SpyRequests.post_called_with)
 
 
+def test_send_with_session(monkeypatch):
+    """
+    if we pass a session, is that used to send
+    rather than a one-off connection?
+    """
+    SpyRequests.reset()
+
+    class SpySession(SpyRequests):  # pylint: disable=too-few-public-methods
+        """a session that logs calls, separately to `SpyRequests`"""
+        post_call_count = 0
+
+    SpySession.reset()
+    monkeypatch.setattr('gmdata_webinterface.consume_webservices.rq',
+                        SpyRequests)
+    req = DataRequest()
+    req.read_attributes(MockConfig())
+    req.set_form_data({'format': MOCK_FORMAT, 'datasets': 'wibble'})
+    req.send(session=SpySession)
+    assert SpySession.post_call_count == 1
+    assert SpySession.post_called_with['url'] == MOCK_URL
+    assert SpyRequests.post_call_count == 0
+
+
 #  long test names are OK
 def test_cannot_send_until_all_parts_populated(monkeypatch):  # pylint: disable=invalid-name
     """
@@ -168,6 +194,16 @@ def test_check_response_raises():    # pylint: disable=invalid-name
     assert 'no valid files returned' in error.value.args[0]
 
 
+def test_check_response_returns_archive():  # pylint: disable=invalid-name
+    """the checked archive is handed back open, to extract from"""
+    buff = io.BytesIO()
+    with zipfile.ZipFile(buff, 'w') as fzip:
+        fzip.writestr('esk2015.wdc', b'data')
+    with check_response(requests.codes.ok, buff.getvalue()) as fzip:
+        assert fzip.namelist() == ['esk2015.wdc']
+        assert fzip.read('esk2015.wdc') == b'data'
+
+
 def test_construction_valid_from_args():  # pylint: disable=invalid-name
     """
     Can we create a DataRequest with passing
@@ -247,3 +283,25 @@ def test_can_send():
     assert not empty_at_1st.can_send
     empty_at_1st.set_form_data({'some': 'data'})
     assert empty_at_1st.can_send
+
+
+def test_fingerprint():
+    """equal requests share a fingerprint, different ones do not"""
+    heads = {'Accept': 'text/html', 'Content-Type': 'form'}
+    formdata = {
+        'datasets': '/wdc/datasets/hour/esk2014,/wdc/datasets/hour/esk2015',
+        'format': 'text/x-wdc'
+    }
+    req = DataRequest(MOCK_URL, heads, formdata)
+    # same contents, built in a different order
+    same = DataRequest(
+        MOCK_URL,
+        {'content-type': 'form', 'accept': 'text/html'},
+        {'format': 'text/x-wdc', 'datasets': formdata['datasets']}
+    )
+    assert req.fingerprint == same.fingerprint
+    assert len(req.fingerprint) == 64
+    for other in (DataRequest('https://elsewhere', heads, formdata),
+                  DataRequest(MOCK_URL, {'Accept': 'xml'}, formdata),
+                  DataRequest(MOCK_URL, heads, {'format': 'text/x-wdc'})):
+        assert other.fingerprint != req.fingerprint
@@ -0,0 +1,84 @@
+"""tests for unpacking the zip archives returned by the webservice"""
+import io
+import os
+import stat
+import zipfile
+
+import pytest
+
+from gmdata_webinterface.extract import Extractor, member_path
+from gmdata_webinterface.tests.helpers import make_zip
+
+MEMBERS = {
+    'esk2015{:02d}dmin.min'.format(month): str(month).encode() * 50000
+    for month in range(1, 13)
+}
+MEMBERS['README.txt'] = b'read me'
+
+
+def open_zip(members):
+    """an open `zipfile.ZipFile` holding `members` {name: content}"""
+    return zipfile.ZipFile(io.BytesIO(make_zip(members)))
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_extracts_every_member(tmpdir, workers):
+    """the same files, in archive order, however many workers"""
+    fzip = open_zip(MEMBERS)
+    paths = Extractor(workers=workers)(fzip, str(tmpdir))
+    assert paths == [os.path.join(str(tmpdir), name)
+                     for name in fzip.namelist()]
+    for name, content in MEMBERS.items():
+        assert tmpdir.join(name).read_binary() == content
+    # no temporary files left behind
+    assert sorted(os.listdir(str(tmpdir))) == sorted(MEMBERS)
+
+
+def test_members_filtered_by_pattern(tmpdir):
+    """only members matching a pattern are unpacked"""
+    paths = Extractor(members='*.min', workers=2)(open_zip(MEMBERS),
+                                                  str(tmpdir))
+    assert len(paths) == 12
+    assert 'README.txt' not in os.listdir(str(tmpdir))
+    paths = Extractor(members=['README*', 'esk201501*'])(open_zip(MEMBERS),
+                                                         str(tmpdir))
+    assert sorted(os.path.basename(path) for path in paths) == \
+        ['README.txt', 'esk201501dmin.min']
+
+
+def test_extracted_files_mode(tmpdir):
+    """files get the mode `open` would give them, not mkstemp's 0o600"""
+    umask = os.umask(0o022)
+    os.umask(umask)
+    for path in Extractor()(open_zip(MEMBERS), str(tmpdir)):
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~umask
+
+
+def test_corrupt_member_not_left_behind(tmpdir):
+    """a member failing its CRC check raises and leaves no file"""
+    content = make_zip({'good.min': b'fine',
+                        'bad.min': b'all present and correct'},
+                       zipfile.ZIP_STORED).replace(b'present', b'PRESENT')
+    with pytest.raises(zipfile.BadZipFile):
+        Extractor()(zipfile.ZipFile(io.BytesIO(content)), str(tmpdir))
+    assert os.listdir(str(tmpdir)) == ['good.min']
+
+
+def test_paths_kept_under_saveroot(tmpdir):
+    """names cannot climb out of `saveroot`; folders are made"""
+    root = str(tmpdir)
+    assert member_path(root, '../../etc/passwd') == \
+        os.path.join(root, 'etc', 'passwd')
+    assert member_path(root, '/abs/./x.min') == os.path.join(root, 'abs',
+                                                             'x.min')
+    paths = Extractor()(open_zip({'sub/': b'', 'sub/esk.min': b'data'}),
+                        root)
+    assert paths == [os.path.join(root, 'sub', 'esk.min')]
+    assert tmpdir.join('sub', 'esk.min').read_binary() == b'data'
+
+
+def test_bad_workers():
+    """need at least one worker"""
+    with pytest.raises(ValueError) as err:
+        Extractor(workers=0)
+    assert 'workers' in str(err.value)
@@ -0,0 +1,231 @@
+"""
+tests for fetching data for many stations, one after another or
+concurrently, without making any requests over the network
+"""
+from datetime import date
+import threading
+import time
+
+import pytest
+
+from gmdata_webinterface import consume_webservices as cws
+
+FETCH_ARGS = {
+    'start_date': date(2015, 4, 1),
+    'end_date': date(2015, 4, 30),
+    'cadence': 'hour',
+    'service': 'WDC',
+    'saveroot': 'nowhere',
+}
+STATIONS = ['ESK', 'LER', 'HAD', 'NGK', 'ABK', 'BOU']
+
+
+# small Mock classes can be weird
+# pylint: disable=missing-docstring, too-few-public-methods
+class SpyFetch(object):
+    """
+    stand in for `fetch_station_data` that records how many
+    fetches are in flight at once
+    """
+    def __init__(self, fail_for=(), delay=0.02):
+        self.fail_for = fail_for
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.called_for = []
+        self.sessions = set()
+        self.configs = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        station = kwargs['station']
+        with self._lock:
+            self.called_for.append(station)
+            self.sessions.add(kwargs['session'])
+            self.configs.add(id(kwargs['config']))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        if station in self.fail_for:
+            raise ValueError('server says no to ' + station)
+        return cws.FetchResult(station, [station.lower() + '2015.wdc'])
+# pylint: enable=missing-docstring, too-few-public-methods
+
+
+def test_sequential_by_default(monkeypatch):
+    """one station at a time, results keyed on station"""
+    spy = SpyFetch()
+    monkeypatch.setattr(cws, 'fetch_station_data', spy)
+    results = cws.fetch_data(station_list=STATIONS, **FETCH_ARGS)
+    assert spy.max_in_flight == 1
+    assert spy.called_for == STATIONS
+    assert list(results) == STATIONS
+    assert results['ESK'].files == ['esk2015.wdc']
+    assert all(result.ok for result in results.values())
+    # the config is read once and passed down
+    assert len(spy.configs) == 1
+
+
+def test_sequential_errors_propagate(monkeypatch):
+    """without concurrency the first error stops us, as it always has"""
+    spy = SpyFetch(fail_for=['LER'])
+    monkeypatch.setattr(cws, 'fetch_station_data', spy)
+    with pytest.raises(ValueError) as err:
+        cws.fetch_data(station_list=STATIONS, **FETCH_ARGS)
+    assert 'LER' in str(err.value)
+    assert not isinstance(err.value, cws.FetchError)
+    assert spy.called_for == ['ESK', 'LER']
+
+
+@pytest.mark.parametrize('engine', cws.ENGINES)
+def test_concurrent_fetch_is_bounded(monkeypatch, engine):
+    """never more than `max_workers` requests in flight"""
+    spy = SpyFetch()
+    monkeypatch.setattr(cws, 'fetch_station_data', spy)
+    results = cws.fetch_data(station_list=STATIONS, max_workers=3,
+                             engine=engine, **FETCH_ARGS)
+    assert 1 < spy.max_in_flight <= 3
+    assert sorted(spy.called_for) == sorted(STATIONS)
+    # results come back in the order asked for
+    assert list(results) == STATIONS
+
+
+@pytest.mark.parametrize('engine', cws.ENGINES)
+def test_concurrent_errors_reported(monkeypatch, engine):
+    """a failing station does not abandon the rest"""
+    spy = SpyFetch(fail_for=['LER', 'BOU'])
+    monkeypatch.setattr(cws, 'fetch_station_data', spy)
+    with pytest.raises(cws.FetchError) as err:
+        cws.fetch_data(station_list=STATIONS, max_workers=4,
+                       engine=engine, **FETCH_ARGS)
+    assert sorted(spy.called_for) == sorted(STATIONS)
+    assert sorted(err.value.errors) == ['BOU', 'LER']
+    assert err.value.results['ESK'].ok
+    assert not err.value.results['LER'].ok
+    for str_ in ['2 of 6', 'LER', 'BOU']:
+        assert str_ in str(err.value)
+    # still a ValueError, as before concurrency
+    assert isinstance(err.value, ValueError)
+
+
+def test_failed_chunks_keep_retries(monkeypatch):
+    """a station failing part way still reports its files and retries"""
+    def fetch_station_data(**kwargs):
+        result = cws.FetchResult(kwargs['station'], ['got.wdc'], retries=2)
+        raise cws.ChunkError(result, {'lost': ValueError('server says no')})
+
+    monkeypatch.setattr(cws, 'fetch_station_data', fetch_station_data)
+    with pytest.raises(cws.FetchError) as err:
+        cws.fetch_data(station_list=STATIONS, max_workers=2, **FETCH_ARGS)
+    result = err.value.results['ESK']
+    assert not result.ok
+    assert isinstance(result.error, cws.ChunkError)
+    assert result.files == ['got.wdc']
+    assert result.retries == 2
+
+
+def test_bad_concurrency_options(monkeypatch):
+    """reject engines and worker counts we cannot use"""
+    monkeypatch.setattr(cws, 'fetch_station_data', SpyFetch())
+    with pytest.raises(ValueError) as err:
+        cws.fetch_data(station_list=STATIONS, max_workers=2,
+                       engine='wibble', **FETCH_ARGS)
+    for str_ in ['wibble', 'thread']:
+        assert str_ in str(err.value)
+    with pytest.raises(ValueError) as err:
+        cws.fetch_data(station_list=STATIONS, max_workers=0, **FETCH_ARGS)
+    assert 'max_workers' in str(err.value)
+
+
+def test_station_string_split(monkeypatch):
+    """space separated station codes are still accepted"""
+    spy = SpyFetch()
+    monkeypatch.setattr(cws, 'fetch_station_data', spy)
+    results = cws.fetch_data(station_list='ESK LER', **FETCH_ARGS)
+    assert list(results) == ['ESK', 'LER']
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_stations_share_one_session(monkeypatch, max_workers):
+    """every station's request goes via the same pooled session"""
+    spy = SpyFetch()
+    monkeypatch.setattr(cws, 'fetch_station_data', spy)
+    cws.fetch_data(station_list=STATIONS, max_workers=max_workers,
+                   **FETCH_ARGS)
+    assert len(spy.sessions) == 1
+    assert None not in spy.sessions
+
+    mine = object()
+    spy = SpyFetch()
+    monkeypatch.setattr(cws, 'fetch_station_data', spy)
+    cws.fetch_data(station_list=STATIONS, max_workers=max_workers,
+                   session=mine, **FETCH_ARGS)
+    assert spy.sessions == {mine}
+
+
+def test_sync_needs_a_start(monkeypatch, tmpdir):
+    """without a high-water mark we must be told `since`"""
+    monkeypatch.setattr(cws, 'fetch_station_data', SpyFetch())
+    with pytest.raises(ValueError) as err:
+        cws.sync_data(['ESK'], 'minute', str(tmpdir))
+    for str_ in ['ESK', 'since']:
+        assert str_ in str(err.value)
+
+
+@pytest.mark.parametrize('cadence, restart', [
+    ('minute', date(2015, 4, 1)),
+    ('hour', date(2015, 1, 1)),
+])
+def test_sync_from_high_water_mark(monkeypatch, tmpdir, cadence, restart):
+    """each run starts from the period holding the last date fetched"""
+    calls = []
+
+    def spy_fetch(**kwargs):
+        calls.append(kwargs)
+        if kwargs['station'] in ('BAD',):
+            raise ValueError('server says no')
+        return cws.FetchResult(kwargs['station'])
+
+    monkeypatch.setattr(cws, 'fetch_station_data', spy_fetch)
+    saveroot = str(tmpdir)
+    cws.sync_data(['ESK', 'LER'], cadence, saveroot, since=date(2014, 1, 1),
+                  end_date=date(2015, 4, 20), stream=True)
+    assert [call['start_date'] for call in calls] == [date(2014, 1, 1)] * 2
+    assert all(call['stream'] for call in calls)
+
+    calls.clear()
+    with pytest.raises(cws.FetchError):
+        cws.sync_data(['ESK', 'BAD', 'NGK'], cadence, saveroot,
+                      since=date(2010, 1, 1), end_date=date(2015, 5, 2),
+                      max_workers=2)
+    starts = {call['station']: call['start_date'] for call in calls}
+    assert starts == {'ESK': restart, 'BAD': date(2010, 1, 1),
+                      'NGK': date(2010, 1, 1)}
+
+    # the failed station keeps no mark, so starts again from `since`
+    calls.clear()
+    with pytest.raises(ValueError):
+        cws.sync_data(['NGK', 'BAD'], cadence, saveroot,
+                      end_date=date(2015, 5, 3))
+    assert calls == []
+
+
+def test_sync_backfill_keeps_mark(monkeypatch, tmpdir):
+    """a run ending before the high-water mark does not move it back"""
+    calls = []
+
+    def spy_fetch(**kwargs):
+        calls.append(kwargs)
+        return cws.FetchResult(kwargs['station'])
+
+    monkeypatch.setattr(cws, 'fetch_station_data', spy_fetch)
+    saveroot = str(tmpdir)
+    cws.sync_data('ESK', 'minute', saveroot, since=date(2015, 1, 1),
+                  end_date=date(2015, 6, 10))
+    cws.sync_data('ESK', 'minute', saveroot, since=date(2010, 1, 1),
+                  end_date=date(2012, 12, 31))
+    calls.clear()
+    cws.sync_data('ESK', 'minute', saveroot, end_date=date(2015, 7, 1))
+    assert calls[0]['start_date'] == date(2015, 6, 1)
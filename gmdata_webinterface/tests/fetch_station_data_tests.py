@@ -0,0 +1,337 @@
+"""
+tests for fetching and unpacking a single station's data,
+with the webservice replaced by canned zip responses
+"""
+from datetime import date
+import os
+import tempfile
+
+import pytest
+import requests
+
+from gmdata_webinterface import consume_webservices as cws
+from gmdata_webinterface.cache import DatasetCache
+from gmdata_webinterface.extract import Extractor
+from gmdata_webinterface.instrument import MetricsAggregator
+from gmdata_webinterface.tests.helpers import (
+    ChunkedSession, MockResponse, make_zip
+)
+from gmdata_webinterface.transport import RetryPolicy
+
+MEMBERS = {
+    'esk201501dmin.min': b'January\n' * 1000,
+    'esk201502dmin.min': b'February\n' * 1000,
+}
+FETCH_ARGS = {
+    'start_date': date(2015, 1, 15),
+    'end_date': date(2015, 2, 2),
+    'station': 'ESK',
+    'cadence': 'minute',
+    'service': 'WDC',
+}
+
+
+# small Mock classes can be weird
+# pylint: disable=missing-docstring, too-few-public-methods
+class SpySession(object):
+    def __init__(self, response):
+        self.response = response
+        self.post_called_with = []
+
+    def post(self, url, data, headers, **kwargs):
+        self.post_called_with.append(
+            {'url': url, 'data': data, 'headers': headers, **kwargs}
+        )
+        return self.response
+# pylint: enable=missing-docstring, too-few-public-methods
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_extracts_every_member(tmpdir, stream):
+    """both ways of handling the response give the same files"""
+    session = SpySession(MockResponse(make_zip(MEMBERS)))
+    result = cws.fetch_station_data(saveroot=str(tmpdir), session=session,
+                                    stream=stream, **FETCH_ARGS)
+    assert result.ok
+    assert result.station == 'ESK'
+    assert sorted(os.path.basename(file_) for file_ in result.files) == \
+        sorted(MEMBERS)
+    for name, content in MEMBERS.items():
+        with open(os.path.join(str(tmpdir), name), 'rb') as file_:
+            assert file_.read() == content
+    datasets = session.post_called_with[0]['data']['datasets']
+    assert 'esk201501' in datasets
+    assert 'esk201502' in datasets
+    assert session.post_called_with[0].get('stream', False) is stream
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_archive_parsed_once(tmpdir, monkeypatch, stream):
+    """checking the response does not cost a second parse of the zip"""
+    session = SpySession(MockResponse(make_zip(MEMBERS)))
+    opened = []
+    real_zipfile = cws.zipfile.ZipFile
+
+    def spy_zipfile(*args, **kwargs):
+        opened.append(args)
+        return real_zipfile(*args, **kwargs)
+
+    monkeypatch.setattr(cws.zipfile, 'ZipFile', spy_zipfile)
+    cws.fetch_station_data(saveroot=str(tmpdir), session=session,
+                           stream=stream, **FETCH_ARGS)
+    assert len(opened) == 1
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_selective_extraction(tmpdir, stream):
+    """only the members `extract` wants are unpacked"""
+    members = dict(MEMBERS, **{'README.txt': b'read me'})
+    session = SpySession(MockResponse(make_zip(members)))
+    result = cws.fetch_station_data(
+        saveroot=str(tmpdir), session=session, stream=stream,
+        extract=Extractor(members='*.min', workers=2), **FETCH_ARGS
+    )
+    assert sorted(os.path.basename(file_) for file_ in result.files) == \
+        sorted(MEMBERS)
+    assert sorted(os.listdir(str(tmpdir))) == sorted(MEMBERS)
+
+
+def test_streaming_reads_in_chunks(tmpdir, monkeypatch):
+    """the streamed response is consumed chunk by chunk and closed"""
+    monkeypatch.setattr(cws, 'STREAM_CHUNK_SIZE', 256)
+    response = MockResponse(make_zip(MEMBERS))
+    cws.fetch_station_data(saveroot=str(tmpdir), session=SpySession(response),
+                           stream=True, **FETCH_ARGS)
+    assert response.chunks_read > 1
+    assert response.closed
+
+
+def test_streaming_spools_to_disk(tmpdir, monkeypatch):
+    """responses bigger than `spool_max_size` are not kept in memory"""
+    spools = []
+    real_spool = cws.tempfile.SpooledTemporaryFile
+
+    def spy_spool(*args, **kwargs):
+        spools.append(real_spool(*args, **kwargs))
+        return spools[-1]
+
+    monkeypatch.setattr(cws.tempfile, 'SpooledTemporaryFile', spy_spool)
+    content = make_zip(MEMBERS)
+    cws.fetch_station_data(saveroot=str(tmpdir),
+                           session=SpySession(MockResponse(content)),
+                           stream=True, spool_max_size=len(content) // 2,
+                           **FETCH_ARGS)
+    assert spools[0]._rolled  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize('spool_max_size', [cws.SPOOL_MAX_SIZE, 1])
+def test_streamed_members_opened(tmpdir, monkeypatch, spool_max_size):
+    """
+    members are read from the spool, in memory or on disk, even where it
+    has no `seekable` (Python 3.7 to 3.10)
+    """
+    class OldSpool(tempfile.SpooledTemporaryFile):
+        """a `SpooledTemporaryFile` as it was before Python 3.11"""
+        def __getattribute__(self, name):
+            if name == 'seekable':
+                raise AttributeError(name)
+            return super().__getattribute__(name)
+
+    monkeypatch.setattr(cws.tempfile, 'SpooledTemporaryFile', OldSpool)
+    session = SpySession(MockResponse(make_zip(MEMBERS)))
+    result = cws.fetch_station_data(saveroot=str(tmpdir), session=session,
+                                    stream=True,
+                                    spool_max_size=spool_max_size,
+                                    **FETCH_ARGS)
+    assert len(result.files) == len(MEMBERS)
+    for file_ in result.files:
+        with open(file_, 'rb') as member:
+            assert member.read() == MEMBERS[os.path.basename(file_)]
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_bad_responses_raise(tmpdir, stream):
+    """server errors and empty archives raise, streamed or not"""
+    error_response = MockResponse(b'', requests.codes.internal_server_error)
+    with pytest.raises(ValueError) as err:
+        cws.fetch_station_data(saveroot=str(tmpdir),
+                               session=SpySession(error_response),
+                               stream=stream, **FETCH_ARGS)
+    assert '500' in str(err.value)
+
+    empty_response = MockResponse(make_zip({}))
+    with pytest.raises(ValueError) as err:
+        cws.fetch_station_data(saveroot=str(tmpdir),
+                               session=SpySession(empty_response),
+                               stream=stream, **FETCH_ARGS)
+    assert 'no valid files returned' in str(err.value)
+    if stream:
+        assert error_response.closed and empty_response.closed
+
+
+@pytest.mark.parametrize('chunk_workers', [1, 3])
+def test_chunked_requests(tmpdir, chunk_workers):
+    """long ranges are split into several requests, merged in `saveroot`"""
+    session = ChunkedSession()
+    args = {**FETCH_ARGS}
+    args['end_date'] = date(2015, 12, 1)
+    result = cws.fetch_station_data(saveroot=str(tmpdir), session=session,
+                                    max_datasets=5,
+                                    chunk_workers=chunk_workers, **args)
+    assert sorted(len(chunk) for chunk in session.requested) == [2, 5, 5]
+    assert len(result.files) == 12
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'esk2015{:02d}dmin.min'.format(month) for month in range(1, 13)
+    ]
+
+
+def test_failed_chunk_costs_only_it(tmpdir):
+    """every chunk is tried, the failure reported with what did arrive"""
+    session = ChunkedSession(fail_for=('esk201503',))
+    args = {**FETCH_ARGS}
+    args['end_date'] = date(2015, 6, 1)
+    with pytest.raises(cws.ChunkError) as err:
+        cws.fetch_station_data(saveroot=str(tmpdir), session=session,
+                               max_datasets=1, **args)
+    assert len(session.requested) == 6
+    assert len(err.value.result.files) == 5
+    assert list(err.value.errors) == ['/wdc/datasets/minute/esk201503']
+    assert 'esk201503' in str(err.value)
+    assert isinstance(err.value, ValueError)
+
+
+def test_cached_datasets_not_requested(tmpdir):
+    """only datasets the cache lacks are asked for"""
+    saveroot = str(tmpdir)
+    cache = DatasetCache(saveroot, provisional_ttl=None)
+    args = {**FETCH_ARGS}
+    args['end_date'] = date(2015, 3, 1)
+    first = cws.fetch_station_data(saveroot=saveroot, session=ChunkedSession(),
+                                   cache=cache, **args)
+    assert len(first.files) == 3
+
+    args['end_date'] = date(2015, 5, 1)
+    session = ChunkedSession()
+    second = cws.fetch_station_data(saveroot=saveroot, session=session,
+                                    cache=cache, **args)
+    assert [sorted(chunk) for chunk in session.requested] == [[
+        '/wdc/datasets/minute/esk201504', '/wdc/datasets/minute/esk201505'
+    ]]
+    assert sorted(second.files) == sorted(
+        os.path.join(saveroot, 'esk2015{:02d}dmin.min'.format(month))
+        for month in range(1, 6)
+    )
+
+    session = ChunkedSession()
+    cws.fetch_station_data(saveroot=saveroot, session=session, cache=cache,
+                           **args)
+    assert session.requested == []
+
+
+def test_convert_stage(tmpdir):
+    """the files each chunk unpacked are passed through `convert`"""
+    saveroot = str(tmpdir)
+    converted = []
+
+    def convert(files):
+        converted.append(sorted(os.path.basename(file_) for file_ in files))
+        for file_ in files:
+            os.rename(file_, file_ + '.z')
+        return [file_ + '.z' for file_ in files]
+
+    cache = DatasetCache(saveroot, provisional_ttl=None)
+    args = {**FETCH_ARGS}
+    args['end_date'] = date(2015, 3, 1)
+    result = cws.fetch_station_data(saveroot=saveroot,
+                                    session=ChunkedSession(), max_datasets=2,
+                                    cache=cache, convert=convert, **args)
+    assert converted == [['esk201501dmin.min', 'esk201502dmin.min'],
+                         ['esk201503dmin.min']]
+    assert sorted(os.path.basename(file_) for file_ in result.files) == [
+        'esk201501dmin.min.z', 'esk201502dmin.min.z', 'esk201503dmin.min.z'
+    ]
+    # the cache holds what `convert` kept
+    assert cache.files_for(['/wdc/datasets/minute/esk201503'], 'wdc') == \
+        [os.path.join(saveroot, 'esk201503dmin.min.z')]
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_observer_told_each_stage(tmpdir, stream):
+    """every stage of every chunk is timed, with the bytes moved"""
+    events = []
+    content = make_zip(MEMBERS)
+    cws.fetch_station_data(saveroot=str(tmpdir),
+                           session=SpySession(MockResponse(content)),
+                           stream=stream, observer=events.append,
+                           convert=lambda files: files, **FETCH_ARGS)
+    assert [event.stage for event in events] == [
+        'config', 'form', 'request', 'validate', 'extract', 'convert'
+    ]
+    assert all(event.station == 'ESK' for event in events)
+    assert all(event.error is None for event in events)
+    assert events[2].datasets == ['/wdc/datasets/minute/esk201501',
+                                  '/wdc/datasets/minute/esk201502']
+    assert events[2].nbytes == len(content)
+    assert events[4].nbytes == sum(len(data) for data in MEMBERS.values())
+
+
+def test_observer_told_of_failures(tmpdir):
+    """a failed stage is reported, and totalled, before the error is raised"""
+    metrics = MetricsAggregator()
+    args = {**FETCH_ARGS}
+    args['end_date'] = date(2015, 6, 1)
+    with pytest.raises(cws.ChunkError):
+        cws.fetch_station_data(saveroot=str(tmpdir),
+                               session=ChunkedSession(fail_for=('esk201503',)),
+                               max_datasets=2, observer=metrics, **args)
+    assert metrics.stages['request']['count'] == 3
+    assert metrics.stages['validate']['errors'] == 1
+    assert metrics.stages['extract']['count'] == 2
+
+
+class FlakySession(ChunkedSession):  # pylint: disable=too-few-public-methods
+    """fails each chunk's first request with `status_code`"""
+    def __init__(self, status_code, headers=None):
+        super(FlakySession, self).__init__()
+        self.status_code = status_code
+        self.headers = headers
+
+    def post(self, url, data, headers, **kwargs):
+        if data['datasets'] not in [','.join(chunk)
+                                    for chunk in self.requested]:
+            self.requested.append(data['datasets'].split(','))
+            return MockResponse(b'', self.status_code, self.headers)
+        return super(FlakySession, self).post(url, data, headers, **kwargs)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_failed_chunks_retried(tmpdir, stream):
+    """each chunk retried on its own, after the wait the server asks for"""
+    slept, events = [], []
+    args = {**FETCH_ARGS}
+    args['end_date'] = date(2015, 4, 1)
+    result = cws.fetch_station_data(
+        saveroot=str(tmpdir), session=FlakySession(503, {'Retry-After': '7'}),
+        max_datasets=2, stream=stream, observer=events.append,
+        retry=RetryPolicy(sleep=slept.append), **args
+    )
+    assert len(result.files) == 4
+    assert result.retries == 2
+    assert 'retries=2' in repr(result)
+    assert slept == [7.0, 7.0]
+    retries = [event for event in events if event.stage == 'retry']
+    assert [event.duration for event in retries] == [7.0, 7.0]
+    assert all(event.error.status_code == 503 for event in retries)
+
+
+def test_not_retried_unless_asked(tmpdir):  # pylint: disable=invalid-name
+    """by default, and for errors not worth retrying, one attempt only"""
+    with pytest.raises(cws.InvalidResponse) as err:
+        cws.fetch_station_data(saveroot=str(tmpdir),
+                               session=FlakySession(503), **FETCH_ARGS)
+    assert err.value.status_code == 503
+    session = FlakySession(404)
+    with pytest.raises(cws.InvalidResponse):
+        cws.fetch_station_data(saveroot=str(tmpdir), session=session,
+                               retry=RetryPolicy(sleep=None), **FETCH_ARGS)
+    assert len(session.requested) == 1
@@ -1,8 +1,12 @@
 """test container class for POST request form data"""
-from datetime import date
+from datetime import date, timedelta
+from hypothesis import given, strategies as st
 import pytest
 
-from gmdata_webinterface.consume_webservices import FormData
+from gmdata_webinterface.consume_webservices import (
+    FormData, plan_chunks, estimate_dataset_bytes, ESTIMATED_DATASET_BYTES,
+    parse_dataset, iter_dataset_periods
+)
 
 # tiny Mock helper classes are OK being weird
 # pylint: disable=too-few-public-methods, missing-docstring
@@ -105,3 +109,139 @@ def test_as_dict():
     payload_dict = formdata.as_dict()
     assert 'datasets' in payload_dict.keys()
     assert payload_dict.get('format') == MOCK_FORMAT
+
+
+MONTHS = ['/wdc/datasets/minute/esk2015{:02d}'.format(month)
+          for month in range(1, 13)]
+
+
+def test_plan_chunks_by_count():
+    """consecutive chunks of at most `max_datasets`, nothing lost"""
+    chunks = plan_chunks(MONTHS, max_datasets=5)
+    assert [len(chunk) for chunk in chunks] == [5, 5, 2]
+    assert [dset for chunk in chunks for dset in chunk] == MONTHS
+    assert plan_chunks(MONTHS) == [MONTHS]
+    assert plan_chunks([], max_datasets=5) == []
+
+
+def test_plan_chunks_by_bytes():
+    """chunks sized by estimated bytes, at least one dataset each"""
+    per_month = ESTIMATED_DATASET_BYTES['minute']
+    assert estimate_dataset_bytes(MONTHS[0]) == per_month
+    chunks = plan_chunks(MONTHS, max_bytes=3 * per_month)
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 3]
+    tiny = plan_chunks(MONTHS[:2], max_bytes=1)
+    assert tiny == [[MONTHS[0]], [MONTHS[1]]]
+    both = plan_chunks(MONTHS, max_bytes=3 * per_month, max_datasets=2)
+    assert [len(chunk) for chunk in both] == [2] * 6
+
+
+def test_plan_chunks_bad_limits():
+    """limits must allow at least something in a chunk"""
+    for kwargs in ({'max_datasets': 0}, {'max_bytes': -1}):
+        with pytest.raises(ValueError) as err:
+            plan_chunks(MONTHS, **kwargs)
+        assert list(kwargs)[0] in str(err.value)
+    with pytest.raises(ValueError) as err:
+        estimate_dataset_bytes('/wdc/datasets/fortnight/esk2015')
+    assert 'fortnight' in str(err.value)
+
+
+def test_split():
+    """split into several `FormData`, each its own request"""
+    formdata = FormData(MockConfig())
+    with pytest.raises(ValueError) as err:
+        formdata.split(max_datasets=2)
+    assert 'set_datasets' in str(err.value)
+    args = {**HOURLY_DATASET_ARGS}
+    args['end_date'] = date(2004, 6, 1)
+    formdata.set_datasets(**args)
+    assert formdata.split() == [formdata]
+    parts = formdata.split(max_datasets=2)
+    assert len(parts) == 3
+    assert all(part.format == MOCK_FORMAT for part in parts)
+    assert ','.join(part.datasets for part in parts) == formdata.datasets
+    assert parts[-1].datasets == \
+        '/yyy/datasets/hour/xxx2003,/yyy/datasets/hour/xxx2004'
+
+
+def test_parse_dataset():
+    """datasets split back into their parts"""
+    got = parse_dataset('/wdc/datasets/minute/esk201501')
+    assert got == ('wdc', 'minute', 'esk', 2015, 1)
+    assert got.month == 1
+    got = parse_dataset('/wdc/datasets/hour/ngk2015')
+    assert (got.cadence, got.station, got.year, got.month) == \
+        ('hour', 'ngk', 2015, None)
+    with pytest.raises(ValueError) as err:
+        parse_dataset('/wdc/datasets/hour/ngk15')
+    assert 'ngk15' in str(err.value)
+
+
+def per_day_periods(start_date, end_date, cadence):
+    """
+    the periods the original, day by day, `set_datasets` would have
+    given: the oracle for `iter_dataset_periods`
+    """
+    if cadence == 'hour':
+        return [(year,) for year in range(start_date.year, end_date.year + 1)]
+    num_days = (end_date - start_date).days + 1
+    all_days = (start_date + timedelta(day) for day in range(num_days))
+    return sorted({(day.year, day.month) for day in all_days})
+
+
+DATES = st.dates(min_value=date(1900, 1, 1), max_value=date(2100, 12, 31))
+
+
+@given(start_date=DATES, end_date=DATES,
+       cadence=st.sampled_from(['minute', 'hour']))
+def test_periods_match_per_day(start_date, end_date, cadence):
+    """the same periods as counting day by day, in chronological order"""
+    got = list(iter_dataset_periods(start_date, end_date, cadence))
+    assert got == per_day_periods(start_date, end_date, cadence)
+    assert got == sorted(set(got))
+
+
+@given(start_date=DATES, span=st.integers(min_value=0, max_value=3000))
+def test_set_datasets_ordered(start_date, span):
+    """minute datasets come out one per month, oldest first"""
+    formdata = FormData(MockConfig())
+    formdata.set_datasets(start_date, start_date + timedelta(span), 'XXX',
+                          'minute', 'YYY')
+    datasets = formdata.datasets.split(',')
+    assert datasets == sorted(set(datasets))
+    assert datasets[0].endswith('xxx{:%Y%m}'.format(start_date))
+
+
+def test_iter_dataset_periods_edges():
+    """year boundaries, single days, and bad cadences"""
+    got = list(iter_dataset_periods(date(1999, 12, 31), date(2000, 1, 1),
+                                    'minute'))
+    assert got == [(1999, 12), (2000, 1)]
+    got = list(iter_dataset_periods(date(2000, 2, 29), date(2000, 2, 29),
+                                    'minute'))
+    assert got == [(2000, 2)]
+    assert list(iter_dataset_periods(date(2000, 2, 2), date(2000, 2, 1),
+                                     'minute')) == []
+    with pytest.raises(ValueError) as err:
+        iter_dataset_periods(date(2000, 1, 1), date(2000, 2, 1), 'wibble')
+    for str_ in ['hour', 'minute', 'wibble']:
+        assert str_ in str(err.value)
+
+
+def test_fingerprint_stable():
+    """same datasets, same order, same fingerprint, every time"""
+    formdata = FormData(MockConfig())
+    with pytest.raises(ValueError):
+        formdata.fingerprint  # pylint: disable=pointless-statement
+    minutely_args = {**HOURLY_DATASET_ARGS}
+    minutely_args['cadence'] = 'minute'
+    minutely_args['end_date'] = date(2003, 1, 1)
+    formdata.set_datasets(**minutely_args)
+    again = FormData(MockConfig())
+    again.set_datasets(**minutely_args)
+    assert formdata.datasets == again.datasets
+    assert formdata.fingerprint == again.fingerprint
+    minutely_args['end_date'] = date(2003, 2, 1)
+    again.set_datasets(**minutely_args)
+    assert formdata.fingerprint != again.fingerprint
@@ -0,0 +1,65 @@
+"""
+stand-ins for the webservice shared by the tests: canned zip archives,
+and the responses which carry them
+"""
+import io
+import zipfile
+
+import requests
+
+
+def make_zip(members, compression=zipfile.ZIP_DEFLATED):
+    """bytes of a zip archive holding `members` {name: content}"""
+    buff = io.BytesIO()
+    with zipfile.ZipFile(buff, 'w', compression) as fzip:
+        for name, content in members.items():
+            fzip.writestr(name, content)
+    return buff.getvalue()
+
+
+# small Mock classes can be weird
+# pylint: disable=missing-docstring, too-few-public-methods
+class MockResponse(object):
+    """
+    a `requests.Response` with `content`, read whole or in chunks;
+    reading in chunks, the connection drops after `drop_after` bytes
+    """
+    def __init__(self, content, status_code=requests.codes.ok, headers=None,
+                 drop_after=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.drop_after = drop_after
+        self.closed = False
+        self.chunks_read = 0
+
+    def iter_content(self, chunk_size):
+        end = len(self.content)
+        if self.drop_after is not None:
+            end = self.drop_after
+        for start in range(0, end, chunk_size):
+            self.chunks_read += 1
+            yield self.content[start:min(start + chunk_size, end)]
+        if end < len(self.content):
+            raise requests.exceptions.ChunkedEncodingError('dropped')
+
+    def close(self):
+        self.closed = True
+
+
+class ChunkedSession(object):
+    """answers each request with a zip of the months asked for"""
+    def __init__(self, fail_for=()):
+        self.fail_for = fail_for
+        self.requested = []
+
+    def post(self, url, data, headers, **kwargs):
+        # pylint: disable=unused-argument
+        datasets = data['datasets'].split(',')
+        self.requested.append(datasets)
+        if any(dset.endswith(self.fail_for) for dset in datasets):
+            return MockResponse(b'', requests.codes.internal_server_error)
+        return MockResponse(make_zip({
+            dset.split('/')[-1] + 'dmin.min': b'data' for dset in datasets
+        }))
+# pylint: enable=missing-docstring, too-few-public-methods
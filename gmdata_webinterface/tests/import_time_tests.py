@@ -0,0 +1,50 @@
+"""
+what importing the package pulls in: not the network and archive
+dependencies, which load on first use.
+
+Checked in a fresh interpreter, by the modules it adds to `sys.modules`.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)
+)))
+# only imported when something is fetched (or read)
+LAZY_MODULES = ['asyncio', 'numpy', 'requests', 'six', 'tempfile',
+                'urllib3', 'zipfile']
+LIST_MODULES = 'import json, sys{}; print(json.dumps(sorted(sys.modules)))'
+
+
+def modules_imported(module):
+    """
+    names of the modules `import module` adds to `sys.modules` in a
+    fresh interpreter, beyond those there from its own start-up
+    """
+    def list_modules(imports):
+        """`sys.modules` of a fresh interpreter, after `imports`"""
+        env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+        return set(json.loads(subprocess.run(
+            [sys.executable, '-c', LIST_MODULES.format(imports)], env=env,
+            stdout=subprocess.PIPE, check=True, universal_newlines=True
+        ).stdout))
+
+    return sorted(list_modules(', ' + module) - list_modules(''))
+
+
+@pytest.mark.parametrize('module', [
+    'gmdata_webinterface.consume_webservices',
+    'gmdata_webinterface.cache',
+    'gmdata_webinterface.planner',
+    'gmdata_webinterface.cli',
+])
+def test_heavy_deps_not_imported(module):
+    """nothing slow is imported until it is needed"""
+    imported = modules_imported(module)
+    assert module in imported
+    assert [name for name in imported
+            if name.split('.')[0] in LAZY_MODULES] == []
@@ -0,0 +1,64 @@
+"""tests for timing the stages of a fetch and totalling the results"""
+import pytest
+
+from gmdata_webinterface.instrument import Event, MetricsAggregator, Stage
+
+EVENTS = [
+    Event('extract', 'ESK', ['a'], 0.5, 3000, None),
+    Event('request', 'ESK', ['a'], 2.0, 100, None),
+    Event('request', 'LER', ['b'], 1.0, 50, None),
+    Event('request', 'LER', ['c'], 0.25, None, IOError('boom')),
+    Event('config', None, None, 0.001, None, None),
+]
+
+
+def test_stage_reports_event():
+    """duration, bytes and any error are passed to the observer"""
+    events = []
+    with Stage(events.append, 'request', 'ESK', ['a']) as timing:
+        timing.nbytes = 10
+    with pytest.raises(ValueError):
+        with Stage(events.append, 'validate', 'ESK'):
+            raise ValueError('bad zip')
+    assert [(event.stage, event.nbytes) for event in events] == \
+        [('request', 10), ('validate', None)]
+    assert events[0].duration >= 0
+    assert events[0].error is None
+    assert isinstance(events[1].error, ValueError)
+    # no observer, nothing timed
+    with Stage(None, 'request', 'ESK'):
+        pass
+
+
+def test_aggregator_totals():
+    """counted by stage, in the order stages run; bytes by station"""
+    metrics = MetricsAggregator()
+    for event in EVENTS:
+        metrics(event)
+    assert list(metrics.stages) == ['config', 'request', 'extract']
+    assert metrics.stages['request'] == {
+        'count': 3, 'errors': 1, 'seconds': 3.25, 'max_seconds': 2.0,
+        'bytes': 150
+    }
+    assert metrics.stations == {'ESK': 100, 'LER': 50}
+    summary = metrics.summary().splitlines()
+    assert summary[0].split() == ['stage', 'count', 'errors', 'total', 's',
+                                  'max', 's', 'bytes']
+    assert summary[2].split() == ['request', '3', '1', '3.250', '2.000',
+                                  '150']
+
+
+def test_aggregator_exports():
+    """Prometheus exposition and StatsD lines"""
+    metrics = MetricsAggregator()
+    for event in EVENTS:
+        metrics(event)
+    prom = metrics.prometheus().splitlines()
+    assert '# TYPE gmdata_stage_count_total counter' in prom
+    assert 'gmdata_stage_count_total{stage="request"} 3' in prom
+    assert 'gmdata_stage_errors_total{stage="request"} 1' in prom
+    assert 'gmdata_stage_bytes_total{stage="extract"} 3000' in prom
+    statsd = metrics.statsd(prefix='nightly')
+    assert 'nightly.request.count:3|c' in statsd
+    assert 'nightly.request.time:3250|ms' in statsd
+    assert 'nightly.extract.bytes:3000|c' in statsd
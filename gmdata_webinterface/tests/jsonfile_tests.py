@@ -0,0 +1,14 @@
+"""tests for the JSON files kept alongside downloaded data"""
+import os
+
+from gmdata_webinterface.jsonfile import load_json, save_json
+
+
+def test_round_trip(tmpdir):
+    """written to a new folder in one step, read back the same"""
+    path = str(tmpdir.join('new', 'state.json'))
+    assert load_json(path) == {}
+    save_json(path, {'esk': '2015-01-31'})
+    save_json(path, {'esk': '2015-02-28', 'ler': None})
+    assert load_json(path) == {'esk': '2015-02-28', 'ler': None}
+    assert os.listdir(os.path.dirname(path)) == ['state.json']
@@ -0,0 +1,308 @@
+"""
+mock_server module
+
+A stand-in for the WDC download webservice, run locally on a thread so
+`fetch_data` can be tested and benchmarked end to end offline.
+
+It answers POSTs to the download route with a zip of the datasets
+asked for, built from the files in `test_data/known_good`. A dataset
+with a known-good file of its own gets that file. Any other dataset,
+e.g. another station or year, gets the known-good file of the same
+cadence, under the name it would have. Responses can be slowed, by a
+fixed latency and a bandwidth limit, and made to fail: with an error
+status, or by dropping the connection part way through the body.
+'Range' requests are honoured, as the resumable downloads need.
+
+Example
+-------
+>>> with MockWDCServer(latency=0.05, bandwidth=10e6) as server:
+...     fetch_data(..., configpath=server.write_config(tmpdir))
+
+@author: W. Brown
+"""
+import glob
+import hashlib
+import io
+import os
+import random
+import re
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+from gmdata_webinterface.consume_webservices import parse_dataset
+from gmdata_webinterface.planner import expected_file_names
+from gmdata_webinterface.sandboxed_format import safe_format
+
+KNOWN_GOOD = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'test_data', 'known_good')
+ROUTE = 'wdc/datasets/download'
+# bytes written at a time, and so how finely `bandwidth` is kept to
+WRITE_CHUNK_SIZE = 16 * 1024
+CONFIG_TEMPLATE = """[WDC]
+FileFormat = {file_format}
+Hostname = {url}
+Route = {route}
+Accept = text/html, application/xhtml+xml, application/xml\\; q=0.9,*/*\\; q=0
+Accept-Encoding = gzip, deflate
+Content-Type = application/x-www-form-urlencoded
+_format_template = text/x-{{}}
+"""
+
+
+class MockWDCServer(object):
+    """
+    A local WDC download server, serving from a thread
+    between `start` and `stop` (or within a `with` block)
+
+    Parameters
+    ----------
+    latency: float, default 0
+        seconds to wait before answering each request
+    bandwidth: float or (default) `None`
+        most bytes per second sent in each response body;
+        `None` for as fast as possible
+    error_rate: float, default 0
+        chance of answering a request with `error_status`
+    drop_rate: float, default 0
+        chance of dropping the connection half way through a body
+    error_status: int, default 503
+    retry_after: float or (default) `None`
+        sent as 'Retry-After' with each error
+    seed: int or (default) `None`
+        for the random choice of which requests fail
+    data_path: file path as string, default `KNOWN_GOOD`
+        folder of the files served
+
+    Attributes
+    ----------
+    url: string
+        e.g. 'http://127.0.0.1:50123', once started
+    requests: list of list of string
+        the datasets asked for by each request received
+    bytes_sent: int
+        total bytes of the response bodies sent
+    max_in_flight: int
+        most requests being answered at the same time
+    """
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0,
+                 drop_rate=0.0, error_status=503, retry_after=None, seed=None,
+                 data_path=KNOWN_GOOD):
+        """ see class docstring """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.data_path = data_path
+        self.requests = []
+        self.bytes_sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._archives = {}
+        self._httpd = None
+        self._thread = None
+
+    def __repr__(self):
+        return safe_format('{}(url={}, latency={}, bandwidth={})',
+                           self.__class__.__name__, repr(self.url),
+                           self.latency, self.bandwidth)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    @property
+    def url(self):
+        """where we are listening, or `None` if not started"""
+        if self._httpd is None:
+            return None
+        host, port = self._httpd.server_address[:2]
+        return safe_format('http://{}:{}', host, port)
+
+    def start(self):
+        """listen on a free local port, serving from a daemon thread"""
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._httpd.mock = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """stop serving and close the socket"""
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def write_config(self, folder, file_format='iaga2002'):
+        """
+        Write a configuration file pointing `fetch_data` at us
+        to `folder`, asking for `file_format`
+
+        Returns
+        -------
+        path to the file, for `configpath`
+        """
+        path = os.path.join(str(folder), 'mock_wdc.ini')
+        with open(path, 'w') as file_:
+            file_.write(safe_format(CONFIG_TEMPLATE, file_format=file_format,
+                                    url=self.url, route=ROUTE))
+        return path
+
+    def archive(self, datasets, file_format):
+        """
+        bytes of the zip archive answering a request for `datasets`
+        in `file_format`, and its ETag; built once for each request
+        """
+        key = (tuple(datasets), file_format)
+        with self._lock:
+            if key not in self._archives:
+                buff = io.BytesIO()
+                with zipfile.ZipFile(buff, 'w', zipfile.ZIP_DEFLATED) as fzip:
+                    for dataset in datasets:
+                        name, path = self._member(dataset, file_format)
+                        fzip.write(path, name)
+                content = buff.getvalue()
+                etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+                self._archives[key] = (content, etag)
+            return self._archives[key]
+
+    def _member(self, dataset, file_format):
+        """the name `dataset` is served as, and the file served"""
+        parsed = parse_dataset(dataset)
+        names = expected_file_names(dataset, file_format)
+        name = names[0] if names else \
+            dataset.rsplit('/', 1)[-1] + '.' + file_format
+        own = os.path.join(self.data_path, name)
+        if os.path.isfile(own):
+            return name, own
+        pattern = '*dmin.min' if parsed.cadence == 'minute' else '*.wdc'
+        stand_ins = sorted(glob.glob(os.path.join(self.data_path, pattern)))
+        if parsed.month is not None and len(stand_ins) >= parsed.month:
+            return name, stand_ins[parsed.month - 1]
+        return name, stand_ins[0]
+
+    def fault(self):
+        """`None`, 'error' or 'drop': how the next response should fail"""
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.error_rate:
+            return 'error'
+        if draw < self.error_rate + self.drop_rate:
+            return 'drop'
+        return None
+
+    def record(self, datasets, nbytes=0):
+        """note a request for `datasets`, or `nbytes` more sent"""
+        with self._lock:
+            if datasets is not None:
+                self.requests.append(datasets)
+            self.bytes_sent += nbytes
+
+    def answering(self, change):
+        """note `change` (+1 or -1) in the requests being answered"""
+        with self._lock:
+            self.in_flight += change
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """an `HTTPServer` answering each connection on its own thread"""
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """answers requests for `_ThreadingHTTPServer.mock`"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """answer a request for datasets with a zip of them"""
+        mock = self.server.mock
+        mock.answering(+1)
+        try:
+            self._answer(mock)
+        finally:
+            mock.answering(-1)
+
+    def _answer(self, mock):
+        """answer the request, see `do_POST`"""
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if self.path.strip('/') != ROUTE:
+            return self._empty(404)
+        datasets = form.get('datasets', [''])[0].split(',')
+        file_format = form.get('format', ['text/x-wdc'])[0].rsplit('-', 1)[-1]
+        try:
+            content, etag = mock.archive(datasets, file_format)
+        except (ValueError, IndexError):
+            return self._empty(400)
+        mock.record(datasets)
+        time.sleep(mock.latency)
+
+        fault = mock.fault()
+        if fault == 'error':
+            headers = {}
+            if mock.retry_after is not None:
+                headers['Retry-After'] = str(mock.retry_after)
+            return self._empty(mock.error_status, headers)
+        start = 0
+        wanted = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if wanted and self.headers.get('If-Range') == etag:
+            start = int(wanted.group(1))
+            if start >= len(content):
+                return self._empty(416)
+            self.send_response(206)
+            self.send_header('Content-Range', safe_format(
+                'bytes {}-{}/{}', start, len(content) - 1, len(content)
+            ))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(len(content) - start))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        end = len(content)
+        if fault == 'drop':
+            end = start + (end - start) // 2
+            self.close_connection = True
+        self._send(content, start, end)
+
+    def _send(self, content, start, end):
+        """write `content[start:end]`, keeping to the bandwidth limit"""
+        mock = self.server.mock
+        started = time.perf_counter()
+        sent = 0
+        for offset in range(start, end, WRITE_CHUNK_SIZE):
+            chunk = content[offset:min(offset + WRITE_CHUNK_SIZE, end)]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            mock.record(None, len(chunk))
+            if mock.bandwidth:
+                ahead = sent / mock.bandwidth - \
+                    (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        self.wfile.flush()
+
+    def _empty(self, status, headers=None):
+        """answer with `status` and no body"""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *_):  # pylint: disable=arguments-differ
+        """say nothing of each request"""
+        pass
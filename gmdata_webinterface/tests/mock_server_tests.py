@@ -0,0 +1,103 @@
+"""
+end-to-end tests of `fetch_data`, offline, against the stand-in
+WDC server in `mock_server`
+"""
+import filecmp
+import os
+from datetime import date
+
+import pytest
+
+from gmdata_webinterface import consume_webservices as cws
+from gmdata_webinterface.tests.mock_server import KNOWN_GOOD, MockWDCServer
+from gmdata_webinterface.transport import RetryPolicy
+
+
+def no_sleep(_):
+    """skip the back-off between retries"""
+    pass
+
+
+def fetch(server, saveroot, stations=('ESK',), end=date(2015, 3, 31),
+          **kwargs):
+    """fetch minute data from 2015-01 to `end` from `server`"""
+    return cws.fetch_data(
+        start_date=date(2015, 1, 1), end_date=end, station_list=stations,
+        cadence='minute', service='WDC', saveroot=str(saveroot),
+        configpath=server.write_config(saveroot.dirpath()), **kwargs
+    )
+
+
+def test_known_good_served(tmpdir):
+    """the files fetched are those in `known_good`"""
+    saveroot = tmpdir.mkdir('data')
+    with MockWDCServer() as server:
+        fetch(server, saveroot)
+    assert server.requests == [['/wdc/datasets/minute/esk201501',
+                                '/wdc/datasets/minute/esk201502',
+                                '/wdc/datasets/minute/esk201503']]
+    for month in ('01', '02', '03'):
+        name = 'esk2015' + month + 'dmin.min'
+        assert filecmp.cmp(str(saveroot.join(name)),
+                           os.path.join(KNOWN_GOOD, name), shallow=False)
+
+
+def test_other_stations_stood_in(tmpdir):
+    """any station is served, under its own name"""
+    saveroot = tmpdir.mkdir('data')
+    with MockWDCServer() as server:
+        fetch(server, saveroot, stations=('LER', 'HAD'),
+              end=date(2015, 1, 31), max_workers=2, stream=True)
+    assert sorted(os.listdir(str(saveroot))) == ['had201501dmin.min',
+                                                 'ler201501dmin.min']
+
+
+def test_chunks_overlap(tmpdir):
+    """the default session has a connection for every chunk worker"""
+    with MockWDCServer(latency=0.2) as server:
+        fetch(server, tmpdir.mkdir('data'), max_datasets=1, chunk_workers=3)
+    assert len(server.requests) == 3
+    assert server.max_in_flight == 3
+
+
+def test_errors_retried(tmpdir):
+    """injected errors are retried, honouring 'Retry-After'"""
+    waits = []
+    retry = RetryPolicy(max_attempts=10, sleep=waits.append)
+    with MockWDCServer(error_rate=0.5, retry_after=0.25, seed=1) as server:
+        fetch(server, tmpdir.mkdir('data'), retry=retry)
+    assert len(server.requests) == len(waits) + 1 > 1
+    assert set(waits) == {0.25}
+
+
+def test_dropped_connection_resumed(tmpdir):
+    """a body cut short is finished with a 'Range' request"""
+    saveroot = tmpdir.mkdir('data')
+    retry = RetryPolicy(max_attempts=10, sleep=no_sleep)
+    with MockWDCServer(drop_rate=0.5, seed=1) as server:
+        fetch(server, saveroot, retry=retry, resume=True)
+    assert len(server.requests) > 1
+    # what was cut short is not sent again
+    content, _ = server.archive(server.requests[0], 'iaga2002')
+    assert server.bytes_sent < 2 * len(content)
+    assert len(os.listdir(str(saveroot))) == 3
+
+
+def test_latency_and_bandwidth(tmpdir):
+    """responses are slowed as asked"""
+    observed = []
+    with MockWDCServer(latency=0.1, bandwidth=2e6) as server:
+        fetch(server, tmpdir.mkdir('data'), end=date(2015, 1, 31),
+              observer=observed.append)
+    content, _ = server.archive(server.requests[0], 'iaga2002')
+    request = [event for event in observed if event.stage == 'request'][0]
+    assert request.duration > 0.1 + len(content) / 2e6 * 0.9
+
+
+def test_bad_request():
+    """anything not a download is refused"""
+    with MockWDCServer() as server:
+        rq = pytest.importorskip('requests')
+        assert rq.post(server.url + '/wdc/elsewhere').status_code == 404
+        assert rq.post(server.url + '/wdc/datasets/download',
+                       data={'datasets': 'nonsense'}).status_code == 400
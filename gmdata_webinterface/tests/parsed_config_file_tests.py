@@ -3,9 +3,11 @@ tests for the reading of config files for
 bits of websrevice requests that will not change much
 """
 import configparser
+import os
 
 import pytest
 
+from gmdata_webinterface import consume_webservices as cws
 from gmdata_webinterface.consume_webservices import ParsedConfigFile, ConfigError
 
 # these small Mock classes are OK weird
@@ -211,3 +213,35 @@ def test_reads_supplied_filename(monkeypatch):
     ParsedConfigFile(filename, THE_SERVICE)
     assert SpyCfgParser.read_call_count == 1
     assert SpyCfgParser.read_called_with == filename
+
+
+def test_load_config_reads_once(tmpdir, monkeypatch):
+    """a config is parsed again only when its file changes"""
+    cws.clear_config_cache()
+    parsed = []
+    real_init = ParsedConfigFile.__init__
+
+    def spy_init(self, *args):
+        parsed.append(args)
+        real_init(self, *args)
+
+    monkeypatch.setattr(ParsedConfigFile, '__init__', spy_init)
+    path = tmpdir.join('consume_rest.ini')
+    with open(cws.DEFAULT_CONFIGPATH) as default:
+        path.write(default.read())
+    first = cws.load_config(str(path), 'WDC')
+    assert cws.load_config(str(path), 'WDC') is first
+    assert len(parsed) == 1
+    assert cws.load_config(None, 'WDC') is cws.load_config(
+        cws.DEFAULT_CONFIGPATH, 'WDC')
+    assert len(parsed) == 2
+
+    path.write(path.read().replace('FileFormat = wdc', 'FileFormat = wibble'))
+    os.utime(str(path), ns=(0, 0))
+    changed = cws.load_config(str(path), 'WDC')
+    assert changed is not first
+    assert 'wibble' in changed.dataformat
+    with pytest.raises(ConfigError):
+        cws.load_config(str(path), 'NOPE')
+    with pytest.raises(ConfigError):
+        cws.load_config(str(tmpdir.join('missing.ini')), 'WDC')
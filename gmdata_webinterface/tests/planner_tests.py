@@ -0,0 +1,113 @@
+"""
+tests for planning a fetch, and for running the plan,
+with the webservice replaced by canned zip responses
+"""
+from datetime import date
+import json
+import os
+
+from gmdata_webinterface.cache import DatasetCache
+from gmdata_webinterface.consume_webservices import ESTIMATED_DATASET_BYTES
+from gmdata_webinterface.planner import expected_file_names, plan_fetch
+from gmdata_webinterface.tests.helpers import ChunkedSession
+
+DATAPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'test_data')
+IAGA_CONFIG = os.path.join(DATAPATH, 'wdc_minute_data_iaga2002output.ini')
+PLAN_ARGS = {
+    'start_date': date(2015, 1, 15),
+    'end_date': date(2015, 6, 2),
+    'station_list': ['ESK', 'LER'],
+    'cadence': 'minute',
+    'service': 'WDC',
+    'configpath': IAGA_CONFIG,
+}
+
+
+def test_expected_file_names():
+    """named as the server names them, where we know how"""
+    assert expected_file_names('/wdc/datasets/minute/esk201501',
+                               'iaga2002') == ['esk201501dmin.min']
+    assert expected_file_names('/wdc/datasets/hour/ngk2015', 'wdc') == \
+        ['ngk2015.wdc']
+    assert expected_file_names('/wdc/datasets/minute/esk201501', 'wdc') == []
+
+
+def test_plan(tmpdir):
+    """requests, datasets, sizes and files, per station"""
+    plan = plan_fetch(saveroot=str(tmpdir), max_datasets=4, **PLAN_ARGS)
+    assert plan.stations == ['ESK', 'LER']
+    assert [(request.station, len(request.datasets))
+            for request in plan.requests] == \
+        [('ESK', 4), ('ESK', 2), ('LER', 4), ('LER', 2)]
+    assert plan.requests[1].datasets == ['/wdc/datasets/minute/esk201505',
+                                         '/wdc/datasets/minute/esk201506']
+    assert plan.requests[1].file_names == ['esk201505dmin.min',
+                                           'esk201506dmin.min']
+    assert plan.requests[1].form_data.datasets == \
+        ','.join(plan.requests[1].datasets)
+    assert plan.estimated_bytes == 12 * ESTIMATED_DATASET_BYTES['minute']
+    assert plan.n_satisfied == 0
+    summary = plan.summary()
+    assert summary.startswith('4 requests for 12 datasets, about 37.2 MB')
+    assert 'esk201501..esk201504' in summary
+    json.dumps(plan.as_dict())
+
+
+def test_plan_skips_what_is_cached(tmpdir):
+    """datasets the cache holds are not planned for"""
+    tmpdir.join('esk201502dmin.min').write('old')
+    cache = DatasetCache(str(tmpdir), provisional_ttl=None)
+    cache.record(['/wdc/datasets/minute/esk201502'],
+                 [str(tmpdir.join('esk201502dmin.min'))], 'iaga2002')
+    plan = plan_fetch(saveroot=str(tmpdir), cache=cache, **PLAN_ARGS)
+    assert list(plan.satisfied['ESK']) == ['/wdc/datasets/minute/esk201502']
+    assert plan.satisfied['ESK']['/wdc/datasets/minute/esk201502'] == \
+        [str(tmpdir.join('esk201502dmin.min'))]
+    assert len(plan.requests[0].datasets) == 5
+    assert plan.n_satisfied == 1
+    assert list(plan.satisfied['LER']) == []
+
+
+def test_plan_fetches_uncached_files(tmpdir):
+    """files on disk may be empty or partial: without a cache, refetch"""
+    tmpdir.join('esk201501dmin.min').write('')
+    tmpdir.join('esk201502dmin.min').write('cut sho')
+    plan = plan_fetch(saveroot=str(tmpdir), **PLAN_ARGS)
+    assert plan.n_satisfied == 0
+    assert len(plan.requests[0].datasets) == 6
+    assert list(plan.on_disk['ESK']) == ['/wdc/datasets/minute/esk201501',
+                                         '/wdc/datasets/minute/esk201502']
+    assert 'ESK   on disk, fetched again: esk201501dmin.min ' \
+        'esk201502dmin.min' in plan.summary()
+    assert plan.as_dict()['on_disk']['LER'] == {}
+
+    session = ChunkedSession()
+    results = plan.execute(session=session)
+    assert session.requested[0] == plan.requests[0].datasets
+    assert tmpdir.join('esk201501dmin.min').read() == 'data'
+    assert tmpdir.join('esk201502dmin.min').read() == 'data'
+    assert len(results['ESK'].files) == 6
+
+
+def test_plan_executed(tmpdir):
+    """exactly the requests planned are sent"""
+    tmpdir.join('esk201502dmin.min').write('old')
+    cache = DatasetCache(str(tmpdir), provisional_ttl=None)
+    cache.record(['/wdc/datasets/minute/esk201502'],
+                 [str(tmpdir.join('esk201502dmin.min'))], 'iaga2002')
+    plan = plan_fetch(saveroot=str(tmpdir), max_datasets=3, cache=cache,
+                      **PLAN_ARGS)
+    session = ChunkedSession()
+    results = plan.execute(session=session, max_workers=2)
+    assert sorted(session.requested) == sorted(request.datasets
+                                               for request in plan.requests)
+    assert len(results['ESK'].files) == 6
+    assert results['ESK'].files[0].endswith('esk201502dmin.min')
+    assert tmpdir.join('esk201502dmin.min').read() == 'old'
+    assert len(results['LER'].files) == 6
+
+    # nothing left to plan
+    again = plan_fetch(saveroot=str(tmpdir), cache=cache, **PLAN_ARGS)
+    assert again.requests == []
+    assert again.execute(session=ChunkedSession())['LER'].ok
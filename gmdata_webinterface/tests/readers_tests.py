@@ -0,0 +1,360 @@
+"""tests for reading downloaded data files into numpy arrays"""
+import os
+
+import numpy as np
+import pytest
+
+from gmdata_webinterface.readers import (
+    read_iaga2002, parse_iaga2002, read_wdc, parse_wdc, concatenate,
+    ReaderError, GeomagData, MappedIAGA2002, IAGA2002Archive,
+    write_npz, read_npz, NpzConverter
+)
+
+ORACLEPATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'test_data', 'known_good'
+)
+ESK_JAN = os.path.join(ORACLEPATH, 'esk201501dmin.min')
+
+HEADER = b'''\
+ Format                  IAGA-2002                                    |
+ Source of Data          British Geological Survey                    |
+ IAGA Code               LER                                          |
+ Geodetic Latitude       60.138                                       |
+ Geodetic Longitude      358.817                                      |
+ Elevation               85                                           |
+ Reported                HDZF                                         |
+ Data Interval Type      PT1M                                         |
+ # a comment about the data                                           |
+DATE       TIME         DOY     LERH      LERD      LERZ      LERF   |
+'''
+DATA = b'''\
+1999-12-31 23:59:00.000 365     14821.50     -3.25  50000.00  99999.00
+2000-01-01 00:00:00.000 001     14821.75    -12.50  88888.00  52000.25
+'''
+
+
+def read_line_by_line(path):
+    """the slow, obvious way: the oracle for the vectorised reader"""
+    times, values = [], []
+    with open(path) as file_:
+        for line in file_:
+            if line[:1].isdigit():
+                fields = line.split()
+                times.append(fields[0] + 'T' + fields[1])
+                values.append([float(field) for field in fields[3:]])
+    values = np.array(values)
+    values[values >= 88888] = np.nan
+    return np.array(times, dtype='datetime64[ms]'), values
+
+
+@pytest.mark.parametrize('month', [1, 2, 6, 12])
+def test_read_known_good(month):
+    """same numbers as parsing line by line"""
+    path = os.path.join(ORACLEPATH, 'esk2015{:02d}dmin.min'.format(month))
+    got = read_iaga2002(path)
+    times, values = read_line_by_line(path)
+    np.testing.assert_array_equal(got.times, times)
+    np.testing.assert_array_equal(got.values, values)
+    assert got.values.dtype == np.float64
+    assert got.times.dtype == np.dtype('datetime64[ms]')
+
+
+def test_read_metadata():
+    """header fields come back typed where sensible"""
+    got = read_iaga2002(ESK_JAN)
+    assert got.components == ['X', 'Y', 'Z', 'F']
+    assert got.metadata['iaga_code'] == 'ESK'
+    assert got.metadata['reported'] == 'XYZF'
+    assert got.metadata['data_interval_type'] == 'PT1M'
+    assert got.metadata['data_type'] == 'DEFINITIVE'
+    assert got.metadata['geodetic_latitude'] == -55.317
+    assert got.metadata['geodetic_longitude'] == 356.8
+    assert len(got) == 31 * 1440
+    assert got.times[-1] == np.datetime64('2015-01-31T23:59')
+    np.testing.assert_array_equal(got['X'], got.values[:, 0])
+    with pytest.raises(KeyError):
+        got['Q']  # pylint: disable=pointless-statement
+    assert 'ESK' in repr(got)
+
+
+@pytest.mark.parametrize('newline', [b'\n', b'\r\n'])
+def test_parse_missing_values_and_comments(newline):
+    """sentinels become NaN; comments and line endings are handled"""
+    got = parse_iaga2002((HEADER + DATA).replace(b'\n', newline))
+    assert got.components == ['H', 'D', 'Z', 'F']
+    assert got.metadata['source_of_data'] == 'British Geological Survey'
+    assert got.metadata['elevation'] == 85.0
+    assert got.metadata['comments'] == ['a comment about the data']
+    np.testing.assert_array_equal(got.times, np.array(
+        ['1999-12-31T23:59', '2000-01-01T00:00'], dtype='datetime64[ms]'
+    ))
+    np.testing.assert_array_equal(got.values, [
+        [14821.5, -3.25, 50000.0, np.nan],
+        [14821.75, -12.5, np.nan, 52000.25],
+    ])
+
+
+def test_parse_ragged_lines():
+    """lines of differing width are read by the slower fallback"""
+    ragged = DATA.replace(b'  50000.00', b' 50000.00')
+    got = parse_iaga2002(HEADER + ragged.rstrip(b'\n'))
+    assert got.values[0, 2] == 50000.0
+    assert len(got) == 2
+
+
+def test_parse_unusual_number_layout():
+    """fields without a fixed decimal point still parse"""
+    odd = DATA.replace(b'  50000.00', b'   50000.0')
+    got = parse_iaga2002(HEADER + odd)
+    np.testing.assert_array_equal(got['Z'], [50000.0, np.nan])
+    np.testing.assert_array_equal(got['H'], [14821.5, 14821.75])
+
+
+def test_parse_empty_and_bad():
+    """no data is fine, no column header is not"""
+    got = parse_iaga2002(HEADER)
+    assert isinstance(got, GeomagData)
+    assert len(got) == 0
+    assert got.values.shape == (0, 4)
+    with pytest.raises(ReaderError):
+        parse_iaga2002(DATA)
+
+
+NGK_2015 = os.path.join(ORACLEPATH, 'ngk2015.wdc')
+
+
+def wdc_record(element, day, base, hourly, mean=9999, code=b'ABC',
+               year=b'99', century=b'19', flags=b'    '):
+    """one 120 character WDC format record"""
+    record = (code + year + b'01' + element + '{:02d}'.format(day).encode() +
+              flags + century + '{:4d}'.format(base).encode() +
+              b''.join('{:4d}'.format(value).encode() for value in hourly) +
+              '{:4d}'.format(mean).encode())
+    assert len(record) == 120
+    return record + b'\n'
+
+
+def read_wdc_line_by_line(path):
+    """the slow, obvious way: the oracle for `read_wdc`"""
+    rows = {}
+    with open(path) as file_:
+        for line in file_:
+            base = int(line[16:20]) * 100
+            hourly = [int(line[start:start + 4])
+                      for start in range(20, 116, 4)]
+            rows.setdefault(line[7], []).extend(
+                np.nan if value == 9999 else base + value
+                for value in hourly
+            )
+    return rows
+
+
+def test_read_wdc_known_good():
+    """same numbers as decoding record by record"""
+    got = read_wdc(NGK_2015)
+    assert got.components == ['X', 'Y', 'Z', 'F']
+    assert got.metadata['iaga_code'] == 'NGK'
+    assert len(got) == 365 * 24
+    assert got.times[0] == np.datetime64('2015-01-01T00:30')
+    assert got.times[-1] == np.datetime64('2015-12-31T23:30')
+    for component, values in read_wdc_line_by_line(NGK_2015).items():
+        np.testing.assert_array_equal(got[component], values)
+    assert got.values[0, 0] == 14400 + 4455
+    # no daily means in this file
+    assert np.isnan(got.metadata['daily_means']).all()
+
+
+def test_parse_wdc_angles_gaps_and_sentinels():  # pylint: disable=invalid-name
+    """declination in arc-minutes, missing days and values as NaN"""
+    content = (
+        wdc_record(b'H', 1, 170, [100] * 23 + [9999], mean=150) +
+        wdc_record(b'D', 1, -2, [-55] * 24, mean=-55) +
+        wdc_record(b'H', 3, 170, [200] * 24) +
+        wdc_record(b'D', 3, -2, [5] * 24)
+    )
+    got = parse_wdc(content)
+    assert got.components == ['H', 'D']
+    assert got.metadata['iaga_code'] == 'ABC'
+    assert len(got) == 3 * 24
+    assert got.times[0] == np.datetime64('1999-01-01T00:30')
+    np.testing.assert_array_equal(got['H'][:23], 17100)
+    assert np.isnan(got['H'][23])
+    # day 2 has no records
+    assert np.isnan(got.values[24:48]).all()
+    np.testing.assert_allclose(got['D'][:24], -120 - 5.5)
+    np.testing.assert_allclose(got['D'][48:], -120 + 0.5)
+    np.testing.assert_allclose(got.metadata['daily_means'][0],
+                               [17150, -125.5])
+
+
+def test_parse_wdc_day_flags():
+    """the Q/D-day flags are skipped, not read as numbers"""
+    content = (wdc_record(b'H', 1, 170, [100] * 24, flags=b'   Q') +
+               wdc_record(b'H', 2, 170, [200] * 24, flags=b'  DH'))
+    got = parse_wdc(content)
+    assert got.times[0] == np.datetime64('1999-01-01T00:30')
+    np.testing.assert_array_equal(got['H'], [17100] * 24 + [17200] * 24)
+
+
+def test_parse_wdc_bad():
+    """records of the wrong width or from several stations"""
+    with pytest.raises(ReaderError):
+        parse_wdc(b'too short\n')
+    with pytest.raises(ReaderError):
+        parse_wdc(b'')
+    with pytest.raises(ReaderError) as err:
+        parse_wdc(wdc_record(b'H', 1, 170, [100] * 24) +
+                  wdc_record(b'H', 1, 170, [100] * 24, code=b'XYZ'))
+    assert 'XYZ' in str(err.value)
+    with pytest.raises(ReaderError) as err:
+        parse_wdc(wdc_record(b'H', 1, 170, [100] * 24) +
+                  wdc_record(b'H', 2, 170, [100] * 24) +
+                  wdc_record(b'H', 3, 170, [100] * 24).replace(b' 100',
+                                                               b' 1O0', 1))
+    assert 'line 3' in str(err.value)
+
+
+def test_concatenate_months():
+    """consecutive files join into one sorted series"""
+    feb = read_iaga2002(os.path.join(ORACLEPATH, 'esk201502dmin.min'))
+    jan = read_iaga2002(ESK_JAN)
+    both = concatenate([feb, jan])
+    assert len(both) == len(jan) + len(feb)
+    assert (np.diff(both.times) == np.timedelta64(1, 'm')).all()
+    assert both.metadata['iaga_code'] == 'ESK'
+    with pytest.raises(ValueError):
+        concatenate([jan, parse_iaga2002(HEADER + DATA)])
+    with pytest.raises(ValueError):
+        concatenate([])
+
+
+@pytest.mark.parametrize('start, end', [
+    (None, None),
+    ('2015-01-10T12:00', '2015-01-10T13:00'),
+    ('2015-01-10T12:00:30', '2015-01-11'),
+    ('2014-12-01', '2015-01-01T00:05'),
+    ('2015-01-31T23:59', '2015-03-01'),
+    ('2015-03-01', '2015-04-01'),
+])
+def test_mapped_slices_match_full_read(start, end):
+    """a lazily read slice is the same as slicing the whole file"""
+    full = read_iaga2002(ESK_JAN)
+    wanted = np.ones(len(full), dtype=bool)
+    if start is not None:
+        wanted &= full.times >= np.datetime64(start)
+    if end is not None:
+        wanted &= full.times < np.datetime64(end)
+    with MappedIAGA2002(ESK_JAN) as mapped:
+        assert len(mapped) == len(full)
+        assert mapped.start == full.times[0]
+        assert mapped.end == full.times[-1] + np.timedelta64(1, 'm')
+        got = mapped.read(start, end)
+        np.testing.assert_array_equal(got.times, full.times[wanted])
+        np.testing.assert_array_equal(got.values, full.values[wanted])
+        some = mapped.read(start, end, components=['Z', 'X'])
+        np.testing.assert_array_equal(some.values,
+                                      full.values[wanted][:, [2, 0]])
+        assert some.components == ['Z', 'X']
+        with pytest.raises(KeyError):
+            mapped.read(components=['Q'])
+
+
+@pytest.mark.parametrize('newline', [b'\n', b'\r\n'])
+def test_mapped_uneven_or_ragged(tmpdir, newline):
+    """gaps in time and ragged lines are searched, not computed"""
+    data = (b'2015-01-01 00:00:00.000 001        1.00      2.00      3.00'
+            b'      4.00\n'
+            b'2015-01-01 00:01:00.000 001        5.00      6.00      7.00'
+            b'      8.00   \n'
+            b'2015-01-01 00:05:00.000 001        9.00     10.00     11.00'
+            b'     12.00')
+    path = tmpdir.join('ler20150101dmin.min')
+    path.write_binary((HEADER + data).replace(b'\n', newline))
+    with MappedIAGA2002(str(path)) as mapped:
+        got = mapped.read('2015-01-01T00:01', '2015-01-01T00:06')
+        np.testing.assert_array_equal(got.values, [[5, 6, 7, 8],
+                                                   [9, 10, 11, 12]])
+        assert mapped.read(end='2015-01-01').times.size == 0
+
+
+@pytest.mark.parametrize('newline', [b'\n', b'\r\n'])
+@pytest.mark.parametrize('last_ending', [True, False])
+def test_mapped_rows_viewed_in_place(tmpdir, newline, last_ending):
+    """lines of one width are viewed in the map, not copied"""
+    data = DATA if last_ending else DATA[:-1]
+    path = tmpdir.join('ler20000101dmin.min')
+    path.write_binary((HEADER + data).replace(b'\n', newline))
+    with MappedIAGA2002(str(path)) as mapped:
+        width = len(DATA.splitlines()[0])
+        assert mapped.rows.shape == (2, width)
+        # stepping over each line ending in the map
+        assert mapped.rows.strides == (width + len(newline), 1)
+        np.testing.assert_array_equal(mapped.read().values,
+                                      parse_iaga2002(HEADER + DATA).values)
+
+
+def test_archive_reads_across_files(tmpdir):
+    """only the files covering the time asked for are decoded"""
+    for month in (1, 2, 3):
+        name = 'esk2015{:02d}dmin.min'.format(month)
+        with open(os.path.join(ORACLEPATH, name), 'rb') as file_:
+            tmpdir.join(name).write_binary(file_.read())
+    tmpdir.join('ler20000101dmin.min').write_binary(HEADER + DATA)
+    with IAGA2002Archive(str(tmpdir)) as archive:
+        assert archive.stations == ['ESK', 'LER']
+        got = archive.read('esk', '2015-01-31T12:00', '2015-02-01T12:00',
+                           components=['X'])
+        assert len(got) == 24 * 60
+        assert (np.diff(got.times) == np.timedelta64(1, 'm')).all()
+        feb = read_iaga2002(str(tmpdir.join('esk201502dmin.min')))
+        np.testing.assert_array_equal(got['X'][-720:], feb['X'][:720])
+        assert len(archive.read('LER')) == 2
+        with pytest.raises(KeyError):
+            archive.read('HAD')
+        with pytest.raises(ValueError):
+            archive.read()
+
+
+@pytest.mark.parametrize('dtype', [None, np.float32])
+def test_npz_round_trip(tmpdir, dtype):
+    """times, values, components and header all survive"""
+    data = read_iaga2002(ESK_JAN)
+    path = str(tmpdir.join('esk201501dmin.npz'))
+    write_npz(data, path, dtype)
+    got = read_npz(path)
+    np.testing.assert_array_equal(got.times, data.times)
+    assert got.values.dtype == (dtype or np.float64)
+    np.testing.assert_allclose(got.values, data.values, rtol=1e-7)
+    assert got.components == data.components
+    assert got.metadata == data.metadata
+    assert os.listdir(str(tmpdir)) == ['esk201501dmin.npz']
+    np.save(str(tmpdir.join('other.npy')), np.zeros(3))
+    with pytest.raises(ReaderError):
+        read_npz(str(tmpdir.join('other.npy')))
+
+
+@pytest.mark.parametrize('keep_text', [True, False])
+def test_npz_converter(tmpdir, keep_text):
+    """data files are converted, anything else passed over"""
+    paths = []
+    for name in ['esk201501dmin.min', 'ngk2015.wdc']:
+        with open(os.path.join(ORACLEPATH, name), 'rb') as file_:
+            tmpdir.join(name).write_binary(file_.read())
+        paths.append(str(tmpdir.join(name)))
+    tmpdir.join('README.txt').write('hello')
+    paths.append(str(tmpdir.join('README.txt')))
+    convert = NpzConverter(np.float32, keep_text=keep_text)
+    kept = convert(paths)
+    expected = ['README.txt', 'esk201501dmin.npz', 'ngk2015.npz']
+    if keep_text:
+        expected += ['esk201501dmin.min', 'ngk2015.wdc']
+    assert sorted(os.path.basename(path) for path in kept) == \
+        sorted(expected)
+    assert sorted(os.listdir(str(tmpdir))) == sorted(expected)
+    hourly = read_npz(str(tmpdir.join('ngk2015.npz')))
+    assert hourly.values.dtype == np.float32
+    assert hourly.metadata['iaga_code'] == 'NGK'
+    hourly_text = read_wdc(os.path.join(ORACLEPATH, 'ngk2015.wdc'))
+    np.testing.assert_array_equal(hourly.metadata['daily_means'],
+                                  hourly_text.metadata['daily_means'])
@@ -0,0 +1,193 @@
+"""
+tests for resuming downloads cut short, with the webservice replaced
+by a canned zip response which can drop part way through
+"""
+from datetime import date
+import gzip
+import os
+import re
+import zipfile
+
+import pytest
+import requests
+
+from gmdata_webinterface import consume_webservices as cws
+from gmdata_webinterface.resume import PartialDownload
+from gmdata_webinterface.tests.helpers import MockResponse, make_zip
+from gmdata_webinterface.transport import RetryPolicy
+
+MEMBERS = {
+    'esk2015{:02d}dmin.min'.format(month): os.urandom(20000)
+    for month in (1, 2)
+}
+FETCH_ARGS = {
+    'start_date': date(2015, 1, 15),
+    'end_date': date(2015, 2, 2),
+    'station': 'ESK',
+    'cadence': 'minute',
+    'service': 'WDC',
+}
+CONTENT = make_zip(MEMBERS, zipfile.ZIP_STORED)
+ENCODED = gzip.compress(CONTENT)
+
+
+# small Mock classes can be weird
+# pylint: disable=missing-docstring, too-few-public-methods
+class RangeSession(object):
+    """
+    serves `CONTENT`, dropping the connection after `drop_after` bytes
+    on the first request; honours 'Range' if `ranges`. With `compress`
+    it compresses the body whatever we ask, and counts ranges in `ENCODED`.
+    """
+    def __init__(self, drop_after=None, ranges=True, etag='"v1"',
+                 compress=False):
+        self.drop_after = drop_after
+        self.ranges = ranges
+        self.etag = etag
+        self.compress = compress
+        self.sent = []
+
+    def post(self, url, data, headers, stream):
+        # pylint: disable=unused-argument
+        self.sent.append(headers)
+        drop_after, self.drop_after = self.drop_after, None
+        wanted = re.match(r'bytes=(\d+)-', headers.get('Range', ''))
+        encoding = {'Content-Encoding': 'gzip'} if self.compress else {}
+        if wanted and self.ranges and headers.get('If-Range') == self.etag:
+            body = ENCODED if self.compress else CONTENT
+            start = int(wanted.group(1))
+            if start >= len(body):
+                return MockResponse(b'', 416)
+            return MockResponse(body[start:], 206, dict(encoding, **{
+                'ETag': self.etag,
+                'Content-Range': 'bytes {}-{}/{}'.format(
+                    start, len(body) - 1, len(body)
+                ),
+            }), drop_after)
+        # as requests' iter_content gives it us: decoded
+        return MockResponse(CONTENT, 200, dict(encoding, ETag=self.etag),
+                            drop_after)
+# pylint: enable=missing-docstring, too-few-public-methods
+
+
+def fetch(saveroot, session, **kwargs):
+    """fetch ESK with `session`, resuming"""
+    return cws.fetch_station_data(saveroot=saveroot, session=session,
+                                  resume=True, **dict(FETCH_ARGS, **kwargs))
+
+
+def test_resumed_where_dropped(tmpdir):
+    """a retry asks only for the bytes that did not arrive"""
+    session = RangeSession(drop_after=16 * 1024)
+    events = []
+    result = fetch(str(tmpdir), session, observer=events.append,
+                   retry=RetryPolicy(sleep=lambda _: None))
+    assert result.retries == 1
+    assert 'Range' not in session.sent[0]
+    assert all(headers['Accept-Encoding'] == 'identity'
+               for headers in session.sent)
+    assert session.sent[1]['Range'] == 'bytes=16384-'
+    assert session.sent[1]['If-Range'] == '"v1"'
+    requested = [event.nbytes for event in events if event.stage == 'request']
+    assert requested == [16384, len(CONTENT) - 16384]
+    for name, content in MEMBERS.items():
+        assert tmpdir.join(name).read_binary() == content
+    # nothing left behind
+    assert sorted(os.listdir(str(tmpdir))) == sorted(MEMBERS)
+
+
+def test_resumed_by_later_call(tmpdir):
+    """the checkpoint outlives the call that was cut short"""
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        fetch(str(tmpdir), RangeSession(drop_after=8 * 1024))
+    assert len(os.listdir(str(tmpdir))) == 2
+    session = RangeSession()
+    fetch(str(tmpdir), session)
+    assert session.sent[0]['Range'] == 'bytes=8192-'
+    assert sorted(os.listdir(str(tmpdir))) == sorted(MEMBERS)
+
+
+def test_compressed_body_not_resumed(tmpdir):
+    """ranges of a body compressed in transit are not of what we wrote"""
+    session = RangeSession(drop_after=8 * 1024, compress=True)
+    result = fetch(str(tmpdir), session,
+                   retry=RetryPolicy(sleep=lambda _: None))
+    assert result.retries == 1
+    assert 'Range' not in session.sent[1]
+    for name, content in MEMBERS.items():
+        assert tmpdir.join(name).read_binary() == content
+
+    # nor is a compressed part of one, should the server change its mind
+    partial = PartialDownload(str(tmpdir), 'abc')
+    partial.nbytes = 100
+    content_range = 'bytes 100-{}/{}'.format(len(ENCODED) - 1, len(ENCODED))
+    response = MockResponse(ENCODED[100:], 206, {
+        'Content-Range': content_range, 'Content-Encoding': 'gzip'
+    })
+    assert not partial.accepts(response)
+    assert partial.nbytes == 0
+
+
+@pytest.mark.parametrize('session', [
+    RangeSession(drop_after=8 * 1024, ranges=False),
+    RangeSession(drop_after=8 * 1024, etag=None),
+])
+def test_full_fetch_if_range_ignored(tmpdir, session):
+    """a server ignoring the range, or with no validator, starts again"""
+    fetch(str(tmpdir), session, retry=RetryPolicy(sleep=lambda _: None))
+    assert len(session.sent) == 2
+    for name, content in MEMBERS.items():
+        assert tmpdir.join(name).read_binary() == content
+
+
+def test_refused_range_discarded(tmpdir):
+    """a 416 (e.g. a stale checkpoint) restarts the download at once"""
+    fingerprint = 'abc'
+    partial = PartialDownload(str(tmpdir), fingerprint)
+    with open(partial.path, 'wb') as file_:
+        file_.write(b'x' * (len(CONTENT) + 10))
+    partial.nbytes = len(CONTENT) + 10
+    partial.etag = '"v1"'
+    assert not partial.accepts(MockResponse(b'', 416))
+    assert os.listdir(str(tmpdir)) == []
+    assert partial.range_headers() == {}
+
+
+@pytest.mark.parametrize('status_code, answer_headers', [
+    (416, {}),
+    (206, {'Content-Range': 'bytes 100-199/200'}),
+])
+def test_range_always_refused(tmpdir, status_code, answer_headers):
+    """a server refusing every request is asked twice, not forever"""
+    class Refusing(RangeSession):  # pylint: disable=too-few-public-methods
+        def post(self, url, data, headers, stream):
+            self.sent.append(headers)
+            return MockResponse(b'x' * 100, status_code, answer_headers)
+
+    session = Refusing()
+    with pytest.raises(cws.InvalidResponse) as err:
+        fetch(str(tmpdir), session)
+    assert err.value.status_code == status_code
+    assert len(session.sent) == 2
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_checkpoint_trusted_so_far(tmpdir):
+    """resumed from the bytes checkpointed, for the same request only"""
+    partial = PartialDownload(str(tmpdir), 'abc')
+    assert partial.accepts(MockResponse(CONTENT, 200, {'ETag': '"v1"'}))
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        partial.receive(MockResponse(CONTENT, drop_after=4096), 1024)
+    assert partial.nbytes == 4096
+    again = PartialDownload(str(tmpdir), 'abc')
+    assert (again.nbytes, again.etag) == (4096, '"v1"')
+    # bytes written after the checkpoint are dropped
+    with open(again.path, 'ab') as file_:
+        file_.write(b'junk')
+    assert PartialDownload(str(tmpdir), 'abc').nbytes == 4096
+    assert PartialDownload(str(tmpdir), 'xyz').nbytes == 0
+    # a 206 for the wrong range is refused
+    assert not again.accepts(MockResponse(b'', 206, {
+        'Content-Range': 'bytes 0-99/100'
+    }))
+    assert os.listdir(str(tmpdir)) == []
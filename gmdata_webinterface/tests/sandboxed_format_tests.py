@@ -0,0 +1,70 @@
+"""tests for formatting strings without exposing internals"""
+import pytest
+
+from gmdata_webinterface.sandboxed_format import (
+    SafeFormatter, MagicFormatMapping, SafeTemplate, get_template,
+    safe_format
+)
+
+
+def reference_format(fmt, *args, **kwargs):
+    """the uncompiled path: a fresh formatter parsing `fmt` every time"""
+    return SafeFormatter().vformat(fmt, args,
+                                   MagicFormatMapping(args, kwargs))
+
+
+class Thing(object):  # pylint: disable=too-few-public-methods
+    """something with attributes, public and private"""
+    colour = 'blue'
+    _secret = 'hidden'
+    items = ['a', 'b']
+
+
+@pytest.mark.parametrize('fmt, args, kwargs', [
+    ('', (), {}),
+    ('no fields', (), {}),
+    ('{}-{}', ('a', 1), {}),
+    ('{1}{0}{1}', ('a', 'b'), {}),
+    ('{} {name}', ('a',), {'name': 'b'}),
+    ('esk{}{:02d}', (2015, 3), {}),
+    ('{!r} {!s:>6} {!a}', ('x', 'y', 'é'), {}),
+    ('{0.colour} {0.items[1]} {thing.items[0]}', (Thing(),),
+     {'thing': Thing()}),
+    ('{:{}}', ('x', 5), {}),
+    ('{{literal}} {}', ('x',), {}),
+    ('{.colour}', (Thing(),), {}),
+])
+def test_same_as_formatter(fmt, args, kwargs):
+    """a template renders exactly as the formatter it replaces"""
+    assert SafeTemplate(fmt).render(*args, **kwargs) == \
+        reference_format(fmt, *args, **kwargs)
+    assert safe_format(fmt, *args, **kwargs) == \
+        reference_format(fmt, *args, **kwargs)
+
+
+def test_private_attributes_refused():  # pylint: disable=invalid-name
+    """no climbing into internals, compiled or not"""
+    for fmt in ['{0._secret}', '{0.__class__}', '{.__init__.__globals__}']:
+        with pytest.raises(AttributeError):
+            safe_format(fmt, Thing())
+    with pytest.raises(AttributeError):
+        safe_format('{0.f_globals}', Thing())
+
+
+@pytest.mark.parametrize('fmt, args', [
+    ('{} {0}', ('a',)),
+    ('{0} {}', ('a',)),
+    ('{} {}', ('a',)),
+    ('{!x}', ('a',)),
+    ('{', ()),
+])
+def test_bad_formats_raise(fmt, args):
+    """the same errors as `str.format`"""
+    with pytest.raises((ValueError, IndexError)):
+        safe_format(fmt, *args)
+
+
+def test_templates_cached():
+    """a format string is parsed only once"""
+    assert get_template('{}-cached') is get_template('{}-cached')
+    assert 'cached' in repr(get_template('{}-cached'))
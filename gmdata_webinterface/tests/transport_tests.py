@@ -0,0 +1,136 @@
+"""tests for the pooled HTTP sessions shared between requests"""
+import pytest
+
+from zipfile import BadZipFile
+
+import requests
+
+from gmdata_webinterface.consume_webservices import InvalidResponse
+from gmdata_webinterface.transport import (
+    make_session, parse_retry_after, RetryPolicy, DEFAULT_POOL_SIZE
+)
+
+
+def test_make_session_defaults():
+    """pooled, keep-alive, no retries unless asked"""
+    # pylint: disable=protected-access
+    session = make_session()
+    for scheme in ('http://', 'https://'):
+        adapter = session.get_adapter(scheme + 'app.geomag.bgs.ac.uk')
+        assert adapter._pool_maxsize == DEFAULT_POOL_SIZE
+        assert adapter._pool_block
+        assert adapter.max_retries.total == 0
+    assert session.headers.get('Connection') != 'close'
+    session.close()
+
+
+def test_make_session_options():
+    """pool size, keep-alive and retries are all configurable"""
+    # pylint: disable=protected-access
+    session = make_session(pool_size=3, keep_alive=False, retries=4,
+                           backoff_factor=0.5)
+    adapter = session.get_adapter('http://app.geomag.bgs.ac.uk')
+    assert adapter._pool_maxsize == 3
+    assert adapter.max_retries.total == 4
+    # as requests' own urllib3 sees it, not wrapped as a retry count
+    retry_class = requests.packages.urllib3.util.retry.Retry
+    assert retry_class.from_int(adapter.max_retries) is adapter.max_retries
+    assert adapter.max_retries.connect == 4
+    assert adapter.max_retries.backoff_factor == 0.5
+    # the download route is a POST, so that must be retryable
+    assert adapter.max_retries.is_retry('POST', 503, False) is False
+    assert adapter.max_retries._is_method_retryable('POST')
+    assert session.headers['Connection'] == 'close'
+    session.close()
+
+
+def test_make_session_bad_options():
+    """refuse options that cannot make a working session"""
+    with pytest.raises(ValueError) as err:
+        make_session(pool_size=0)
+    assert 'pool_size' in str(err.value)
+    with pytest.raises(ValueError) as err:
+        make_session(retries=-1)
+    assert 'retries' in str(err.value)
+
+
+def test_retry_delays():
+    """exponential, capped, jittered; the server's 'Retry-After' honoured"""
+    policy = RetryPolicy(max_attempts=5, backoff=2.0, max_backoff=5.0,
+                         jitter=0)
+    busy = InvalidResponse('busy', 503)
+    assert [policy.retry_delay(attempt, busy) for attempt in range(1, 6)] \
+        == [2.0, 4.0, 5.0, 5.0, None]
+    assert policy.retry_delay(1, InvalidResponse('busy', 429, 30.0)) == 30.0
+    assert policy.retry_delay(1, InvalidResponse('gone', 404)) is None
+    assert policy.retry_delay(1, KeyError('bug')) is None
+    assert policy.retry_delay(1, requests.ConnectionError()) == 2.0
+    assert policy.retry_delay(1, BadZipFile()) == 2.0
+    jittered = RetryPolicy(backoff=2.0)
+    delays = [jittered.retry_delay(1, busy) for _ in range(100)]
+    assert all(0 < delay <= 2.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_retry_after_capped():
+    """we give up rather than wait longer than `max_delay`"""
+    policy = RetryPolicy(max_delay=60.0)
+    assert policy.retry_delay(1, InvalidResponse('busy', 503, 60.0)) == 60.0
+    assert policy.retry_delay(1, InvalidResponse('busy', 503, 7200.0)) \
+        is None
+    slept = []
+    policy = RetryPolicy(sleep=slept.append)
+
+    def hostile():
+        raise InvalidResponse('come back tomorrow', 503, 86400.0)
+
+    with pytest.raises(InvalidResponse):
+        policy.call(hostile)
+    assert slept == []
+
+
+def test_with_errors():
+    """other errors can be made retryable, leaving the original be"""
+    policy = RetryPolicy(jitter=0)
+    extended = policy.with_errors(KeyError, BadZipFile)
+    assert extended.retry_delay(1, KeyError('flaky')) == 1.0
+    assert extended.retry_delay(1, BadZipFile()) == 1.0
+    assert extended.errors.count(BadZipFile) == 1
+    assert policy.retry_delay(1, KeyError('flaky')) is None
+    assert extended.max_attempts == policy.max_attempts
+
+
+def test_retry_call():
+    """retried until it works, the waits slept and reported"""
+    outcomes = [InvalidResponse('busy', 503, 0.5),
+                requests.Timeout(), 'done']
+    slept, told = [], []
+
+    def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    policy = RetryPolicy(backoff=0.25, jitter=0, sleep=slept.append)
+    assert policy.call(flaky, lambda err, delay: told.append(delay)) == \
+        ('done', 2)
+    assert slept == told == [0.5, 0.5]
+
+    outcomes = [InvalidResponse('busy', 503)] * 3
+    with pytest.raises(InvalidResponse):
+        policy.call(flaky)
+    assert not outcomes
+    with pytest.raises(ValueError) as err:
+        RetryPolicy(max_attempts=0)
+    assert 'max_attempts' in str(err.value)
+
+
+def test_parse_retry_after():
+    """seconds or an HTTP date"""
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    now = 1445412480.0  # Wed, 21 Oct 2015 07:28:00 GMT
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:30 GMT', now) == 30.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:27:00 GMT', now) == 0.0
@@ -0,0 +1,264 @@
+"""
+transport module
+
+Pooled HTTP sessions shared by every request we send to a webservice,
+so that a multi-station job reuses a small set of keep-alive connections
+rather than opening a new TCP/TLS connection for each station.
+
+`RetryPolicy` retries whole requests that fail transiently, e.g. with the
+500 the server returns when it is misbehaving.
+
+@author: W. Brown
+"""
+import copy
+import random
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from zipfile import BadZipFile
+
+import requests as rq
+from requests.adapters import HTTPAdapter
+# requests' own urllib3: older releases vendor a copy, whose HTTPAdapter
+#   only recognises its own Retry
+# pylint: disable=import-error
+from requests.packages.urllib3.util.retry import Retry
+# pylint: enable=import-error
+
+from gmdata_webinterface.sandboxed_format import safe_format
+
+DEFAULT_POOL_SIZE = 10
+# longest `RetryPolicy` will wait, whatever 'Retry-After' asks for
+DEFAULT_MAX_DELAY = 300.0
+# too many requests, or the server (or a proxy in front of it) misbehaving
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# failures to connect or to receive the whole response
+RETRY_ERRORS = (rq.ConnectionError, rq.Timeout,
+                rq.exceptions.ChunkedEncodingError, BadZipFile)
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE, keep_alive=True, retries=0,
+                 backoff_factor=0.0):
+    """
+    Build a `requests.Session` with a bounded connection pool,
+    for sharing between `DataRequest.send` and `fetch_data` calls.
+
+    Parameters
+    ----------
+    pool_size: int, default `DEFAULT_POOL_SIZE`
+        most connections kept open to any one host. Requests beyond
+        this wait for a pooled connection, rather than opening more.
+    keep_alive: bool, default `True`
+        reuse connections between requests. If `False`, ask the server
+        to close each connection once its response has been sent.
+    retries: int, default 0
+        how many times to retry a request that failed to connect
+        or whose response could not be read
+    backoff_factor: float, default 0.0
+        sleep for `backoff_factor * 2 ** (retry number - 1)` seconds
+        between retries
+
+    Returns
+    -------
+    `requests.Session` ready to `post` requests
+
+    Raises
+    ------
+    ValueError if `pool_size` is less than 1 or `retries` is negative
+    """
+    if pool_size < 1:
+        raise ValueError(safe_format('pool_size must be >= 1, not {}',
+                                     pool_size))
+    if retries < 0:
+        raise ValueError(safe_format('retries must be >= 0, not {}',
+                                     retries))
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=_build_retry(retries, backoff_factor)
+    )
+    session = rq.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def _build_retry(retries, backoff_factor):
+    """
+    `Retry` for connection and read failures on any HTTP method:
+    the download route is a POST, which urllib3 won't retry by default
+    """
+    kwargs = {
+        'total': retries,
+        'connect': retries,
+        'read': retries,
+        'status': 0,
+        'backoff_factor': backoff_factor,
+        'raise_on_status': False,
+    }
+    try:
+        return Retry(allowed_methods=None, **kwargs)
+    except TypeError:  # urllib3 < 1.26 spells it differently
+        return Retry(method_whitelist=False, **kwargs)
+
+
+class RetryPolicy(object):
+    """
+    When, and after how long, to try a failed request again.
+
+    Waits grow exponentially with each attempt, up to `max_backoff`, with
+    random jitter so that many clients failing together do not retry in
+    step. A 'Retry-After' from the server is honoured instead, up to
+    `max_delay`.
+
+    Parameters
+    ----------
+    max_attempts: int, default 3
+        most times to try a request, including the first
+    backoff: float, default 1.0
+        seconds to wait before the first retry; doubled for each after
+    max_backoff: float, default 60.0
+        longest wait between attempts, bar any 'Retry-After'
+    max_delay: float, default `DEFAULT_MAX_DELAY`
+        longest wait a 'Retry-After' may ask for; if the server asks
+        us to wait any longer we give up rather than sleep
+    jitter: float, default 1.0
+        fraction of each wait which is random: 0 for none, 1 for a
+        uniformly random wait up to the backoff ("full jitter")
+    status_codes: iterable of int, default `RETRY_STATUS_CODES`
+        HTTP status codes worth retrying
+    errors: tuple of Exception types, default `RETRY_ERRORS`
+        errors worth retrying, other than bad status codes;
+        see also `with_errors`
+    sleep: callable, default `time.sleep`
+        waits for a number of seconds
+
+    Raises
+    ------
+    ValueError if `max_attempts` is less than 1
+    """
+    def __init__(self, max_attempts=3, backoff=1.0, max_backoff=60.0,
+                 max_delay=DEFAULT_MAX_DELAY, jitter=1.0,
+                 status_codes=RETRY_STATUS_CODES, errors=RETRY_ERRORS,
+                 sleep=time.sleep):
+        """ see class docstring """
+        if max_attempts < 1:
+            raise ValueError(safe_format('max_attempts must be >= 1, not {}',
+                                         max_attempts))
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.status_codes = frozenset(status_codes)
+        self.errors = tuple(errors)
+        self.sleep = sleep
+
+    def __repr__(self):
+        return safe_format('{}(max_attempts={}, backoff={}, max_backoff={})',
+                           self.__class__.__name__, self.max_attempts,
+                           self.backoff, self.max_backoff)
+
+    def retry_delay(self, attempt, error):
+        """
+        How long to wait before trying again, after attempt number
+        `attempt` (from 1) failed with `error`
+
+        Returns
+        -------
+        float seconds, or `None` if we should not try again, including
+            when the server asks us to wait longer than `max_delay`
+        """
+        if attempt >= self.max_attempts or not self.is_retryable(error):
+            return None
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def with_errors(self, *errors):
+        """
+        A copy of this policy which also retries `errors`,
+        e.g. the failures of an HTTP client other than requests
+
+        Returns
+        -------
+        `RetryPolicy`
+        """
+        policy = copy.copy(self)
+        policy.errors = self.errors + tuple(
+            error for error in errors if error not in self.errors
+        )
+        return policy
+
+    def is_retryable(self, error):
+        """is `error` worth trying again?"""
+        status_code = getattr(error, 'status_code', None)
+        if status_code is None and isinstance(error, rq.HTTPError):
+            status_code = getattr(error.response, 'status_code', None)
+        if status_code is not None:
+            return status_code in self.status_codes
+        return isinstance(error, self.errors)
+
+    def call(self, func, on_retry=None):
+        """
+        Call `func()` until it succeeds, or fails in a way not worth
+        retrying, or `max_attempts` run out
+
+        Parameters
+        ----------
+        func: callable taking no arguments
+        on_retry: callable or (default) `None`
+            called with the error and the wait before each retry
+
+        Returns
+        -------
+        tuple of what `func` returned and how many retries it took
+
+        Raises
+        ------
+        whatever `func` raised on the last attempt
+        """
+        attempt = 1
+        while True:
+            try:
+                return func(), attempt - 1
+            except Exception as err:  # pylint: disable=broad-except
+                delay = self.retry_delay(attempt, err)
+                if delay is None:
+                    raise
+                if on_retry is not None:
+                    on_retry(err, delay)
+                self.sleep(delay)
+                attempt += 1
+
+
+def parse_retry_after(value, now=None):
+    """
+    Seconds to wait given the value of a 'Retry-After' header:
+    either seconds, or an HTTP date
+
+    Returns
+    -------
+    float seconds (never negative), or `None` if `value` is missing
+        or cannot be read
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:  # '-0000' is UTC too
+        when = when.replace(tzinfo=timezone.utc)
+    when = when.timestamp()
+    now = time.time() if now is None else now
+    return max(0.0, when - now)
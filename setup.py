@@ -47,9 +47,16 @@ setup(
                       "sphinx>=1.5.1, <2.0"],
     extras_require={"develop": ["ipython==5.1.0",
                                 "flake8==3.3.0",
+                                "hypothesis==3.44.1",
                                 "pylint==1.6.4",
                                 "pytest==3.0.5",
                                 "pytest-cov==2.3.1",
-                                "sphinx==1.5.1"]},
+                                "sphinx==1.5.1"],
+                    "readers": ["numpy>=1.13"],
+                    "async": ["aiohttp>=3.0"],
+                    "yaml": ["PyYAML>=3.12"]},
+    entry_points={"console_scripts": [
+        "gmdata-fetch=gmdata_webinterface.cli:main",
+    ]},
 )
 